@@ -2,6 +2,7 @@ from contextlib import asynccontextmanager
 import logging
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 
 # load environment variables
 from dotenv import load_dotenv
@@ -15,16 +16,34 @@ from app.utils.logger import get_logger
 logger = get_logger(__name__)
 
 # Import database to initialize connection and tables
-from app.utils.database import Base, engine, init_models
+from app.utils.database import Base, engine, init_models, pool_stats
 from app.models import *
 
 
 def create_app():
+    from app.utils.metrics import CONTENT_TYPE, MetricsMiddleware, render
+    from app.utils.completions import completion_cache
+    from app.utils.executor import get_cpu_pool
+    from app.utils.persistence import message_writer
+    from app.utils.tokens import revoked_tokens
+    from app.utils.unlock import get_unlock_store
+    from app.utils.tracing import QueryTraceMiddleware, install_query_tracing
+
     @asynccontextmanager
     async def lifespan(app: FastAPI):
         await init_models()
+        message_writer.start()
+        revoked_tokens.start()
+        get_unlock_store().start()
+        completion_cache.start()
         yield
+        await completion_cache.stop()
+        await get_unlock_store().stop()
+        await revoked_tokens.stop()
+        # Drain queued messages before the pool goes away
+        await message_writer.stop()
         await engine.dispose()
+        get_cpu_pool().shutdown()
 
     app = FastAPI(lifespan=lifespan)
 
@@ -35,11 +54,27 @@ def create_app():
         allow_methods=["*"],
         allow_headers=["*"],
     )
+    app.add_middleware(QueryTraceMiddleware)
+    app.add_middleware(MetricsMiddleware)
+    install_query_tracing(engine)
 
     @app.get("/status")
     def read_root():
         return {"message": "Success"}
 
+    @app.get("/status/persistence")
+    def persistence_status():
+        return message_writer.stats()
+
+    @app.get("/status/pool")
+    def pool_status():
+        return pool_stats()
+
+    # async so rendering runs on the event loop, never concurrently with updates
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        return PlainTextResponse(render(), media_type=CONTENT_TYPE)
+
     from app.views.auth import auth_router
     from app.views.conversation import conversation_router
     from app.views.qa import qa_router
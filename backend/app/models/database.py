@@ -27,6 +27,38 @@ class UserKeys(Base):
     updated_at = Column(DateTime, default=datetime.now)
 
 
+class UnlockSession(Base):
+    """
+    Shared /keys unlock sessions (UNLOCK_STORE=database). wrapped_key is the
+    key derived from the user's password, encrypted under UNLOCK_SERVER_KEY.
+    """
+
+    __tablename__ = "unlock_sessions"
+    email = Column(String, ForeignKey("users.email"), primary_key=True)
+    wrapped_key = Column(String, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+class RevokedToken(Base):
+    """Logged-out JWTs, by SHA-256 digest, until they would have expired."""
+
+    __tablename__ = "revoked_tokens"
+    token_digest = Column(String, primary_key=True)
+    expires_at = Column(DateTime, nullable=False, index=True)
+    revoked_at = Column(DateTime, default=datetime.now)
+
+
+class CompletionCacheEntry(Base):
+    """Persistent tier of the completion cache, keyed by request hash."""
+
+    __tablename__ = "completion_cache"
+    key = Column(String, primary_key=True)
+    model = Column(String, nullable=False)
+    response = Column(String, nullable=False)
+    created_at = Column(DateTime, default=datetime.now, index=True)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
 class Conversation(Base):
     __tablename__ = "conversations"
     id = Column(String, primary_key=True)
@@ -37,12 +69,17 @@ class Conversation(Base):
         "Message",
         back_populates="conversation",
         order_by="Message.created_at.asc()",
-        lazy="selectin",
+        # never load history implicitly; use selectinload() where it is needed
+        lazy="raise",
     )
     hidden = Column(Boolean, default=False)
     created_at = Column(DateTime, default=datetime.now)
     updated_at = Column(DateTime, default=datetime.now)
 
+    __table_args__ = (
+        Index("idx_conversations_user_updated", "user_email", "updated_at", "id"),
+    )
+
 
 class Message(Base):
     __tablename__ = "messages"
@@ -53,7 +90,8 @@ class Message(Base):
     content = Column(String, nullable=False)
     created_at = Column(DateTime, default=datetime.now)
 
-    # tsvector index for full-text search
+    # tsvector index for full-text search, computed by the
+    # messages_content_tsv_trigger (see app/utils/migrations.py); never set it
     content_tsv = Column(TSVECTOR)
 
     __table_args__ = (
@@ -1,26 +1,283 @@
+import asyncio
+import base64
 import hashlib
+import hmac
+import os
 import uuid
+from datetime import datetime
+from typing import Optional
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import event, select, update
+from sqlalchemy.orm import Session
 
+from app import logger
 from app.models.database import User
+from app.utils.cache import TTLCache
+from app.utils.executor import run_cpu
 
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))  # seconds
 
-def hash_password(password: str, salt: str = "") -> str:
-    """Hash a password using SHA256."""
+
+class UserCache:
+    """
+    Cache of User rows keyed by email, for handlers that already know who
+    the caller is from a verified token. Concurrent misses for the same email
+    share one query. Cached users are detached from any session; treat them
+    as read-only and merge() them into a session before modifying.
+
+    Each worker has its own cache and commits only invalidate the local one,
+    so another worker may serve a changed user for up to USER_CACHE_TTL.
+    That is why credentials are never checked against it (see
+    verify_password).
+    """
+
+    def __init__(self, maxsize: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL):
+        self._cache = TTLCache(maxsize, ttl, name="users")
+        self._loading: dict[str, asyncio.Future] = {}
+
+    async def get(self, email: str, db: AsyncSession) -> Optional[User]:
+        user = self._cache.get(email)
+        if user is not None:
+            return user
+
+        loading = self._loading.get(email)
+        if loading is not None:
+            try:
+                return await asyncio.shield(loading)
+            except asyncio.CancelledError:
+                if not loading.cancelled():
+                    raise
+                # The request that was loading it went away; load it ourselves
+
+        loading = self._loading[email] = asyncio.get_running_loop().create_future()
+        try:
+            result = await db.execute(select(User).filter(User.email == email))
+            user = result.scalar_one_or_none()
+            if user is not None:
+                db.expunge(user)
+                # Skip the put if an invalidation arrived while we were loading
+                if self._loading.get(email) is loading:
+                    self._cache.put(email, user)
+            loading.set_result(user)
+            return user
+        except Exception as e:
+            loading.set_exception(e)
+            # Nobody may be waiting; don't log "exception never retrieved"
+            loading.exception()
+            raise
+        finally:
+            if not loading.done():
+                loading.cancel()
+            if self._loading.get(email) is loading:
+                del self._loading[email]
+
+    def invalidate(self, email: str):
+        self._cache.invalidate(email)
+        self._loading.pop(email, None)
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+
+user_cache = UserCache() if USER_CACHE_SIZE > 0 else None
+
+
+async def get_user(email: str, db: AsyncSession) -> Optional[User]:
+    """Look up a user by email, through the user cache when it is enabled."""
+    if user_cache is not None:
+        return await user_cache.get(email, db)
+    result = await db.execute(select(User).filter(User.email == email))
+    return result.scalar_one_or_none()
+
+
+# Any committed insert, update or delete of a User row invalidates its cache
+# entry, so password changes and deletions take effect on the next request
+@event.listens_for(Session, "after_flush")
+def _collect_changed_users(session, flush_context):
+    emails = session.info.setdefault("changed_user_emails", set())
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, User):
+            emails.add(obj.email)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_changed_users(session):
+    emails = session.info.pop("changed_user_emails", None)
+    if emails and user_cache is not None:
+        for email in emails:
+            user_cache.invalidate(email)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_changed_users(session, previous_transaction):
+    session.info.pop("changed_user_emails", None)
+
+
+# Password hashes are stored as "$"-separated strings naming their scheme and
+# cost, so parameters can be raised later and old hashes recognised:
+#   scrypt$<n>$<r>$<p>$<salt>$<hash>
+#   pbkdf2_sha256$<iterations>$<salt>$<hash>
+# Hashes without a "$" are the legacy single SHA-256 round, salted from
+# User.salt. Any hash not in the current scheme and cost is replaced on the
+# next successful login.
+PASSWORD_HASHER = os.getenv("PASSWORD_HASHER", "scrypt")
+SCRYPT_N = int(os.getenv("SCRYPT_N", "16384"))
+SCRYPT_R = int(os.getenv("SCRYPT_R", "8"))
+SCRYPT_P = int(os.getenv("SCRYPT_P", "1"))
+PBKDF2_ITERATIONS = int(os.getenv("PBKDF2_ITERATIONS", "600000"))
+# Hashes running at once; later logins wait their turn
+PASSWORD_HASH_CONCURRENCY = int(os.getenv("PASSWORD_HASH_CONCURRENCY", "2"))
+HASH_SALT_BYTES = 16
+
+PASSWORD_HASHERS = ("scrypt", "pbkdf2_sha256")
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.b64encode(data).decode().rstrip("=")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.b64decode(data + "=" * (-len(data) % 4))
+
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    # scrypt needs about 128 * n * r bytes; hashlib's default cap is 32MB
+    return hashlib.scrypt(
+        password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r, dklen=32
+    )
+
+
+def _pbkdf2(password: str, salt: bytes, iterations: int) -> bytes:
+    return hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+
+
+def legacy_hash_password(password: str, salt: str = "") -> str:
+    """Hash a password using a single SHA256 round (legacy format)."""
     return hashlib.sha256((password + salt).encode()).hexdigest()
 
 
+def make_password_hash(password: str, hasher: Optional[str] = None, **params) -> str:
+    """
+    Hash a password in the configured (or given) scheme. CPU-bound; async
+    code should use hash_password instead. params override the configured
+    cost, e.g. n=32768 or iterations=1000000.
+    """
+    hasher = hasher or PASSWORD_HASHER
+    salt = os.urandom(HASH_SALT_BYTES)
+    if hasher == "scrypt":
+        n = params.get("n", SCRYPT_N)
+        r = params.get("r", SCRYPT_R)
+        p = params.get("p", SCRYPT_P)
+        digest = _scrypt(password, salt, n, r, p)
+        return f"scrypt${n}${r}${p}${_b64encode(salt)}${_b64encode(digest)}"
+    if hasher == "pbkdf2_sha256":
+        iterations = params.get("iterations", PBKDF2_ITERATIONS)
+        digest = _pbkdf2(password, salt, iterations)
+        return f"pbkdf2_sha256${iterations}${_b64encode(salt)}${_b64encode(digest)}"
+    raise ValueError(f"Unknown PASSWORD_HASHER: {hasher}")
+
+
+def check_password_hash(password: str, stored: str, legacy_salt: str = "") -> bool:
+    """Check a password against a stored hash in any supported format."""
+    if "$" not in stored:
+        expected = legacy_hash_password(password, legacy_salt)
+        return hmac.compare_digest(expected, stored)
+
+    scheme, *fields = stored.split("$")
+    try:
+        if scheme == "scrypt":
+            n, r, p, salt, digest = fields
+            actual = _scrypt(password, _b64decode(salt), int(n), int(r), int(p))
+        elif scheme == "pbkdf2_sha256":
+            iterations, salt, digest = fields
+            actual = _pbkdf2(password, _b64decode(salt), int(iterations))
+        else:
+            return False
+    except ValueError:
+        return False
+    return hmac.compare_digest(actual, _b64decode(digest))
+
+
+def needs_rehash(stored: str) -> bool:
+    """True if a stored hash is not in the current scheme and cost."""
+    scheme, *fields = stored.split("$")
+    if scheme != PASSWORD_HASHER:
+        return True
+    if scheme == "scrypt":
+        return fields[:3] != [str(SCRYPT_N), str(SCRYPT_R), str(SCRYPT_P)]
+    return fields[0] != str(PBKDF2_ITERATIONS)
+
+
+_hash_slots: Optional[asyncio.Semaphore] = None
+
+
+async def _run_hash(func, *args):
+    """Run a hashing call on the CPU pool, at most PASSWORD_HASH_CONCURRENCY at once."""
+    global _hash_slots
+    if _hash_slots is None:
+        _hash_slots = asyncio.Semaphore(PASSWORD_HASH_CONCURRENCY)
+    async with _hash_slots:
+        return await run_cpu(func, *args)
+
+
+async def hash_password(password: str) -> str:
+    """Hash a password in the current scheme, off the event loop."""
+    return await _run_hash(make_password_hash, password)
+
+
+async def check_password(password: str, stored: str, legacy_salt: str = "") -> bool:
+    """Check a password against a stored hash, off the event loop."""
+    return await _run_hash(check_password_hash, password, stored, legacy_salt)
+
+
+# Checked against when the email is unknown, so a login for a missing user
+# costs the same as one for a real user
+_dummy_hash: Optional[str] = None
+
+
 async def verify_password(email: str, password: str, db: AsyncSession) -> bool:
-    """Verify a password against the stored hash."""
-    # Query user from database
+    """
+    Verify a password against the stored hash. On success, a hash in an old
+    scheme or cost is replaced with one in the current scheme.
+    """
+    global _dummy_hash
+    # Read the hash from the database, not the per-worker user cache, so a
+    # password changed through another worker stops working right away
     result = await db.execute(select(User).filter(User.email == email))
     user = result.scalar_one_or_none()
 
-    if user:
-        password_hash = hash_password(password, user.salt)
-        return user.password_hash == password_hash
-    return False
+    if not user:
+        if _dummy_hash is None:
+            _dummy_hash = await hash_password(str(uuid.uuid4()))
+        await check_password(password, _dummy_hash)
+        return False
+
+    if not await check_password(password, user.password_hash, user.salt):
+        return False
+
+    if needs_rehash(user.password_hash):
+        try:
+            await upgrade_password_hash(user, password, db)
+        except Exception as e:
+            # The login itself succeeded; try again next time
+            logger.error(f"Password rehash for {email} failed: {str(e)}")
+    return True
+
+
+async def upgrade_password_hash(user: User, password: str, db: AsyncSession):
+    """Replace a user's stored hash with one in the current scheme."""
+    new_hash = await hash_password(password)
+    # Conditional on the old hash so a concurrent password change wins
+    await db.execute(
+        update(User)
+        .where(User.email == user.email, User.password_hash == user.password_hash)
+        .values(password_hash=new_hash, salt="", updated_at=datetime.now())
+    )
+    await db.commit()
+    # A Core UPDATE bypasses the session hooks that normally invalidate it
+    if user_cache is not None:
+        user_cache.invalidate(user.email)
 
 
 async def create_user(email: str, password: str, db: AsyncSession) -> User:
@@ -31,13 +288,11 @@ async def create_user(email: str, password: str, db: AsyncSession) -> User:
     if existing_user:
         raise ValueError("Email already exists")
 
-    # Create new user
-    salt = str(uuid.uuid4())
-    password_hash = hash_password(password, salt)
+    # Create new user; the salt lives inside the hash string now
     user = User(
         email=email,
-        password_hash=hash_password(password, salt),
-        salt=salt,
+        password_hash=await hash_password(password),
+        salt="",
     )
     db.add(user)
     await db.commit()
@@ -0,0 +1,105 @@
+"""
+Bounded in-process caches.
+TTLCache is an LRU map whose entries also expire, either after the cache's
+default ttl or at a per-entry deadline. Named caches report their size, hits
+and misses on /metrics.
+"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from app.utils.metrics import CallbackCounter, CallbackGauge
+
+_caches: dict[str, "TTLCache"] = {}
+
+
+class TTLCache:
+    def __init__(self, maxsize: int, ttl: float, name: Optional[str] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # key -> (monotonic deadline, value), least recently used first
+        self._entries: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if name:
+            _caches[name] = self
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        if entry[0] <= time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Store value for ttl seconds (the cache default if None)."""
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            self._entries.pop(key, None)
+            return
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def purge(self) -> int:
+        """Drop expired entries now rather than on access; returns how many."""
+        now = time.monotonic()
+        expired = [key for key, (deadline, _) in self._entries.items() if deadline <= now]
+        for key in expired:
+            del self._entries[key]
+        return len(expired)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+CallbackGauge(
+    "cache_entries",
+    "Entries held by each named in-process cache.",
+    lambda: {(name,): len(cache) for name, cache in _caches.items()},
+    ("cache",),
+)
+CallbackGauge(
+    "cache_hit_ratio",
+    "Lifetime hit ratio of each named in-process cache.",
+    lambda: {(name,): cache.stats()["hit_rate"] for name, cache in _caches.items()},
+    ("cache",),
+)
+CallbackCounter(
+    "cache_requests_total",
+    "Lookups served by each named in-process cache, by result.",
+    lambda: {
+        key: value
+        for name, cache in _caches.items()
+        for key, value in (((name, "hit"), cache.hits), ((name, "miss"), cache.misses))
+    },
+    ("cache", "result"),
+)
@@ -0,0 +1,226 @@
+"""
+Checkpoints of streamed answers, so an interrupted /ws query can be resumed.
+An answer is generated into its checkpoint, detached from the connection
+that asked, and stored as numbered chunks (seq 1, 2, ...). Connections send
+the chunks on as they arrive, so a client that lost its socket reconnects
+with {"type": "resume", "query_id": ..., "last_seq": n} and receives what it
+missed, then the rest live. An answer whose stream failed or was cancelled
+is generated on from its partial text.
+
+Checkpoints live in the worker that generated them. An untouched checkpoint
+expires after STREAM_CHECKPOINT_TTL seconds. The least recently active ones
+are evicted beyond STREAM_CHECKPOINT_SIZE checkpoints or
+STREAM_CHECKPOINT_MAX_BYTES of text in total.
+"""
+
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from app.utils.metrics import CallbackGauge
+
+STREAM_CHECKPOINT_SIZE = int(os.getenv("STREAM_CHECKPOINT_SIZE", "1000"))
+STREAM_CHECKPOINT_TTL = float(os.getenv("STREAM_CHECKPOINT_TTL", "600"))  # seconds
+STREAM_CHECKPOINT_MAX_BYTES = int(
+    os.getenv("STREAM_CHECKPOINT_MAX_BYTES", str(64 * 1024 * 1024))
+)
+
+STREAMING = "streaming"
+DONE = "done"
+# Stream failed or cancelled; the partial answer can be generated on
+INTERRUPTED = "interrupted"
+# Ended before generating anything, e.g. an unknown conversation
+FAILED = "failed"
+
+
+class StreamCheckpoint:
+    def __init__(
+        self,
+        query_id: str,
+        user_email: str,
+        conversation_id: str,
+        messages: Optional[list[dict]] = None,
+    ):
+        self.query_id = query_id
+        self.user_email = user_email
+        self.conversation_id = conversation_id
+        # The request the answer is generated for, to continue it later
+        self.messages = messages
+        # Chunk seq n is parts[n - 1]
+        self.parts: list[str] = []
+        self.size = 0  # UTF-8 bytes
+        self.status = STREAMING
+        self.error: Optional[str] = None
+        self.cancelled = False
+        # Place in the LLM scheduler's queue while waiting for a slot
+        self.position: Optional[int] = None
+        # Assistant message saved for this answer, once there is one
+        self.message_id: Optional[str] = None
+        # Bumped on every change, see wait()
+        self.version = 0
+        self.store: Optional["CheckpointStore"] = None
+        self._changed = asyncio.Event()
+
+    @property
+    def seq(self) -> int:
+        """Number of the last chunk."""
+        return len(self.parts)
+
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    def restart(self):
+        """Mark the answer as streaming again, before (re)generating it."""
+        self.error = None
+        self.cancelled = False
+        self.position = None
+        self.finish(STREAMING)
+
+    def append(self, text: str):
+        self.parts.append(text)
+        size = len(text.encode())
+        self.size += size
+        self._notify(size)
+
+    def set_position(self, position: int):
+        self.position = position
+        self._notify()
+
+    def finish(self, status: str):
+        self.status = status
+        self._notify()
+
+    def fail(self, error: str):
+        self.error = error
+        self.finish(FAILED)
+
+    def chunks_after(self, seq: int) -> list[tuple[int, str]]:
+        return list(enumerate(self.parts[seq:], start=seq + 1))
+
+    def since(self, offset: int) -> tuple[int, int, str]:
+        """
+        Text after the first offset bytes, with the offset used and the seq
+        the text runs up to. An offset inside a multi-byte character moves
+        back to its start.
+        """
+        data = self.text().encode()
+        offset = max(0, min(offset, len(data)))
+        while 0 < offset < len(data) and data[offset] & 0xC0 == 0x80:
+            offset -= 1
+        return offset, self.seq, data[offset:].decode()
+
+    def _notify(self, grew: int = 0):
+        self.version += 1
+        self._changed.set()
+        self._changed = asyncio.Event()
+        if self.store is not None:
+            self.store.touch(self, grew)
+
+    async def wait(self, version: int):
+        """Wait until the checkpoint changes after version was read."""
+        while self.version == version:
+            await self._changed.wait()
+
+
+# (user email, query_id)
+CheckpointKey = tuple[str, str]
+
+
+class CheckpointStore:
+    def __init__(
+        self,
+        maxsize: int = STREAM_CHECKPOINT_SIZE,
+        ttl: float = STREAM_CHECKPOINT_TTL,
+        max_bytes: int = STREAM_CHECKPOINT_MAX_BYTES,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        # (user email, query_id) -> (monotonic deadline, checkpoint), least
+        # recently active first; every change restarts the ttl, so this is also
+        # deadline order. query_ids are chosen by clients, so one user's can't
+        # replace another's
+        self._entries: "OrderedDict[CheckpointKey, tuple[float, StreamCheckpoint]]" = (
+            OrderedDict()
+        )
+        self.bytes = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def create(
+        self,
+        query_id: str,
+        user_email: str,
+        conversation_id: str,
+        messages: Optional[list[dict]] = None,
+    ) -> StreamCheckpoint:
+        key = (user_email, query_id)
+        self._remove(key)
+        checkpoint = StreamCheckpoint(query_id, user_email, conversation_id, messages)
+        checkpoint.store = self
+        self._entries[key] = (time.monotonic() + self.ttl, checkpoint)
+        self._trim()
+        return checkpoint
+
+    def get(self, query_id: str, user_email: str) -> Optional[StreamCheckpoint]:
+        """The user's checkpoint for query_id, if this worker still has it."""
+        self._trim()
+        entry = self._entries.get((user_email, query_id))
+        return entry[1] if entry is not None else None
+
+    def touch(self, checkpoint: StreamCheckpoint, grew: int = 0):
+        """Restart a changed checkpoint's ttl and count the bytes it grew by."""
+        key = (checkpoint.user_email, checkpoint.query_id)
+        entry = self._entries.get(key)
+        if entry is None or entry[1] is not checkpoint:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, checkpoint)
+        self._entries.move_to_end(key)
+        self.bytes += grew
+        if grew:
+            self._trim()
+
+    def _remove(self, key: CheckpointKey):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1].size
+            # An answer still generating carries on; it just can't be resumed
+            entry[1].store = None
+
+    def _trim(self):
+        now = time.monotonic()
+        while self._entries:
+            key, (deadline, _) = next(iter(self._entries.items()))
+            if deadline > now:
+                if len(self._entries) <= self.maxsize and self.bytes <= self.max_bytes:
+                    break
+                self.evictions += 1
+            self._remove(key)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "evictions": self.evictions,
+        }
+
+
+checkpoints = CheckpointStore()
+
+CallbackGauge(
+    "stream_checkpoints",
+    "Resumable answers held by this worker.",
+    lambda: len(checkpoints),
+)
+CallbackGauge(
+    "stream_checkpoint_bytes",
+    "Text held by this worker's resumable answers, in bytes.",
+    lambda: checkpoints.bytes,
+)
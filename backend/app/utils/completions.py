@@ -0,0 +1,241 @@
+"""
+Exact-match completion cache.
+Responses are stored under a hash of the normalized request (model,
+instructions, messages and parameters such as reasoning effort), so a
+question that was answered before is replayed instead of paying for the
+model again. Opt-in with COMPLETION_CACHE:
+- "off" (default)
+- "memory": a per-worker LRU of COMPLETION_CACHE_SIZE responses
+- "database": the same LRU in front of the completion_cache table, shared by
+  every worker and trimmed to COMPLETION_CACHE_DB_MAX_ENTRIES by a
+  background sweep
+Entries expire after COMPLETION_CACHE_TTL seconds. Only requests of at most
+COMPLETION_CACHE_MAX_MESSAGES messages are cached (0: any length); the
+default of 1 covers first-turn questions, which are the ones that repeat.
+"""
+
+import asyncio
+import os
+import re
+from contextlib import aclosing
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import delete, select, text
+from sqlalchemy.dialects.postgresql import insert
+
+from app import logger
+from app.models.database import CompletionCacheEntry
+from app.utils.cache import TTLCache
+from app.utils.database import SessionLocal
+from app.utils.llm import INSTRUCTIONS, LLMEvent, LLMProvider, request_key
+from app.utils.metrics import Counter
+
+COMPLETION_CACHE = os.getenv("COMPLETION_CACHE", "off")
+COMPLETION_CACHE_SIZE = int(os.getenv("COMPLETION_CACHE_SIZE", "1000"))
+COMPLETION_CACHE_TTL = float(os.getenv("COMPLETION_CACHE_TTL", "86400"))  # seconds
+COMPLETION_CACHE_DB_MAX_ENTRIES = int(
+    os.getenv("COMPLETION_CACHE_DB_MAX_ENTRIES", "100000")
+)
+COMPLETION_CACHE_MAX_MESSAGES = int(os.getenv("COMPLETION_CACHE_MAX_MESSAGES", "1"))
+COMPLETION_CACHE_SWEEP_SECONDS = float(
+    os.getenv("COMPLETION_CACHE_SWEEP_SECONDS", "300")
+)
+
+COMPLETION_CACHE_TIERS = ("off", "memory", "database")
+
+# Cached responses are replayed as deltas of about this many characters
+REPLAY_CHUNK_CHARS = 64
+
+completion_cache_lookups = Counter(
+    "completion_cache_lookups_total",
+    "Completion cache lookups by result: memory_hit, database_hit or miss.",
+    ("result",),
+)
+memory_hits = completion_cache_lookups.labels("memory_hit")
+database_hits = completion_cache_lookups.labels("database_hit")
+misses = completion_cache_lookups.labels("miss")
+
+
+def replay_chunks(response: str) -> list[str]:
+    """Split a cached response into word-aligned deltas."""
+    chunks, current = [], ""
+    # Each word with the space before it; trailing space as its own piece
+    for word in re.findall(r"\s*\S+|\s+$", response):
+        if current and len(current) + len(word) > REPLAY_CHUNK_CHARS:
+            chunks.append(current)
+            current = ""
+        current += word
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class CompletionCache:
+    def __init__(
+        self,
+        tier: str = COMPLETION_CACHE,
+        maxsize: int = COMPLETION_CACHE_SIZE,
+        ttl: float = COMPLETION_CACHE_TTL,
+        db_max_entries: int = COMPLETION_CACHE_DB_MAX_ENTRIES,
+        sweep_interval: float = COMPLETION_CACHE_SWEEP_SECONDS,
+    ):
+        if tier not in COMPLETION_CACHE_TIERS:
+            raise ValueError(f"Unknown COMPLETION_CACHE: {tier}")
+        self.tier = tier
+        self.ttl = ttl
+        self.db_max_entries = db_max_entries
+        self.sweep_interval = sweep_interval
+        self._memory = TTLCache(maxsize, ttl, name="completions")
+        self._writes: set[asyncio.Task] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.tier != "off"
+
+    async def get(self, key: str) -> Optional[str]:
+        response = self._memory.get(key)
+        if response is not None:
+            memory_hits.inc()
+            return response
+        if self.tier == "database":
+            async with SessionLocal() as db:
+                result = await db.execute(
+                    select(
+                        CompletionCacheEntry.response, CompletionCacheEntry.expires_at
+                    ).where(
+                        CompletionCacheEntry.key == key,
+                        CompletionCacheEntry.expires_at > datetime.now(),
+                    )
+                )
+                row = result.one_or_none()
+            if row is not None:
+                database_hits.inc()
+                remaining = (row.expires_at - datetime.now()).total_seconds()
+                self._memory.put(key, row.response, ttl=remaining)
+                return row.response
+        misses.inc()
+        return None
+
+    def put(self, key: str, model: str, response: str):
+        """Remember a response; the database write happens in the background."""
+        self._memory.put(key, response)
+        if self.tier == "database":
+            task = asyncio.create_task(self._store(key, model, response))
+            self._writes.add(task)
+            task.add_done_callback(self._writes.discard)
+
+    async def _store(self, key: str, model: str, response: str):
+        now = datetime.now()
+        values = {
+            "key": key,
+            "model": model,
+            "response": response,
+            "created_at": now,
+            "expires_at": now + timedelta(seconds=self.ttl),
+        }
+        try:
+            async with SessionLocal() as db:
+                await db.execute(
+                    insert(CompletionCacheEntry)
+                    .values(**values)
+                    .on_conflict_do_update(index_elements=["key"], set_=values)
+                )
+                await db.commit()
+        except Exception as e:
+            logger.error(f"Completion cache write failed: {str(e)}")
+
+    async def sweep(self) -> int:
+        """Delete expired rows, then the oldest beyond db_max_entries."""
+        async with SessionLocal() as db:
+            expired = await db.execute(
+                delete(CompletionCacheEntry).where(
+                    CompletionCacheEntry.expires_at <= datetime.now()
+                )
+            )
+            trimmed = await db.execute(
+                text(
+                    "DELETE FROM completion_cache WHERE key IN ("
+                    "SELECT key FROM completion_cache "
+                    "ORDER BY created_at DESC OFFSET :keep)"
+                ),
+                {"keep": self.db_max_entries},
+            )
+            await db.commit()
+        self._memory.purge()
+        return expired.rowcount + trimmed.rowcount
+
+    def start(self):
+        if self.tier == "database" and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Let responses that were just generated reach the table
+        if self._writes:
+            await asyncio.gather(*self._writes, return_exceptions=True)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Completion cache sweep failed: {str(e)}")
+
+    def stats(self) -> dict:
+        return {"tier": self.tier, **self._memory.stats()}
+
+
+class CachingProvider(LLMProvider):
+    """
+    Wraps a provider with the completion cache. A hit is replayed as delta
+    events followed by a done event without usage, since nothing was billed;
+    a miss streams from the wrapped provider and is stored once it completes.
+    Aborted or failed streams are never stored.
+    """
+
+    def __init__(self, provider: LLMProvider, cache: "CompletionCache"):
+        self.provider = provider
+        self.cache = cache
+        self.name = provider.name
+
+    def cacheable(self, messages: list[dict]) -> bool:
+        limit = COMPLETION_CACHE_MAX_MESSAGES
+        return limit <= 0 or len(messages) <= limit
+
+    async def stream(self, model: str, messages: list[dict], **kwargs):
+        if not self.cacheable(messages):
+            events = self.provider.stream(model, messages, **kwargs)
+            async with aclosing(events):
+                async for event in events:
+                    yield event
+            return
+
+        key = request_key(model, INSTRUCTIONS, messages, **kwargs)
+        response = await self.cache.get(key)
+        if response is not None:
+            for chunk in replay_chunks(response):
+                yield LLMEvent("delta", chunk)
+            yield LLMEvent("done")
+            return
+
+        parts = []
+        events = self.provider.stream(model, messages, **kwargs)
+        async with aclosing(events):
+            async for event in events:
+                if event.type == "delta":
+                    parts.append(event.text)
+                elif event.type == "done" and parts:
+                    self.cache.put(key, model, "".join(parts))
+                yield event
+
+
+completion_cache = CompletionCache()
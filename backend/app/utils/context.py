@@ -0,0 +1,217 @@
+"""
+Bounded conversation history for LLM context.
+Only the most recent messages are fetched (newest first through
+idx_messages_conversation_id) and then trimmed to a token budget, so the cost
+of building a prompt does not grow with the age of the conversation.
+"""
+
+import os
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.database import Message
+
+CONTEXT_MAX_MESSAGES = int(os.getenv("CONTEXT_MAX_MESSAGES", "50"))
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "8000"))
+
+# Rough average for English text; avoids a tokenizer dependency
+CHARS_PER_TOKEN = 4
+
+
+@dataclass
+class ContextWindow:
+    messages: list[dict] = field(default_factory=list)
+    tokens: int = 0
+    # Messages that were fetched but dropped to fit the token budget
+    dropped: int = 0
+    # Older messages exist beyond the fetched window
+    has_more: bool = False
+
+    @property
+    def truncated(self) -> bool:
+        return self.has_more or self.dropped > 0
+
+
+def estimate_tokens(content: str) -> int:
+    """Cheap token estimate for budgeting purposes."""
+    return len(content) // CHARS_PER_TOKEN + 1
+
+
+def fit_to_budget(
+    history: list[dict],
+    max_tokens: int = CONTEXT_MAX_TOKENS,
+    reserved_tokens: int = 0,
+    has_more: bool = False,
+) -> ContextWindow:
+    """
+    Keep the newest messages of a chronologically ordered history that fit in
+    max_tokens, leaving reserved_tokens for the message about to be sent.
+    """
+    budget = max_tokens - reserved_tokens
+    tokens = 0
+    start = len(history)
+    while start > 0:
+        cost = estimate_tokens(history[start - 1]["content"])
+        if tokens + cost > budget:
+            break
+        tokens += cost
+        start -= 1
+
+    return ContextWindow(
+        messages=history[start:],
+        tokens=tokens,
+        dropped=start,
+        has_more=has_more,
+    )
+
+
+async def fetch_recent_history(
+    db: AsyncSession, conversation_id: str, max_messages: int = CONTEXT_MAX_MESSAGES
+) -> tuple[list[dict], bool]:
+    """
+    Fetch at most max_messages of the most recent history, oldest first.
+    Also returns whether older messages exist beyond the fetched window.
+    """
+    result = await db.execute(
+        select(Message.role, Message.content)
+        .filter(Message.conversation_id == conversation_id)
+        .order_by(Message.created_at.desc())
+        .limit(max_messages + 1)
+    )
+    rows = result.all()
+
+    history = [
+        {"role": row.role, "content": row.content}
+        for row in reversed(rows[:max_messages])
+    ]
+    return history, len(rows) > max_messages
+
+
+async def load_context_window(
+    db: AsyncSession,
+    conversation_id: str,
+    max_messages: int = CONTEXT_MAX_MESSAGES,
+    max_tokens: int = CONTEXT_MAX_TOKENS,
+    reserved_tokens: int = 0,
+) -> ContextWindow:
+    """
+    Load at most max_messages of the most recent history for a conversation,
+    oldest first, trimmed to the token budget.
+    """
+    history, has_more = await fetch_recent_history(db, conversation_id, max_messages)
+    return fit_to_budget(history, max_tokens, reserved_tokens, has_more)
+
+
+@dataclass
+class CachedHistory:
+    # Conversation.updated_at when this history was known to be complete
+    version: datetime
+    messages: deque
+    has_more: bool = False
+    # Versions this entry has passed through; while writes are still queued
+    # the database can legitimately be at any of them
+    versions: deque = field(default_factory=deque)
+
+
+class HistoryCache:
+    """
+    LRU cache of recent conversation history, keyed by conversation id.
+    Entries are tagged with Conversation.updated_at, which is bumped on every
+    message write, so a write from another connection or worker shows up as a
+    version mismatch and forces a reload from the database.
+    """
+
+    def __init__(self, maxsize: int, max_messages: int = CONTEXT_MAX_MESSAGES):
+        self.maxsize = maxsize
+        self.max_messages = max_messages
+        self._entries: OrderedDict[str, CachedHistory] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(
+        self, conversation_id: str, version: datetime, pending: bool = False
+    ) -> Optional[CachedHistory]:
+        """
+        Return the cached history if it is still current for version.
+        With pending=True (this process has unwritten messages for the
+        conversation) an older version the entry has passed through is also
+        accepted, since the database has not caught up yet.
+        """
+        entry = self._entries.get(conversation_id)
+        current = entry is not None and (
+            entry.version == version or (pending and version in entry.versions)
+        )
+        if not current:
+            if entry is not None:
+                del self._entries[conversation_id]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(conversation_id)
+        self.hits += 1
+        return entry
+
+    def put(
+        self,
+        conversation_id: str,
+        version: datetime,
+        history: list[dict],
+        has_more: bool = False,
+    ):
+        """Store the recent history of a conversation as of version."""
+        messages = deque(history, maxlen=self.max_messages)
+        has_more = has_more or len(history) > self.max_messages
+        versions = deque([version], maxlen=self.max_messages + 1)
+        self._entries[conversation_id] = CachedHistory(
+            version, messages, has_more, versions
+        )
+        self._entries.move_to_end(conversation_id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def append(
+        self,
+        conversation_id: str,
+        expected_version: datetime,
+        version: datetime,
+        message: dict,
+    ):
+        """
+        Record a message written by this process. If the entry is not at
+        expected_version, another writer got there first and it is dropped.
+        """
+        entry = self._entries.get(conversation_id)
+        if entry is None:
+            return
+        if entry.version != expected_version:
+            del self._entries[conversation_id]
+            return
+        if len(entry.messages) == entry.messages.maxlen:
+            entry.has_more = True
+        entry.messages.append(message)
+        entry.versions.append(version)
+        entry.version = version
+
+    def invalidate(self, conversation_id: str):
+        self._entries.pop(conversation_id, None)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+# Shared by every connection in this process; 0 falls back to a small cache
+# per WebSocket connection
+HISTORY_CACHE_SIZE = int(os.getenv("HISTORY_CACHE_SIZE", "1024"))
+CONNECTION_HISTORY_CACHE_SIZE = 8
+history_cache = HistoryCache(HISTORY_CACHE_SIZE) if HISTORY_CACHE_SIZE > 0 else None
@@ -1,13 +1,118 @@
+from sqlalchemy import exc, text
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 import os
+import time
+
+from app.utils.metrics import CallbackGauge, Counter, db_pool_checkout_wait
 
 # Database URL - using environment variable or default to local postgres
 DATABASE_URL = os.getenv("DATABASE_URL")
 assert DATABASE_URL, "DATABASE_URL is not set"
 
+# Connection pool, per worker process: at most DB_POOL_SIZE + DB_MAX_OVERFLOW
+# connections, so a deployment can open workers times that many in total
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+db_pool_timeouts = Counter(
+    "db_pool_timeouts_total",
+    "Checkouts that gave up after DB_POOL_TIMEOUT seconds without a connection.",
+)
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """
+    Queue pool that records how long each checkout waits for a connection,
+    how many checkouts are waiting right now and how many timed out.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.waiting = 0
+        self.timeouts = 0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        self.waiting += 1
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            self.timeouts += 1
+            db_pool_timeouts.inc()
+            raise
+        finally:
+            self.waiting -= 1
+            db_pool_checkout_wait.observe(time.perf_counter() - start)
+
+
 # Create engine
-engine = create_async_engine(DATABASE_URL)
+engine = create_async_engine(
+    DATABASE_URL,
+    poolclass=TimedQueuePool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=DB_POOL_PRE_PING,
+)
+
+
+def pool_capacity() -> int:
+    """Most connections one worker's pool will open (-1 overflow: unbounded)."""
+    if DB_MAX_OVERFLOW < 0:
+        return -1
+    return DB_POOL_SIZE + DB_MAX_OVERFLOW
+
+
+def pool_stats() -> dict:
+    """Current state of this worker's connection pool."""
+    pool = engine.sync_engine.pool
+    checked_out = pool.checkedout()
+    capacity = pool_capacity()
+    return {
+        "size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "capacity": capacity,
+        "checked_in": pool.checkedin(),
+        "checked_out": checked_out,
+        "overflow": max(pool.overflow(), 0),
+        "waiting": pool.waiting,
+        "timeouts": pool.timeouts,
+        # 1.0 means every connection is busy and further checkouts queue
+        "saturation": round(checked_out / capacity, 3) if capacity > 0 else None,
+    }
+
+
+CallbackGauge(
+    "db_pool_checked_out",
+    "Connections currently checked out of the pool.",
+    lambda: engine.sync_engine.pool.checkedout(),
+)
+CallbackGauge(
+    "db_pool_size",
+    "Connections held by the pool, idle or checked out.",
+    lambda: engine.sync_engine.pool.checkedin() + engine.sync_engine.pool.checkedout(),
+)
+CallbackGauge(
+    "db_pool_overflow",
+    "Connections open beyond DB_POOL_SIZE.",
+    lambda: max(engine.sync_engine.pool.overflow(), 0),
+)
+CallbackGauge(
+    "db_pool_waiting",
+    "Checkouts currently waiting for a connection.",
+    lambda: engine.sync_engine.pool.waiting,
+)
+CallbackGauge(
+    "db_pool_saturation",
+    "Checked-out connections as a fraction of DB_POOL_SIZE + DB_MAX_OVERFLOW.",
+    lambda: engine.sync_engine.pool.checkedout() / max(pool_capacity(), 1),
+)
 
 # Create session factory
 SessionLocal = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
@@ -16,12 +121,63 @@ SessionLocal = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit
 Base = declarative_base()
 
 
+# Advisory lock held while creating tables and triggers
+INIT_LOCK_KEY = 0x62617365677074
+
+
 async def init_models():
+    from app.utils.migrations import install_triggers
+
     async with engine.begin() as conn:
+        # Workers start together; let one create the schema at a time
+        await conn.execute(
+            text("SELECT pg_advisory_xact_lock(:key)"), {"key": INIT_LOCK_KEY}
+        )
         await conn.run_sync(Base.metadata.create_all)
+        await install_triggers(conn)
 
 
 # Dependency to get DB session
 async def get_db() -> AsyncSession:
     async with SessionLocal() as session:
         yield session
+
+
+async def check_connection_budget(workers: int) -> dict:
+    """
+    Compare the connections `workers` processes may open against the
+    server's max_connections (less the superuser reserve). Raises
+    ValueError if they do not fit.
+    """
+    if pool_capacity() < 0:
+        raise ValueError(
+            "DB_MAX_OVERFLOW=-1 lets each pool grow without bound; "
+            "set a limit so the workers fit under max_connections"
+        )
+    async with engine.connect() as conn:
+        max_connections = int(await conn.scalar(text("SHOW max_connections")))
+        reserved = int(await conn.scalar(text("SHOW superuser_reserved_connections")))
+        # Other clients already connected, not counting this check
+        others = await conn.scalar(
+            text(
+                "SELECT count(*) - 1 FROM pg_stat_activity "
+                "WHERE backend_type = 'client backend'"
+            )
+        )
+    budget = {
+        "workers": workers,
+        "per_worker": pool_capacity(),
+        "required": workers * pool_capacity(),
+        "max_connections": max_connections,
+        "reserved": reserved,
+        "available": max_connections - reserved,
+        "in_use_by_others": others,
+    }
+    if budget["required"] > budget["available"]:
+        raise ValueError(
+            f"{workers} workers x (DB_POOL_SIZE {DB_POOL_SIZE} + DB_MAX_OVERFLOW "
+            f"{DB_MAX_OVERFLOW}) = {budget['required']} connections, but Postgres "
+            f"allows {budget['available']} (max_connections {max_connections} - "
+            f"{reserved} reserved); lower the pool settings or the worker count"
+        )
+    return budget
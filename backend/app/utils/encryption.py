@@ -1,6 +1,8 @@
 """
 Encryption utilities for user keys.
 Uses the user's password to derive an encryption key.
+Everything here is CPU-bound and synchronous; async callers should run it
+through app.utils.executor.run_cpu rather than on the event loop.
 """
 
 from cryptography.fernet import Fernet
@@ -9,6 +11,7 @@ from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 from cryptography.hazmat.backends import default_backend
 import base64
 import hashlib
+from typing import Optional
 
 
 def derive_key_from_password(password: str, salt: bytes = None) -> bytes:
@@ -33,15 +36,61 @@ def derive_key_from_password(password: str, salt: bytes = None) -> bytes:
     return key
 
 
+def _encrypt(fernet: Fernet, plain_password: str) -> str:
+    encrypted = fernet.encrypt(plain_password.encode())
+    return base64.urlsafe_b64encode(encrypted).decode()
+
+
+def _decrypt(fernet: Fernet, encrypted_password: str) -> str:
+    encrypted_bytes = base64.urlsafe_b64decode(encrypted_password.encode())
+    return fernet.decrypt(encrypted_bytes).decode()
+
+
+def fernet_encrypt(key: bytes, plain_password: str) -> str:
+    """
+    Encrypt a password with a derived key.
+    Returns base64-encoded encrypted string.
+    """
+    return _encrypt(Fernet(key), plain_password)
+
+
+def fernet_decrypt(key: bytes, encrypted_password: str) -> str:
+    """
+    Decrypt a password produced by fernet_encrypt.
+    Raises cryptography.fernet.InvalidToken if the key does not match.
+    """
+    return _decrypt(Fernet(key), encrypted_password)
+
+
+def fernet_encrypt_many(fernet: Fernet, plain_passwords: list[str]) -> list[str]:
+    """Encrypt a batch of passwords with a Fernet built once by the caller."""
+    return [_encrypt(fernet, password) for password in plain_passwords]
+
+
+def fernet_decrypt_many(
+    fernet: Fernet, encrypted_passwords: list[str]
+) -> list[Optional[str]]:
+    """
+    Decrypt a batch of passwords with a Fernet built once by the caller.
+    Entries that fail to decrypt come back as None instead of failing the
+    whole batch.
+    """
+    decrypted = []
+    for encrypted_password in encrypted_passwords:
+        try:
+            decrypted.append(_decrypt(fernet, encrypted_password))
+        except Exception:
+            decrypted.append(None)
+    return decrypted
+
+
 def encrypt_password(plain_password: str, user_password: str) -> str:
     """
     Encrypt a password using the user's password as the encryption key.
     Returns base64-encoded encrypted string.
     """
     key = derive_key_from_password(user_password)
-    fernet = Fernet(key)
-    encrypted = fernet.encrypt(plain_password.encode())
-    return base64.urlsafe_b64encode(encrypted).decode()
+    return fernet_encrypt(key, plain_password)
 
 
 def decrypt_password(encrypted_password: str, user_password: str) -> str:
@@ -51,9 +100,6 @@ def decrypt_password(encrypted_password: str, user_password: str) -> str:
     """
     try:
         key = derive_key_from_password(user_password)
-        fernet = Fernet(key)
-        encrypted_bytes = base64.urlsafe_b64decode(encrypted_password.encode())
-        decrypted = fernet.decrypt(encrypted_bytes)
-        return decrypted.decode()
+        return fernet_decrypt(key, encrypted_password)
     except Exception as e:
         raise ValueError(f"Failed to decrypt password: {str(e)}")
@@ -0,0 +1,109 @@
+"""
+Worker pool for CPU-heavy work (key derivation, encryption, password hashing)
+that must not run on the event loop, where it would stall every request and
+/ws stream in the process. CRYPTO_EXECUTOR selects "thread" (default; the
+OpenSSL-backed primitives release the GIL), "process", or "inline" (run on
+the loop, for comparison). At most CRYPTO_MAX_PENDING jobs are submitted at
+once; further callers wait asynchronously for a slot.
+"""
+
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Optional
+
+from app.utils.metrics import Gauge, Histogram
+
+CRYPTO_EXECUTOR = os.getenv("CRYPTO_EXECUTOR", "thread")
+CRYPTO_WORKERS = int(os.getenv("CRYPTO_WORKERS", str(min(4, os.cpu_count() or 1))))
+CRYPTO_MAX_PENDING = int(os.getenv("CRYPTO_MAX_PENDING", "32"))
+
+EXECUTOR_KINDS = ("thread", "process", "inline")
+
+cpu_jobs_in_flight = Gauge(
+    "cpu_pool_jobs_in_flight", "Jobs submitted to the CPU worker pool and not finished."
+)
+cpu_slot_wait = Histogram(
+    "cpu_pool_slot_wait_seconds", "Time spent waiting for a CPU worker pool slot."
+)
+cpu_job_duration = Histogram(
+    "cpu_pool_job_seconds", "Time from submission to result for CPU pool jobs."
+)
+
+
+class CpuPool:
+    def __init__(
+        self,
+        kind: str = CRYPTO_EXECUTOR,
+        workers: int = CRYPTO_WORKERS,
+        max_pending: int = CRYPTO_MAX_PENDING,
+    ):
+        if kind not in EXECUTOR_KINDS:
+            raise ValueError(f"Unknown CRYPTO_EXECUTOR: {kind}")
+        self.kind = kind
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor: Optional[Executor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                # spawn, not fork: forking a process with a running event
+                # loop and driver threads is not safe
+                self._executor = ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    self.workers, thread_name_prefix="cpu-pool"
+                )
+        return self._executor
+
+    async def run(self, func: Callable, *args):
+        """Run func(*args) on the pool and return its result."""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+        start = time.perf_counter()
+        async with self._slots:
+            submitted = time.perf_counter()
+            cpu_slot_wait.observe(submitted - start)
+            cpu_jobs_in_flight.inc()
+            try:
+                if self.kind == "inline":
+                    return func(*args)
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._get_executor(), func, *args)
+            finally:
+                cpu_jobs_in_flight.dec()
+                cpu_job_duration.observe(time.perf_counter() - submitted)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+_pool: Optional[CpuPool] = None
+
+
+def get_cpu_pool() -> CpuPool:
+    global _pool
+    if _pool is None:
+        _pool = CpuPool()
+    return _pool
+
+
+def set_cpu_pool(pool: Optional[CpuPool]):
+    """Replace the process-wide pool, e.g. from a benchmark harness."""
+    global _pool
+    if _pool is not None and _pool is not pool:
+        _pool.shutdown()
+    _pool = pool
+
+
+async def run_cpu(func: Callable, *args):
+    """Run a CPU-bound function on the process-wide pool."""
+    return await get_cpu_pool().run(func, *args)
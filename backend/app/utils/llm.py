@@ -1,18 +1,462 @@
+"""
+LLM provider layer.
+Providers expose a streaming call that yields normalized LLMEvent objects and
+a non-streaming call that returns the full text, so request handlers do not
+depend on any one vendor's event names. LLM_PROVIDER selects the backend:
+"openai" (default) or "mock", a deterministic local provider for load tests.
+Requests pass through the scheduler (app/utils/scheduler.py) unless
+LLM_SCHEDULER is off, and with LLM_SINGLE_FLIGHT on, identical requests in
+flight at the same time share one upstream stream. A stream that fails with
+a transient error is retried up to LLM_STREAM_RETRIES times, continuing from
+the text already emitted.
+"""
+
+import asyncio
+import hashlib
+import json
 import os
+import random
+import unicodedata
+from abc import ABC, abstractmethod
+from contextlib import aclosing
+from dataclasses import dataclass
+from typing import AsyncIterator, Optional
+
 import openai
-from typing import AsyncIterator, Union
 
-client = openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+from app import logger
+from app.utils.metrics import Counter, Gauge
+
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openai")
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-5-nano")
+INSTRUCTIONS = "You are a helpful assistant."
+# Retries inside the OpenAI client. Off by default: the scheduler handles 429s
+# and RetryingProvider the other transient errors, and client retries would
+# stack with theirs while holding a scheduler slot
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "0"))
+LLM_SCHEDULER = os.getenv("LLM_SCHEDULER", "true").lower() in ("1", "true", "yes")
+LLM_SINGLE_FLIGHT = os.getenv("LLM_SINGLE_FLIGHT", "true").lower() in ("1", "true", "yes")
+LLM_STREAM_RETRIES = int(os.getenv("LLM_STREAM_RETRIES", "2"))
+LLM_STREAM_RETRY_BACKOFF = float(os.getenv("LLM_STREAM_RETRY_BACKOFF", "0.5"))
+
+# Appended after the partial answer when a stream is continued
+CONTINUE_PROMPT = (
+    "Your previous answer was cut off. Continue it exactly where it stopped, "
+    "without repeating any of it."
+)
+
+# Mock provider defaults
+MOCK_LLM_TOKENS_PER_SECOND = float(os.getenv("MOCK_LLM_TOKENS_PER_SECOND", "50"))
+MOCK_LLM_LATENCY_MS = float(os.getenv("MOCK_LLM_LATENCY_MS", "300"))
+MOCK_LLM_LATENCY_SIGMA = float(os.getenv("MOCK_LLM_LATENCY_SIGMA", "0.5"))
+MOCK_LLM_RESPONSE_TOKENS = int(os.getenv("MOCK_LLM_RESPONSE_TOKENS", "200"))
+MOCK_LLM_SEED = os.getenv("MOCK_LLM_SEED", "0")
+# Fraction of mock streams that drop partway through, to exercise retries
+MOCK_LLM_FAILURE_RATE = float(os.getenv("MOCK_LLM_FAILURE_RATE", "0"))
 
 
-async def call_openai(model: str, messages: list[dict], **kwargs):
+llm_upstream_streams = Gauge("llm_upstream_streams", "Streams open to the LLM provider.")
+llm_single_flight = Counter(
+    "llm_single_flight_requests_total",
+    "Streaming requests by whether they opened an upstream stream (leader) "
+    "or joined an identical one already in flight (follower).",
+    ("role",),
+)
+single_flight_leaders = llm_single_flight.labels("leader")
+single_flight_followers = llm_single_flight.labels("follower")
+llm_stream_retries = Counter(
+    "llm_stream_retries_total", "LLM streams retried after a transient failure."
+)
+
+
+def normalize_text(value: str) -> str:
     """
-    Call OpenAI API. If stream=True, returns an async iterator of events.
-    Otherwise, returns the response object.
+    NFC form with outer and trailing whitespace stripped. Indentation is kept:
+    in code it changes the meaning.
     """
-    return await client.responses.create(
-        model=model,
-        instructions="You are a helpful assistant.",
-        input=messages,
-        **kwargs,
+    value = unicodedata.normalize("NFC", value).strip()
+    return "\n".join(line.rstrip() for line in value.splitlines())
+
+
+def request_key(
+    model: str, instructions: str, messages: list[dict], **params
+) -> str:
+    """SHA-256 of the canonical JSON form of a request."""
+    canonical = {
+        "model": model,
+        "instructions": normalize_text(instructions),
+        "messages": [
+            {"role": m["role"], "content": normalize_text(m["content"])}
+            for m in messages
+        ],
+        "params": params,
+    }
+    data = json.dumps(
+        canonical, sort_keys=True, separators=(",", ":"), ensure_ascii=False
     )
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+@dataclass
+class LLMEvent:
+    # "delta" carries text, "done" marks the end of the response, "queued"
+    # reports the request's place in the scheduler's line
+    type: str
+    text: str = ""
+    usage: Optional[dict] = None
+    position: Optional[int] = None
+
+
+class LLMProvider(ABC):
+    name = "base"
+
+    @abstractmethod
+    def stream(
+        self, model: str, messages: list[dict], **kwargs
+    ) -> AsyncIterator[LLMEvent]:
+        """
+        Stream a response as LLMEvents. Close the iterator (e.g. with
+        contextlib.aclosing) to abort the upstream request early.
+        """
+
+    async def complete(self, model: str, messages: list[dict], **kwargs) -> str:
+        """Return the full response text."""
+        parts = []
+        async for event in self.stream(model, messages, **kwargs):
+            if event.type == "delta":
+                parts.append(event.text)
+        return "".join(parts)
+
+
+class OpenAIProvider(LLMProvider):
+    name = "openai"
+
+    def __init__(
+        self, api_key: Optional[str] = None, max_retries: int = OPENAI_MAX_RETRIES
+    ):
+        self.api_key = api_key
+        self.max_retries = max_retries
+        self._client: Optional[openai.AsyncOpenAI] = None
+
+    @property
+    def client(self) -> openai.AsyncOpenAI:
+        # Created on first use, so building the provider needs no API key yet
+        if self._client is None:
+            self._client = openai.AsyncOpenAI(
+                api_key=self.api_key or os.getenv("OPENAI_API_KEY"),
+                max_retries=self.max_retries,
+            )
+        return self._client
+
+    async def stream(self, model: str, messages: list[dict], **kwargs):
+        stream = await self.client.responses.create(
+            model=model,
+            instructions=INSTRUCTIONS,
+            input=messages,
+            stream=True,
+            **kwargs,
+        )
+        try:
+            async for event in stream:
+                if event.type == "response.output_text.delta":
+                    if event.delta:
+                        yield LLMEvent("delta", event.delta)
+                elif event.type == "response.completed":
+                    usage = event.response.usage
+                    yield LLMEvent(
+                        "done", usage=usage.model_dump() if usage else None
+                    )
+        finally:
+            await stream.close()
+
+    async def complete(self, model: str, messages: list[dict], **kwargs) -> str:
+        response = await self.client.responses.create(
+            model=model,
+            instructions=INSTRUCTIONS,
+            input=messages,
+            **kwargs,
+        )
+        return response.output_text
+
+
+MOCK_WORDS = """
+lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor
+incididunt ut labore et dolore magna aliqua enim ad minim veniam quis nostrud
+exercitation ullamco laboris nisi aliquip ex ea commodo consequat
+""".split()
+
+
+class MockProvider(LLMProvider):
+    """
+    Deterministic local provider. The same messages always produce the same
+    text; time to first token is drawn from a log-normal distribution around
+    latency_ms, then tokens are emitted at tokens_per_second. A failure_rate
+    fraction of streams (chosen at random, not by the seed) raise
+    ConnectionError partway through.
+    """
+
+    name = "mock"
+
+    def __init__(
+        self,
+        tokens_per_second: float = MOCK_LLM_TOKENS_PER_SECOND,
+        latency_ms: float = MOCK_LLM_LATENCY_MS,
+        latency_sigma: float = MOCK_LLM_LATENCY_SIGMA,
+        response_tokens: int = MOCK_LLM_RESPONSE_TOKENS,
+        seed: str = MOCK_LLM_SEED,
+        failure_rate: float = MOCK_LLM_FAILURE_RATE,
+    ):
+        self.failure_rate = failure_rate
+        self.tokens_per_second = tokens_per_second
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.response_tokens = response_tokens
+        self.seed = seed
+
+    async def stream(self, model: str, messages: list[dict], **kwargs):
+        rng = random.Random(f"{self.seed}:{model}:{json.dumps(messages, sort_keys=True)}")
+        if self.latency_ms > 0:
+            first_token = rng.lognormvariate(0, self.latency_sigma) * self.latency_ms
+            await asyncio.sleep(first_token / 1000)
+
+        # Sleeping once per token is too coarse at high rates, so emit tokens
+        # in groups that take at least a millisecond
+        interval = 1 / self.tokens_per_second if self.tokens_per_second > 0 else 0
+        group = max(1, int(0.001 / interval)) if interval else self.response_tokens
+        count = max(1, int(rng.gauss(self.response_tokens, self.response_tokens / 10)))
+        fail_at = None
+        if random.random() < self.failure_rate:
+            fail_at = random.randrange(count)
+        for start in range(0, count, group):
+            if fail_at is not None and start >= fail_at:
+                raise ConnectionError("mock upstream connection dropped")
+            words = [rng.choice(MOCK_WORDS) for _ in range(min(group, count - start))]
+            prefix = "" if start == 0 else " "
+            yield LLMEvent("delta", prefix + " ".join(words))
+            if interval:
+                await asyncio.sleep(interval * len(words))
+
+        yield LLMEvent(
+            "done",
+            usage={
+                "input_tokens": sum(len(m["content"]) // 4 + 1 for m in messages),
+                "output_tokens": count,
+            },
+        )
+
+
+class Flight:
+    """One upstream stream and everything it has emitted so far."""
+
+    def __init__(self):
+        self.events: list[LLMEvent] = []
+        self.finished = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.usage_claimed = False
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait(self):
+        await self._changed.wait()
+
+
+class SingleFlightProvider(LLMProvider):
+    """
+    Wraps a provider so that identical concurrent stream() calls, matched on
+    request_key(), share one upstream stream. The stream is read by its own
+    task; each caller replays the events emitted before it joined and then
+    follows live. The upstream request is aborted once every caller has
+    closed its iterator. Usage is reported to the first caller that reaches
+    the done event, so tokens are counted once per upstream request.
+    """
+
+    def __init__(self, provider: LLMProvider):
+        self.provider = provider
+        self.name = provider.name
+        self._flights: dict[str, Flight] = {}
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    async def stream(self, model: str, messages: list[dict], **kwargs):
+        key = request_key(model, INSTRUCTIONS, messages, **kwargs)
+        flight = self._flights.get(key)
+        if flight is None:
+            single_flight_leaders.inc()
+            flight = self._flights[key] = Flight()
+            flight.task = asyncio.create_task(
+                self._pump(key, flight, model, messages, kwargs)
+            )
+        else:
+            single_flight_followers.inc()
+        flight.subscribers += 1
+        try:
+            position = 0
+            while True:
+                while position < len(flight.events):
+                    event = flight.events[position]
+                    position += 1
+                    if event.type == "done" and event.usage:
+                        if flight.usage_claimed:
+                            event = LLMEvent("done")
+                        flight.usage_claimed = True
+                    yield event
+                if flight.finished:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                await flight.wait()
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.finished:
+                # Nobody is listening: abort upstream, and make sure a new
+                # identical request starts afresh instead of joining
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                flight.task.cancel()
+
+    async def _pump(self, key: str, flight: Flight, model: str, messages, kwargs):
+        llm_upstream_streams.inc()
+        try:
+            events = self.provider.stream(model, messages, **kwargs)
+            async with aclosing(events):
+                async for event in events:
+                    flight.events.append(event)
+                    flight.notify()
+        except asyncio.CancelledError:
+            flight.error = asyncio.CancelledError()
+        except Exception as e:
+            flight.error = e
+        finally:
+            llm_upstream_streams.dec()
+            flight.finished = True
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            flight.notify()
+
+
+def is_transient(error: BaseException, rate_limits: bool = True) -> bool:
+    """
+    Whether a failed stream is worth retrying. Pass rate_limits=False when
+    429s are already retried elsewhere (by the scheduler).
+    """
+    if isinstance(error, openai.RateLimitError):
+        return rate_limits
+    return isinstance(
+        error,
+        (
+            openai.APIConnectionError,  # includes APITimeoutError
+            openai.InternalServerError,
+            ConnectionError,
+            asyncio.TimeoutError,
+        ),
+    )
+
+
+def continuation_messages(messages: list[dict], partial: str) -> list[dict]:
+    """Request that picks up an answer from the partial text it had reached."""
+    if not partial:
+        return messages
+    return messages + [
+        {"role": "assistant", "content": partial},
+        {"role": "user", "content": CONTINUE_PROMPT},
+    ]
+
+
+class RetryingProvider(LLMProvider):
+    """
+    Wraps a provider so that a stream failing with a transient error is
+    retried with exponential backoff. Later attempts ask the model to
+    continue from the text already emitted, so callers see one uninterrupted
+    stream; only the final attempt's usage is reported.
+
+    Behind the scheduler, 429s are left to it: it already requeues them with
+    its own budget, and retrying them here as well would multiply the calls
+    made to a provider that is asking us to back off.
+    """
+
+    def __init__(
+        self,
+        provider: LLMProvider,
+        retries: int = LLM_STREAM_RETRIES,
+        backoff: float = LLM_STREAM_RETRY_BACKOFF,
+        retry_rate_limits: bool = True,
+    ):
+        self.provider = provider
+        self.retries = retries
+        self.backoff = backoff
+        self.retry_rate_limits = retry_rate_limits
+        self.name = provider.name
+
+    async def stream(self, model: str, messages: list[dict], **kwargs):
+        parts: list[str] = []
+        for attempt in range(self.retries + 1):
+            request = continuation_messages(messages, "".join(parts))
+            try:
+                events = self.provider.stream(model, request, **kwargs)
+                async with aclosing(events):
+                    async for event in events:
+                        if event.type == "delta":
+                            parts.append(event.text)
+                        yield event
+                return
+            except Exception as e:
+                if attempt == self.retries or not is_transient(
+                    e, self.retry_rate_limits
+                ):
+                    raise
+                delay = self.backoff * 2**attempt * random.uniform(0.5, 1.5)
+                llm_stream_retries.inc()
+                logger.warning(
+                    f"LLM stream failed after {sum(map(len, parts))} characters "
+                    f"({type(e).__name__}: {str(e)}); retrying in {delay:.2f}s"
+                )
+                await asyncio.sleep(delay)
+
+
+PROVIDERS = {
+    "openai": OpenAIProvider,
+    "mock": MockProvider,
+}
+
+_provider: Optional[LLMProvider] = None
+
+
+def get_provider() -> LLMProvider:
+    """
+    Return the process-wide provider selected by LLM_PROVIDER, behind the
+    scheduler, stream retries, the single-flight layer and the completion
+    cache when those are on.
+    """
+    global _provider
+    if _provider is None:
+        if LLM_PROVIDER not in PROVIDERS:
+            raise ValueError(f"Unknown LLM_PROVIDER: {LLM_PROVIDER}")
+        _provider = PROVIDERS[LLM_PROVIDER]()
+        if LLM_SCHEDULER:
+            from app.utils.scheduler import ScheduledProvider, scheduler
+
+            _provider = ScheduledProvider(_provider, scheduler)
+        if LLM_STREAM_RETRIES > 0:
+            _provider = RetryingProvider(
+                _provider, retry_rate_limits=not LLM_SCHEDULER
+            )
+        if LLM_SINGLE_FLIGHT:
+            _provider = SingleFlightProvider(_provider)
+
+        from app.utils.completions import CachingProvider, completion_cache
+
+        if completion_cache.enabled:
+            _provider = CachingProvider(_provider, completion_cache)
+    return _provider
+
+
+def set_provider(provider: Optional[LLMProvider]):
+    """Replace the process-wide provider, e.g. from a benchmark harness."""
+    global _provider
+    _provider = provider
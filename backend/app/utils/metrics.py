@@ -0,0 +1,324 @@
+"""
+In-process metrics exported in the Prometheus text format on /metrics.
+Instruments are created once at import time. Recording is a dict lookup plus
+a few arithmetic updates; label values are kept as-is and only formatted by
+render() when /metrics is scraped. Resolve labelled children once with
+.labels(...) where the label values are known up front. Values are per
+process and are meant to be updated from the event loop.
+"""
+
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from typing import Callable
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; spans a cached lookup up to a long LLM response
+DEFAULT_BUCKETS = (
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+_registry: list["Metric"] = []
+
+
+class CounterValue:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+
+class GaugeValue:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class HistogramValue:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: tuple):
+        self.bounds = bounds
+        # One slot per bucket plus the +Inf overflow; made cumulative on render
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self) -> "_Timer":
+        """Context manager that observes the elapsed monotonic time."""
+        return _Timer(self)
+
+
+class _Timer:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram: HistogramValue):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Metric(ABC):
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        _registry.append(self)
+
+    @abstractmethod
+    def _samples(self):
+        """Yield (suffix, label names, label values, value) for rendering."""
+
+
+class RecordedMetric(Metric):
+    """Metric recorded in-process, one child per combination of label values."""
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        super().__init__(name, help, labelnames)
+        self._children: dict[tuple, object] = {}
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def labels(self, *values):
+        """Return the child for these label values, creating it on first use."""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(
+                    f"{self.name} expects labels {self.labelnames}, got {values}"
+                )
+            child = self._children[values] = self._new_child()
+        return child
+
+    @abstractmethod
+    def _new_child(self):
+        """Create the value object for one combination of label values."""
+
+    def _samples(self):
+        for values, child in self._children.items():
+            yield "", self.labelnames, values, child.value
+
+
+class Counter(RecordedMetric):
+    type = "counter"
+
+    def _new_child(self):
+        return CounterValue()
+
+    def inc(self, amount: float = 1):
+        self._default.inc(amount)
+
+
+class Gauge(RecordedMetric):
+    type = "gauge"
+
+    def _new_child(self):
+        return GaugeValue()
+
+    def inc(self, amount: float = 1):
+        self._default.inc(amount)
+
+    def dec(self, amount: float = 1):
+        self._default.dec(amount)
+
+    def set(self, value: float):
+        self._default.set(value)
+
+
+class CallbackGauge(Metric):
+    """
+    Gauge whose value is read from `function` at scrape time. Unlabelled
+    gauges return a number; labelled ones return {label values tuple: number}.
+    """
+
+    type = "gauge"
+
+    def __init__(
+        self, name: str, help: str, function: Callable, labelnames: tuple = ()
+    ):
+        self.function = function
+        super().__init__(name, help, labelnames)
+
+    def _samples(self):
+        result = self.function()
+        if not self.labelnames:
+            result = {(): result}
+        for values, value in result.items():
+            yield "", self.labelnames, values, value
+
+
+class CallbackCounter(CallbackGauge):
+    """
+    Counter read from `function` at scrape time, for totals something else
+    already keeps. The values must only ever go up.
+    """
+
+    type = "counter"
+
+
+class Histogram(RecordedMetric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple = (),
+        buckets: tuple = DEFAULT_BUCKETS,
+    ):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames)
+
+    def _new_child(self):
+        return HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self._default.observe(value)
+
+    def time(self) -> _Timer:
+        return self._default.time()
+
+    def _samples(self):
+        bucket_labels = self.labelnames + ("le",)
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+                cumulative += count
+                yield "_bucket", bucket_labels, values + (bound,), cumulative
+            yield "_sum", self.labelnames, values, child.sum
+            yield "_count", self.labelnames, values, child.count
+
+
+def _format_value(value) -> str:
+    if isinstance(value, int):
+        return str(value)
+    value = float(value)
+    if value == float("inf"):
+        return "+Inf"
+    if value == float("-inf"):
+        return "-Inf"
+    return repr(value)
+
+
+def _format_label(value) -> str:
+    if isinstance(value, float):
+        return _format_value(value)
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render() -> str:
+    """Render every registered metric in the Prometheus text format."""
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        for suffix, names, values, value in metric._samples():
+            if names:
+                labels = ",".join(
+                    f'{name}="{_format_label(v)}"' for name, v in zip(names, values)
+                )
+                lines.append(f"{metric.name}{suffix}{{{labels}}} {_format_value(value)}")
+            else:
+                lines.append(f"{metric.name}{suffix} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# HTTP
+http_request_duration = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route template.",
+    ("method", "route", "status"),
+)
+function_duration = Histogram(
+    "function_duration_seconds",
+    "Duration of functions decorated with @timer.",
+    ("function",),
+)
+
+# WebSocket QA
+ws_connections = Gauge("ws_connections", "Open /ws connections.")
+ws_streams_in_flight = Gauge(
+    "ws_streams_in_flight", "Queries currently streaming an LLM response."
+)
+ws_query_duration = Histogram(
+    "ws_query_duration_seconds",
+    "End-to-end /ws query latency by outcome.",
+    ("outcome",),
+)
+qa_phase_duration = Histogram(
+    "qa_phase_duration_seconds",
+    "Latency of each QA phase: auth, history, first_token, stream, persist.",
+    ("phase",),
+)
+
+# LLM
+llm_tokens = Counter(
+    "llm_tokens_total",
+    "Tokens reported by the LLM provider, by model and direction.",
+    ("model", "direction"),
+)
+
+# Database
+db_pool_checkout_wait = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting to check a connection out of the pool.",
+)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that records http_request_duration_seconds. Requests are
+    labelled with the matched route template, not the raw path, so label
+    cardinality stays bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            http_request_duration.labels(
+                scope["method"], route.path if route else "unmatched", status
+            ).observe(time.perf_counter() - start)
@@ -0,0 +1,129 @@
+"""
+Schema maintenance that create_all cannot express.
+
+Message.content_tsv is maintained by a BEFORE INSERT/UPDATE trigger so the
+server computes it from the row itself instead of the app issuing a separate
+to_tsvector() query per message. Rows written before the trigger existed are
+filled in by the batched backfill:
+
+    python -m app.utils.migrations backfill --batch-size 1000
+"""
+
+import argparse
+import asyncio
+import time
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app import logger
+from app.utils.database import engine
+
+TSV_FUNCTION = text(
+    """
+    CREATE OR REPLACE FUNCTION messages_content_tsv_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.content_tsv := to_tsvector('english', NEW.content);
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """
+)
+
+# CREATE TRIGGER has no IF NOT EXISTS; checking pg_trigger first keeps startup
+# idempotent without DROP TRIGGER taking an exclusive lock on every boot
+TSV_TRIGGER = text(
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (
+            SELECT 1 FROM pg_trigger
+            WHERE tgname = 'messages_content_tsv_trigger'
+              AND tgrelid = 'messages'::regclass
+        ) THEN
+            CREATE TRIGGER messages_content_tsv_trigger
+            BEFORE INSERT OR UPDATE OF content ON messages
+            FOR EACH ROW EXECUTE FUNCTION messages_content_tsv_update();
+        END IF;
+    END
+    $$
+    """
+)
+
+
+async def install_triggers(conn: AsyncConnection):
+    """Install the content_tsv trigger. Safe to run on every startup."""
+    await conn.execute(TSV_FUNCTION)
+    await conn.execute(TSV_TRIGGER)
+
+
+async def backfill_content_tsv(
+    batch_size: int = 1000, pause: float = 0.0, rebuild: bool = False
+) -> int:
+    """
+    Fill content_tsv for existing messages in primary-key order.
+    Each batch is its own short transaction, so only the rows in the current
+    batch are locked. With rebuild=True every row is recomputed, e.g. after
+    changing the text search configuration.
+    Returns the number of rows updated.
+    """
+    after = ""
+    updated = 0
+    while True:
+        async with engine.begin() as conn:
+            result = await conn.execute(
+                text(
+                    "SELECT id FROM messages WHERE id > :after ORDER BY id LIMIT :limit"
+                ),
+                {"after": after, "limit": batch_size},
+            )
+            ids = result.scalars().all()
+            if not ids:
+                break
+
+            condition = "" if rebuild else " AND content_tsv IS NULL"
+            result = await conn.execute(
+                text(
+                    "UPDATE messages SET content_tsv = to_tsvector('english', content) "
+                    "WHERE id = ANY(:ids)" + condition
+                ),
+                {"ids": ids},
+            )
+            updated += result.rowcount
+            after = ids[-1]
+
+        logger.info(f"Backfilled content_tsv through {after} ({updated} rows)")
+        if pause:
+            await asyncio.sleep(pause)
+
+    return updated
+
+
+async def main(args):
+    try:
+        async with engine.begin() as conn:
+            await install_triggers(conn)
+        if args.command == "backfill":
+            start = time.perf_counter()
+            updated = await backfill_content_tsv(
+                args.batch_size, args.pause, args.rebuild
+            )
+            logger.info(
+                f"Backfill updated {updated} rows in "
+                f"{time.perf_counter() - start:.2f} seconds"
+            )
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Database maintenance")
+    parser.add_argument("command", choices=["install", "backfill"])
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument(
+        "--pause", type=float, default=0.0, help="seconds to sleep between batches"
+    )
+    parser.add_argument(
+        "--rebuild", action="store_true", help="recompute rows that already have a value"
+    )
+    asyncio.run(main(parser.parse_args()))
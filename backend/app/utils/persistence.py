@@ -0,0 +1,295 @@
+"""
+Write-behind persistence for chat messages.
+Handlers enqueue messages and move on; a single writer task drains the queue
+in batches with one bulk INSERT per batch. A single consumer keeps messages in
+enqueue order, which preserves per-conversation ordering. The queue is bounded,
+so producers wait (and the wait is recorded) when the writer falls behind.
+
+A row the database rejects is dropped. Messages that could not be written
+because the database was unreachable are held and tried again every
+WRITER_RETRY_DELAY seconds, up to WRITER_RETRY_MAX of them.
+"""
+
+import asyncio
+import os
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import exc, update
+from sqlalchemy.dialects.postgresql import insert
+
+from app import logger
+from app.models.database import Conversation, Message
+from app.utils.database import SessionLocal
+from app.utils.metrics import CallbackGauge, Counter, Histogram
+
+WRITER_QUEUE_SIZE = int(os.getenv("WRITER_QUEUE_SIZE", "10000"))
+WRITER_BATCH_SIZE = int(os.getenv("WRITER_BATCH_SIZE", "500"))
+WRITER_MAX_DELAY = float(os.getenv("WRITER_MAX_DELAY", "0.05"))  # seconds
+WRITER_RETRIES = 3
+WRITER_RETRY_DELAY = float(os.getenv("WRITER_RETRY_DELAY", "5"))  # seconds
+WRITER_RETRY_MAX = int(os.getenv("WRITER_RETRY_MAX", "10000"))
+
+writer_batch_duration = Histogram(
+    "message_writer_batch_seconds", "Time to write one batch of queued messages."
+)
+writer_dropped = Counter(
+    "message_writer_dropped_total", "Queued messages given up on, never written."
+)
+
+
+def is_unavailable(error: Exception) -> bool:
+    """True if a write failed because of the database, not the rows."""
+    if isinstance(error, exc.DBAPIError) and error.connection_invalidated:
+        return True
+    return isinstance(
+        error, (exc.OperationalError, exc.InterfaceError, exc.TimeoutError, OSError)
+    )
+
+
+class MessageWriter:
+    def __init__(
+        self,
+        maxsize: int = WRITER_QUEUE_SIZE,
+        batch_size: int = WRITER_BATCH_SIZE,
+        max_delay: float = WRITER_MAX_DELAY,
+    ):
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self._queue: asyncio.Queue[dict] = asyncio.Queue(maxsize)
+        self._task: Optional[asyncio.Task] = None
+        self._pending: dict[str, int] = defaultdict(int)
+        # Set once a conversation has nothing left queued, see flush_conversation
+        self._drained: dict[str, asyncio.Event] = {}
+        # Written while the database was unreachable; still pending, retried
+        self._held: list[dict] = []
+
+        # Backpressure metrics
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.max_depth = 0
+        self.enqueue_waits = 0
+        self.enqueue_wait_seconds = 0.0
+        self.last_batch_size = 0
+        self.last_batch_seconds = 0.0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Write everything still queued, then stop the writer task."""
+        if self._task is None:
+            return
+        await self.flush()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        if self._held:
+            # One last try for what the database could not take earlier
+            held, self._held = self._held, []
+            kept = await self._write(held)
+            self._drop(kept, "writer stopped")
+
+    async def flush(self):
+        """Wait until every message enqueued so far has been written."""
+        await self._queue.join()
+
+    async def flush_conversation(self, conversation_id: str):
+        """
+        Wait until every queued message of one conversation has been written,
+        without waiting for the rest of the queue.
+        """
+        if not self._pending.get(conversation_id):
+            return
+        drained = self._drained.setdefault(conversation_id, asyncio.Event())
+        await drained.wait()
+
+    def pending(self, conversation_id: str) -> int:
+        """Number of queued, not yet written messages for a conversation."""
+        return self._pending.get(conversation_id, 0)
+
+    async def enqueue(
+        self, id: str, conversation_id: str, role: str, content: str, created_at: datetime
+    ):
+        """Queue a message for writing. Waits if the queue is full."""
+        message = {
+            "id": id,
+            "conversation_id": conversation_id,
+            "role": role,
+            "content": content,
+            "created_at": created_at,
+        }
+        self._pending[conversation_id] += 1
+        if self._queue.full():
+            self.enqueue_waits += 1
+            start = time.perf_counter()
+            try:
+                await self._queue.put(message)
+            except BaseException:
+                # Cancelled while waiting for room: the message never got in
+                self._settle(conversation_id)
+                raise
+            self.enqueue_wait_seconds += time.perf_counter() - start
+            logger.warning(
+                f"Message writer queue full ({self.maxsize}); producer waited"
+            )
+        else:
+            self._queue.put_nowait(message)
+        self.enqueued += 1
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # Wake up for held messages even if nothing new arrives
+            timeout = WRITER_RETRY_DELAY if self._held else None
+            try:
+                batch = [await asyncio.wait_for(self._queue.get(), timeout)]
+            except asyncio.TimeoutError:
+                batch = []
+            deadline = loop.time() + self.max_delay
+            while batch and len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            queued = len(batch)
+            batch, self._held = self._held + batch, []
+            # Until the write returns (or if it is cancelled) all of it is kept
+            kept = batch
+            try:
+                kept = await self._write(batch)
+            finally:
+                kept_ids = {message["id"] for message in kept}
+                for message in batch:
+                    if message["id"] not in kept_ids:
+                        self._settle(message["conversation_id"])
+                for _ in range(queued):
+                    self._queue.task_done()
+                self._hold(kept)
+
+    def _settle(self, conversation_id: str):
+        """Count one of a conversation's messages as no longer pending."""
+        self._pending[conversation_id] -= 1
+        if self._pending[conversation_id] <= 0:
+            del self._pending[conversation_id]
+            drained = self._drained.pop(conversation_id, None)
+            if drained is not None:
+                drained.set()
+
+    def _hold(self, messages: list[dict]):
+        """Keep messages for a later retry, dropping the oldest past the cap."""
+        self._held.extend(messages)
+        overflow = len(self._held) - WRITER_RETRY_MAX
+        if overflow > 0:
+            self._drop(self._held[:overflow], "too many held for a retry")
+            del self._held[:overflow]
+
+    def _drop(self, messages: list[dict], reason: str):
+        """Give up on messages that are still counted as pending."""
+        if not messages:
+            return
+        ids = ", ".join(message["id"] for message in messages)
+        logger.error(f"Dropping {len(messages)} messages ({reason}): {ids}")
+        self.dropped += len(messages)
+        writer_dropped.inc(len(messages))
+        for message in messages:
+            self._settle(message["conversation_id"])
+
+    async def _write(self, batch: list[dict]) -> list[dict]:
+        """
+        Write a batch. Rows the database rejects are dropped; returns the
+        messages to hold for a retry because the database was unreachable.
+        """
+        if not batch:
+            return []
+        start = time.perf_counter()
+        dropped = 0
+        kept: list[dict] = []
+        for attempt in range(WRITER_RETRIES):
+            try:
+                await self._insert(batch)
+                break
+            except Exception as e:
+                logger.error(
+                    f"Message batch write failed (attempt {attempt + 1}): {str(e)}"
+                )
+                await asyncio.sleep(0.1 * 2**attempt)
+        else:
+            # Isolate the bad rows so one of them can't sink the whole batch
+            for i, message in enumerate(batch):
+                try:
+                    await self._insert([message])
+                except Exception as e:
+                    if is_unavailable(e):
+                        kept = batch[i:]
+                        logger.error(
+                            f"Holding {len(kept)} messages for a retry: {str(e)}"
+                        )
+                        break
+                    dropped += 1
+                    self.dropped += 1
+                    writer_dropped.inc()
+                    logger.error(f"Dropping message {message['id']}: {str(e)}")
+
+        self.batches += 1
+        self.written += len(batch) - dropped - len(kept)
+        self.last_batch_size = len(batch)
+        self.last_batch_seconds = time.perf_counter() - start
+        writer_batch_duration.observe(self.last_batch_seconds)
+        return kept
+
+    async def _insert(self, batch: list[dict]):
+        # Conversation.updated_at tracks the newest message in each conversation
+        latest: dict[str, datetime] = {}
+        for message in batch:
+            conversation_id = message["conversation_id"]
+            if message["created_at"] > latest.get(conversation_id, datetime.min):
+                latest[conversation_id] = message["created_at"]
+
+        async with SessionLocal() as db:
+            # A retried batch may have been committed before the error
+            await db.execute(insert(Message).on_conflict_do_nothing(), batch)
+            await db.execute(
+                update(Conversation),
+                [{"id": id, "updated_at": ts} for id, ts in latest.items()],
+            )
+            await db.commit()
+
+    def stats(self) -> dict:
+        return {
+            "depth": self._queue.qsize(),
+            "maxsize": self.maxsize,
+            "max_depth": self.max_depth,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "held": len(self._held),
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "enqueue_waits": self.enqueue_waits,
+            "enqueue_wait_seconds": round(self.enqueue_wait_seconds, 6),
+            "last_batch_size": self.last_batch_size,
+            "last_batch_seconds": round(self.last_batch_seconds, 6),
+        }
+
+
+message_writer = MessageWriter()
+
+CallbackGauge(
+    "message_writer_queue_depth",
+    "Messages queued for the background writer.",
+    lambda: message_writer._queue.qsize(),
+)
@@ -0,0 +1,369 @@
+"""
+Admission control for LLM requests.
+Every upstream stream takes a slot from a concurrency limit and is
+charged against its model's requests-per-minute and tokens-per-minute
+buckets. Requests that cannot start yet wait in per-user queues served
+round-robin, so one user's burst does not starve everyone else, and the
+caller is told its place in line with "queued" events.
+
+The limits adapt to the provider: a 429 pauses the model for its
+retry-after, halves the model's refill rate and the concurrency limit, and
+the request is queued again (LLM_RATE_LIMIT_RETRIES times at most, and only
+if nothing was streamed yet). Each successful request then recovers a
+little of both.
+
+LLM_RATE_LIMITS sets per-model budgets as "model=rpm:tpm,..."; models not
+listed use LLM_DEFAULT_RPM and LLM_DEFAULT_TPM. 0 means unlimited.
+
+The scheduler lives in each worker process: LLM_MAX_CONCURRENCY and the
+rpm/tpm budgets apply per worker, so with WEB_WORKERS workers the server as
+a whole may use WEB_WORKERS times as much. Divide the provider's limits by
+the worker count when setting them.
+"""
+
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import aclosing
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+import openai
+
+from app import logger
+from app.utils.context import estimate_tokens
+from app.utils.llm import LLMEvent, LLMProvider
+from app.utils.metrics import CallbackGauge, Counter, Histogram
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "64"))  # per worker
+LLM_RATE_LIMITS = os.getenv("LLM_RATE_LIMITS", "")
+LLM_DEFAULT_RPM = int(os.getenv("LLM_DEFAULT_RPM", "0"))
+LLM_DEFAULT_TPM = int(os.getenv("LLM_DEFAULT_TPM", "0"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "120"))  # seconds
+LLM_RATE_LIMIT_RETRIES = int(os.getenv("LLM_RATE_LIMIT_RETRIES", "3"))
+# Pause after a 429 that carries no retry-after header
+LLM_RATE_LIMIT_BACKOFF = float(os.getenv("LLM_RATE_LIMIT_BACKOFF", "2"))
+
+# The user a request is queued for; set by the request handler
+llm_user: ContextVar[str] = ContextVar("llm_user", default="")
+
+llm_queue_wait = Histogram(
+    "llm_queue_wait_seconds", "Time LLM requests spent queued for admission."
+)
+llm_rate_limited = Counter(
+    "llm_rate_limited_total",
+    "429 responses from the LLM provider, by model.",
+    ("model",),
+)
+
+
+class LLMQueueTimeout(Exception):
+    pass
+
+
+def parse_limits(value: str) -> dict[str, tuple[int, int]]:
+    """Parse "model=rpm:tpm,..." into {model: (rpm, tpm)}."""
+    limits = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        model, _, budget = item.partition("=")
+        rpm, _, tpm = budget.partition(":")
+        limits[model.strip()] = (int(rpm or 0), int(tpm or 0))
+    return limits
+
+
+def retry_after(error: openai.RateLimitError) -> Optional[float]:
+    """Seconds the provider asked us to wait, if it said."""
+    headers = getattr(error.response, "headers", None) or {}
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            value = headers["retry-after"]
+            try:
+                return float(value)
+            except ValueError:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+class TokenBucket:
+    """Refills per_minute units over a minute; may go into debt."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.level = float(per_minute)
+        self._updated = time.monotonic()
+
+    def refill(self, now: float, scale: float):
+        self.level = min(
+            self.capacity, self.level + (now - self._updated) * self.rate * scale
+        )
+        self._updated = now
+
+    def delay(self, amount: float, scale: float) -> float:
+        """Seconds until amount (capped at capacity) is available."""
+        missing = min(amount, self.capacity) - self.level
+        return 0.0 if missing <= 0 else missing / (self.rate * scale)
+
+    def take(self, amount: float):
+        self.level -= amount
+
+
+class ModelLimiter:
+    def __init__(self, rpm: int, tpm: int):
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.paused_until = 0.0
+        # Fraction of the configured refill rate; lowered by 429s
+        self.scale = 1.0
+
+    def delay(self, cost: int, now: float) -> float:
+        wait = max(0.0, self.paused_until - now)
+        if self.requests:
+            self.requests.refill(now, self.scale)
+            wait = max(wait, self.requests.delay(1, self.scale))
+        if self.tokens:
+            self.tokens.refill(now, self.scale)
+            wait = max(wait, self.tokens.delay(cost, self.scale))
+        return wait
+
+    def take(self, cost: int):
+        if self.requests:
+            self.requests.take(1)
+        if self.tokens:
+            self.tokens.take(cost)
+
+    def charge(self, tokens: int):
+        """Correct the token bucket once the real usage is known."""
+        if self.tokens:
+            self.tokens.take(tokens)
+
+
+class Waiter:
+    def __init__(self, user: str, model: str, cost: int):
+        self.user = user
+        self.model = model
+        self.cost = cost
+        self.admitted = False
+        self.position: Optional[int] = None
+        self.enqueued = time.monotonic()
+        self._changed = asyncio.Event()
+
+    def notify(self):
+        self._changed.set()
+
+    async def wait(self):
+        await self._changed.wait()
+        self._changed.clear()
+
+
+class LLMScheduler:
+    def __init__(
+        self,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        limits: Optional[dict[str, tuple[int, int]]] = None,
+        default_limits: tuple[int, int] = (LLM_DEFAULT_RPM, LLM_DEFAULT_TPM),
+        queue_timeout: float = LLM_QUEUE_TIMEOUT,
+    ):
+        self.max_concurrency = max_concurrency
+        # Current (adaptive) concurrency limit
+        self.limit = float(max_concurrency)
+        self.active = 0
+        self.queue_timeout = queue_timeout
+        self._limits = parse_limits(LLM_RATE_LIMITS) if limits is None else limits
+        self._default_limits = default_limits
+        self._limiters: dict[str, ModelLimiter] = {}
+        # user -> waiting requests; users are served in this (rotating) order
+        self._queues: "OrderedDict[str, deque[Waiter]]" = OrderedDict()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def limiter(self, model: str) -> ModelLimiter:
+        limiter = self._limiters.get(model)
+        if limiter is None:
+            rpm, tpm = self._limits.get(model, self._default_limits)
+            limiter = self._limiters[model] = ModelLimiter(rpm, tpm)
+        return limiter
+
+    def submit(self, user: str, model: str, cost: int) -> Waiter:
+        waiter = Waiter(user, model, cost)
+        self._queues.setdefault(user, deque()).append(waiter)
+        self._dispatch()
+        return waiter
+
+    def cancel(self, waiter: Waiter):
+        """Withdraw a waiter, giving its slot back if it was just admitted."""
+        if waiter.admitted:
+            self.release()
+            return
+        queue = self._queues.get(waiter.user)
+        if queue and waiter in queue:
+            queue.remove(waiter)
+            if not queue:
+                del self._queues[waiter.user]
+            self._dispatch()
+
+    def release(self):
+        self.active -= 1
+        self._dispatch()
+
+    def charge(self, model: str, tokens: int):
+        self.limiter(model).charge(tokens)
+
+    def succeeded(self, model: str):
+        # Additive increase: about one more slot per limit's worth of successes
+        self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+        limiter = self.limiter(model)
+        limiter.scale = min(1.0, limiter.scale + 0.05)
+
+    def throttled(self, model: str, delay: Optional[float]):
+        llm_rate_limited.labels(model).inc()
+        limiter = self.limiter(model)
+        delay = LLM_RATE_LIMIT_BACKOFF if delay is None else delay
+        limiter.paused_until = max(limiter.paused_until, time.monotonic() + delay)
+        limiter.scale = max(0.1, limiter.scale / 2)
+        self.limit = max(1.0, self.limit / 2)
+        logger.warning(
+            f"LLM rate limited on {model}: pausing {delay:.1f}s, "
+            f"concurrency limit now {int(self.limit)}"
+        )
+
+    def _dispatch(self):
+        """Admit queued requests while slots and budgets allow."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        wait = None
+        now = time.monotonic()
+        while self._queues and self.active < int(self.limit):
+            chosen = None
+            for user, queue in self._queues.items():
+                delay = self.limiter(queue[0].model).delay(queue[0].cost, now)
+                if delay == 0:
+                    chosen = user
+                    break
+                wait = delay if wait is None else min(wait, delay)
+            if chosen is None:
+                break
+            wait = None
+            queue = self._queues[chosen]
+            waiter = queue.popleft()
+            if queue:
+                self._queues.move_to_end(chosen)
+            else:
+                del self._queues[chosen]
+            self.limiter(waiter.model).take(waiter.cost)
+            self.active += 1
+            waiter.admitted = True
+            llm_queue_wait.observe(now - waiter.enqueued)
+            waiter.notify()
+        if wait is not None:
+            self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+        self._update_positions()
+
+    def _update_positions(self):
+        """
+        Tell every waiter its 1-based place in line. Users are served one
+        request per turn in rotation order, so the k-th request of a user
+        goes after the first k requests of every user, plus the k-th of each
+        user ahead of it in the rotation.
+        """
+        lengths = [len(queue) for queue in self._queues.values()]
+        longest = max(lengths, default=0)
+        # served_before[k]: requests served in turns before turn k
+        longer = [0] * longest
+        for length in lengths:
+            for k in range(length):
+                longer[k] += 1
+        served_before = [0] * longest
+        for k in range(1, longest):
+            served_before[k] = served_before[k - 1] + longer[k - 1]
+        ahead_in_turn = [0] * longest
+        for queue in self._queues.values():
+            for k, waiter in enumerate(queue):
+                position = served_before[k] + ahead_in_turn[k] + 1
+                ahead_in_turn[k] += 1
+                if position != waiter.position:
+                    waiter.position = position
+                    waiter.notify()
+
+
+class ScheduledProvider(LLMProvider):
+    """
+    Wraps a provider with the scheduler. While a request waits it yields
+    LLMEvent("queued", position=n) whenever its place in line changes.
+    """
+
+    def __init__(self, provider: LLMProvider, scheduler: LLMScheduler):
+        self.provider = provider
+        self.scheduler = scheduler
+        self.name = provider.name
+
+    async def stream(self, model: str, messages: list[dict], **kwargs):
+        cost = sum(estimate_tokens(m["content"]) for m in messages)
+        user = llm_user.get()
+        for attempt in range(LLM_RATE_LIMIT_RETRIES + 1):
+            waiter = self.scheduler.submit(user, model, cost)
+            try:
+                deadline = time.monotonic() + self.scheduler.queue_timeout
+                reported = None
+                while not waiter.admitted:
+                    if waiter.position != reported:
+                        reported = waiter.position
+                        yield LLMEvent("queued", position=reported)
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise LLMQueueTimeout(
+                            "The model is busy, please try again shortly"
+                        )
+                    try:
+                        await asyncio.wait_for(waiter.wait(), remaining)
+                    except asyncio.TimeoutError:
+                        pass
+            except BaseException:
+                self.scheduler.cancel(waiter)
+                raise
+
+            emitted = False
+            try:
+                events = self.provider.stream(model, messages, **kwargs)
+                async with aclosing(events):
+                    async for event in events:
+                        if event.type == "delta":
+                            emitted = True
+                        elif event.type == "done" and event.usage:
+                            used = (event.usage.get("input_tokens") or 0) + (
+                                event.usage.get("output_tokens") or 0
+                            )
+                            self.scheduler.charge(model, used - cost)
+                        yield event
+                self.scheduler.succeeded(model)
+                return
+            except openai.RateLimitError as e:
+                self.scheduler.throttled(model, retry_after(e))
+                if emitted or attempt == LLM_RATE_LIMIT_RETRIES:
+                    raise
+            finally:
+                self.scheduler.release()
+
+
+scheduler = LLMScheduler()
+
+CallbackGauge(
+    "llm_active_requests", "LLM requests admitted and running.", lambda: scheduler.active
+)
+CallbackGauge(
+    "llm_queued_requests", "LLM requests waiting for admission.", scheduler.queued
+)
+CallbackGauge(
+    "llm_concurrency_limit",
+    "Current adaptive limit on concurrent LLM requests.",
+    lambda: int(scheduler.limit),
+)
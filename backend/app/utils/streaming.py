@@ -0,0 +1,92 @@
+"""
+Helpers for streaming responses over WebSockets.
+ChunkBuffer coalesces small LLM deltas into fewer, larger frames; frames can
+be sent as JSON text or, when msgpack is installed, as compact binary.
+"""
+
+import asyncio
+import json
+import os
+from typing import Awaitable, Callable, Optional
+
+try:
+    import msgpack
+except ImportError:  # optional dependency
+    msgpack = None
+
+WS_FLUSH_MS = int(os.getenv("WS_FLUSH_MS", "20"))
+WS_FLUSH_BYTES = int(os.getenv("WS_FLUSH_BYTES", "1024"))
+MAX_FLUSH_MS = 1000
+MAX_FLUSH_BYTES = 65536
+
+FRAME_FORMATS = ("json", "msgpack")
+
+
+def encode_frame(frame: dict, frame_format: str = "json"):
+    """Encode a frame as JSON text or msgpack bytes."""
+    if frame_format == "msgpack":
+        return msgpack.packb(frame)
+    return json.dumps(frame, separators=(",", ":"), ensure_ascii=False)
+
+
+def check_frame_format(frame_format: str):
+    """Raise ValueError if frame_format is unknown or unavailable."""
+    if frame_format not in FRAME_FORMATS:
+        raise ValueError(f"Unknown format: {frame_format}")
+    if frame_format == "msgpack" and msgpack is None:
+        raise ValueError("msgpack format is not available on this server")
+
+
+class ChunkBuffer:
+    """
+    Accumulates text and hands it to `flush` once max_bytes of UTF-8 text is
+    pending or max_delay seconds have passed since the first pending write,
+    whichever comes first. A max_delay of 0 disables coalescing.
+    """
+
+    def __init__(
+        self,
+        flush: Callable[[str], Awaitable[None]],
+        max_bytes: int = WS_FLUSH_BYTES,
+        max_delay: float = WS_FLUSH_MS / 1000,
+    ):
+        self._flush = flush
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self._parts: list[str] = []
+        self._size = 0
+        self._timer: Optional[asyncio.Task] = None
+
+    async def write(self, text: str):
+        self._parts.append(text)
+        self._size += len(text.encode())
+        if self.max_delay <= 0 or self._size >= self.max_bytes:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def flush(self):
+        """Send whatever is pending now."""
+        self.cancel()
+        await self._send()
+
+    def cancel(self):
+        """Stop the pending timed flush, if any."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.max_delay)
+        # Detach before sending so a concurrent flush() can't cancel us
+        # mid-send; the sender's lock keeps frames in order
+        self._timer = None
+        await self._send()
+
+    async def _send(self):
+        if not self._parts:
+            return
+        text = "".join(self._parts)
+        self._parts = []
+        self._size = 0
+        await self._flush(text)
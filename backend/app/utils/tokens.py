@@ -0,0 +1,137 @@
+"""
+Verified-token cache and token revocation.
+Clients present the same long-lived JWT on every request, so a successful
+verification is remembered under the token's SHA-256 digest until the token's
+own exp. Logged-out tokens are recorded in the revoked_tokens table and kept
+in a local set that a background task refreshes, so a logout on one worker
+reaches the others within TOKEN_REVOCATION_SYNC_SECONDS.
+"""
+
+import asyncio
+import hashlib
+import os
+import time
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert
+
+from app import logger
+from app.models.database import RevokedToken
+from app.utils.cache import TTLCache
+from app.utils.database import SessionLocal
+
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", "3600"))  # seconds
+TOKEN_REVOCATION_SYNC_SECONDS = float(os.getenv("TOKEN_REVOCATION_SYNC_SECONDS", "10"))
+
+
+def token_digest(token: str) -> bytes:
+    return hashlib.sha256(token.encode()).digest()
+
+
+class TokenCache:
+    """
+    Payloads of tokens that passed signature verification, keyed by digest.
+    Entries never outlive the token's exp; returned payloads are shared and
+    must not be modified.
+    """
+
+    def __init__(self, maxsize: int = TOKEN_CACHE_SIZE, ttl: float = TOKEN_CACHE_TTL):
+        self._cache = TTLCache(maxsize, ttl, name="tokens")
+
+    def get(self, digest: bytes) -> Optional[dict]:
+        payload = self._cache.get(digest)
+        if payload is not None and payload["exp"] <= time.time():
+            self._cache.invalidate(digest)
+            return None
+        return payload
+
+    def put(self, digest: bytes, payload: dict):
+        self._cache.put(digest, payload, ttl=payload["exp"] - time.time())
+
+    def invalidate(self, digest: bytes):
+        self._cache.invalidate(digest)
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+
+class RevocationList:
+    """
+    Digests of revoked tokens, each kept until the token would have expired
+    anyway. Never evicted early: dropping an entry would revive the token.
+    """
+
+    def __init__(self, sync_interval: float = TOKEN_REVOCATION_SYNC_SECONDS):
+        self.sync_interval = sync_interval
+        self._revoked: dict[bytes, float] = {}  # digest -> exp (epoch seconds)
+        self._task: Optional[asyncio.Task] = None
+
+    def __contains__(self, digest: bytes) -> bool:
+        exp = self._revoked.get(digest)
+        if exp is None:
+            return False
+        if exp <= time.time():
+            del self._revoked[digest]
+            return False
+        return True
+
+    def __len__(self) -> int:
+        return len(self._revoked)
+
+    async def revoke(self, digest: bytes, exp: float):
+        """Record the revocation for every worker, then apply it locally."""
+        async with SessionLocal() as db:
+            await db.execute(
+                insert(RevokedToken)
+                .values(token_digest=digest.hex(), expires_at=datetime.fromtimestamp(exp))
+                .on_conflict_do_nothing()
+            )
+            await db.commit()
+        self._revoked[digest] = exp
+
+    async def sync(self):
+        """Load revocations made by other workers and prune expired ones."""
+        now = datetime.now()
+        async with SessionLocal() as db:
+            await db.execute(delete(RevokedToken).where(RevokedToken.expires_at <= now))
+            result = await db.execute(
+                select(RevokedToken.token_digest, RevokedToken.expires_at)
+            )
+            rows = result.all()
+            await db.commit()
+        # Merge rather than replace: a local revoke may have committed after
+        # the select above
+        for digest, expires_at in rows:
+            self._revoked[bytes.fromhex(digest)] = expires_at.timestamp()
+        cutoff = time.time()
+        for digest in [d for d, exp in self._revoked.items() if exp <= cutoff]:
+            del self._revoked[digest]
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sync()
+            except Exception as e:
+                logger.error(f"Token revocation sync failed: {str(e)}")
+            await asyncio.sleep(self.sync_interval)
+
+
+token_cache = TokenCache() if TOKEN_CACHE_SIZE > 0 else None
+revoked_tokens = RevocationList()
@@ -0,0 +1,153 @@
+"""
+Per-request database query tracing.
+A SQLAlchemy event hook counts statements and DB time into the QueryTrace of
+the current context; QueryTraceMiddleware opens one per HTTP request and the
+/ws handler opens one per query. Totals always go to metrics. With DEBUG set
+they are also returned as X-DB-* response headers (and on /ws done frames),
+and statements repeated within one request are logged as likely N+1 queries.
+"""
+
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+
+from app import logger
+from app.utils.metrics import Counter, Histogram
+
+DEBUG = os.getenv("DEBUG", "false").lower() in ("1", "true", "yes")
+# A statement executed this many times in one request is flagged
+DB_TRACE_REPEAT_THRESHOLD = int(os.getenv("DB_TRACE_REPEAT_THRESHOLD", "2"))
+
+db_queries_per_request = Histogram(
+    "db_queries_per_request",
+    "Statements executed per HTTP request or /ws query.",
+    ("kind",),
+    buckets=(0, 1, 2, 3, 4, 5, 8, 13, 21, 34, 55, 100),
+)
+db_time_per_request = Histogram(
+    "db_time_per_request_seconds",
+    "Time spent executing statements per HTTP request or /ws query.",
+    ("kind",),
+)
+db_repeated_requests = Counter(
+    "db_repeated_statement_requests_total",
+    "Requests that executed an identical statement repeatedly.",
+    ("kind",),
+)
+
+_current: ContextVar[Optional["QueryTrace"]] = ContextVar("query_trace", default=None)
+
+
+class QueryTrace:
+    __slots__ = ("statements", "seconds", "counts", "_start")
+
+    def __init__(self):
+        self.statements = 0
+        self.seconds = 0.0
+        # SQL text -> executions; parameters are not part of the key, so a
+        # loop issuing the same query for different rows shows up here
+        self.counts: dict[str, int] = {}
+        self._start = 0.0
+
+    def repeated(self, threshold: int = DB_TRACE_REPEAT_THRESHOLD) -> dict[str, int]:
+        return {sql: n for sql, n in self.counts.items() if n >= threshold}
+
+    def summary(self) -> dict:
+        return {
+            "queries": self.statements,
+            "time_ms": round(self.seconds * 1000, 3),
+            "repeated": len(self.repeated()),
+        }
+
+
+def current_trace() -> Optional[QueryTrace]:
+    return _current.get()
+
+
+@contextmanager
+def trace_queries(kind: str, label: str = ""):
+    """
+    Trace the statements executed in this context and record them under
+    `kind` ("http" or "ws") when the block exits. `label` (a path or query
+    id) only appears in DEBUG log lines.
+    """
+    trace = QueryTrace()
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+        record(kind, label, trace)
+
+
+def record(kind: str, label: str, trace: QueryTrace):
+    db_queries_per_request.labels(kind).observe(trace.statements)
+    db_time_per_request.labels(kind).observe(trace.seconds)
+    repeated = trace.repeated()
+    if repeated:
+        db_repeated_requests.labels(kind).inc()
+        if DEBUG:
+            for sql, count in repeated.items():
+                logger.warning(
+                    f"{kind} {label}: statement executed {count} times: "
+                    f"{' '.join(sql.split())[:200]}"
+                )
+
+
+def _before_cursor_execute(conn, cursor, statement, *args):
+    trace = _current.get()
+    if trace is not None:
+        trace._start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, *args):
+    trace = _current.get()
+    if trace is not None:
+        trace.seconds += time.perf_counter() - trace._start
+        trace.statements += 1
+        trace.counts[statement] = trace.counts.get(statement, 0) + 1
+
+
+def install_query_tracing(engine):
+    """Attach the tracing hooks to an (async) engine. Safe to call twice."""
+    sync_engine = getattr(engine, "sync_engine", engine)
+    if not event.contains(sync_engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class QueryTraceMiddleware:
+    """
+    ASGI middleware that traces DB statements per HTTP request. In DEBUG mode
+    the totals so far are added to the response as X-DB-Queries, X-DB-Time-Ms
+    and X-DB-Repeated when the response starts.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        with trace_queries("http", scope["path"]) as trace:
+            if not DEBUG:
+                await self.app(scope, receive, send)
+                return
+
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start":
+                    summary = trace.summary()
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"x-db-queries", str(summary["queries"]).encode()),
+                        (b"x-db-time-ms", str(summary["time_ms"]).encode()),
+                        (b"x-db-repeated", str(summary["repeated"]).encode()),
+                    ]
+                await send(message)
+
+            await self.app(scope, receive, send_wrapper)
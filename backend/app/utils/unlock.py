@@ -0,0 +1,199 @@
+"""
+Unlock-session stores for /keys.
+An unlock session holds the key derived from a user's password for a few
+minutes so their stored passwords can be decrypted. UNLOCK_STORE selects:
+- "memory" (default): process-local, with a background sweep of expired
+  sessions and a cap of UNLOCK_MAX_SESSIONS. Each worker has its own.
+- "database": the unlock_sessions table, shared by every worker. Derived keys
+  are stored wrapped (Fernet-encrypted) under UNLOCK_SERVER_KEY, never raw.
+"""
+
+import asyncio
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional
+
+from cryptography.fernet import Fernet
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert
+
+from app import logger
+from app.models.database import UnlockSession
+from app.utils.database import SessionLocal
+from app.utils.executor import run_cpu
+from app.utils.metrics import CallbackGauge
+
+UNLOCK_STORE = os.getenv("UNLOCK_STORE", "memory")
+UNLOCK_MAX_SESSIONS = int(os.getenv("UNLOCK_MAX_SESSIONS", "10000"))
+UNLOCK_SWEEP_SECONDS = float(os.getenv("UNLOCK_SWEEP_SECONDS", "60"))
+# Fernet key (Fernet.generate_key()) wrapping derived keys in the database store
+UNLOCK_SERVER_KEY = os.getenv("UNLOCK_SERVER_KEY")
+
+
+class UnlockStore(ABC):
+    def __init__(self, sweep_interval: float = UNLOCK_SWEEP_SECONDS):
+        self.sweep_interval = sweep_interval
+        self._task: Optional[asyncio.Task] = None
+
+    @abstractmethod
+    async def put(self, email: str, key: bytes, ttl: float):
+        """Unlock email for ttl seconds with the given derived key."""
+
+    @abstractmethod
+    async def get(self, email: str) -> Optional[bytes]:
+        """Return the derived key if email is unlocked, else None."""
+
+    @abstractmethod
+    async def delete(self, email: str):
+        """Lock email again."""
+
+    @abstractmethod
+    async def sweep(self) -> int:
+        """Remove expired sessions; returns how many were removed."""
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Unlock session sweep failed: {str(e)}")
+
+
+class MemoryUnlockStore(UnlockStore):
+    def __init__(
+        self,
+        maxsize: int = UNLOCK_MAX_SESSIONS,
+        sweep_interval: float = UNLOCK_SWEEP_SECONDS,
+    ):
+        super().__init__(sweep_interval)
+        self.maxsize = maxsize
+        # email -> (monotonic deadline, key), least recently unlocked first
+        self._sessions: "OrderedDict[str, tuple[float, bytes]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    async def put(self, email: str, key: bytes, ttl: float):
+        self._sessions[email] = (time.monotonic() + ttl, key)
+        self._sessions.move_to_end(email)
+        while len(self._sessions) > self.maxsize:
+            # Over the cap: the oldest unlock has to unlock again
+            self._sessions.popitem(last=False)
+
+    async def get(self, email: str) -> Optional[bytes]:
+        session = self._sessions.get(email)
+        if session is None:
+            return None
+        if session[0] <= time.monotonic():
+            del self._sessions[email]
+            return None
+        return session[1]
+
+    async def delete(self, email: str):
+        self._sessions.pop(email, None)
+
+    async def sweep(self) -> int:
+        now = time.monotonic()
+        expired = [email for email, (deadline, _) in self._sessions.items() if deadline <= now]
+        for email in expired:
+            del self._sessions[email]
+        return len(expired)
+
+
+class DatabaseUnlockStore(UnlockStore):
+    def __init__(
+        self,
+        server_key: Optional[str] = UNLOCK_SERVER_KEY,
+        sweep_interval: float = UNLOCK_SWEEP_SECONDS,
+    ):
+        super().__init__(sweep_interval)
+        if not server_key:
+            raise ValueError("UNLOCK_SERVER_KEY is required for UNLOCK_STORE=database")
+        self._fernet = Fernet(server_key)
+
+    async def put(self, email: str, key: bytes, ttl: float):
+        wrapped = await run_cpu(self._fernet.encrypt, key)
+        expires_at = datetime.now() + timedelta(seconds=ttl)
+        values = {"email": email, "wrapped_key": wrapped.decode(), "expires_at": expires_at}
+        async with SessionLocal() as db:
+            await db.execute(
+                insert(UnlockSession)
+                .values(**values)
+                .on_conflict_do_update(index_elements=["email"], set_=values)
+            )
+            await db.commit()
+
+    async def get(self, email: str) -> Optional[bytes]:
+        async with SessionLocal() as db:
+            result = await db.execute(
+                select(UnlockSession.wrapped_key).where(
+                    UnlockSession.email == email,
+                    UnlockSession.expires_at > datetime.now(),
+                )
+            )
+            wrapped = result.scalar_one_or_none()
+        if wrapped is None:
+            return None
+        return await run_cpu(self._fernet.decrypt, wrapped.encode())
+
+    async def delete(self, email: str):
+        async with SessionLocal() as db:
+            await db.execute(delete(UnlockSession).where(UnlockSession.email == email))
+            await db.commit()
+
+    async def sweep(self) -> int:
+        async with SessionLocal() as db:
+            result = await db.execute(
+                delete(UnlockSession).where(UnlockSession.expires_at <= datetime.now())
+            )
+            await db.commit()
+        return result.rowcount
+
+
+UNLOCK_STORES = {
+    "memory": MemoryUnlockStore,
+    "database": DatabaseUnlockStore,
+}
+
+_store: Optional[UnlockStore] = None
+
+
+def get_unlock_store() -> UnlockStore:
+    """Return the process-wide store selected by UNLOCK_STORE."""
+    global _store
+    if _store is None:
+        if UNLOCK_STORE not in UNLOCK_STORES:
+            raise ValueError(f"Unknown UNLOCK_STORE: {UNLOCK_STORE}")
+        _store = UNLOCK_STORES[UNLOCK_STORE]()
+    return _store
+
+
+def set_unlock_store(store: Optional[UnlockStore]):
+    """Replace the process-wide store, e.g. from a benchmark harness."""
+    global _store
+    _store = store
+
+
+CallbackGauge(
+    "unlock_sessions",
+    "Unlock sessions held in this process (memory store only).",
+    lambda: len(_store) if isinstance(_store, MemoryUnlockStore) else 0,
+)
@@ -1,30 +1,64 @@
+import base64
+import json
 import time
 import asyncio
+from datetime import datetime
 from functools import wraps
 
 from app import logger
+from app.utils.metrics import function_duration
 
 
 def timer(func):
+    """Log each call's duration and record it in function_duration_seconds."""
+    histogram = function_duration.labels(func.__name__)
+
     if asyncio.iscoroutinefunction(func):
 
         @wraps(func)
         async def async_wrapper(*args, **kwargs):
-            start_time = time.time()
-            result = await func(*args, **kwargs)
-            end_time = time.time()
-            logger.info(f"{func.__name__} took {end_time - start_time:.4f} seconds")
-            return result
+            start_time = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start_time
+                histogram.observe(elapsed)
+                logger.info(f"{func.__name__} took {elapsed:.4f} seconds")
 
         return async_wrapper
     else:
 
         @wraps(func)
         def sync_wrapper(*args, **kwargs):
-            start_time = time.time()
-            result = func(*args, **kwargs)
-            end_time = time.time()
-            logger.info(f"{func.__name__} took {end_time - start_time:.4f} seconds")
-            return result
+            start_time = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start_time
+                histogram.observe(elapsed)
+                logger.info(f"{func.__name__} took {elapsed:.4f} seconds")
 
         return sync_wrapper
+
+
+def encode_cursor(*values) -> str:
+    """
+    Encode keyset pagination values into an opaque, URL-safe cursor string.
+    Datetimes are stored as ISO strings; decode_cursor does not convert back.
+    """
+    payload = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> list:
+    """
+    Decode a cursor produced by encode_cursor.
+    Raises ValueError if the cursor is malformed.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {str(e)}")
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor")
+    return values
@@ -4,11 +4,13 @@ from pydantic import BaseModel
 from datetime import datetime, timedelta, timezone
 import jwt
 import os
+import uuid
 from typing import Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.utils.auth import verify_password, create_user
+from app.utils.auth import verify_password, create_user, get_user
 from app.utils.database import get_db
+from app.utils.tokens import revoked_tokens, token_cache, token_digest
 from app.utils.utils import timer
 from app.models.database import User
 
@@ -65,6 +67,8 @@ def create_jwt_token(email: str) -> str:
         "email": email,
         "exp": int(expiration.timestamp()),
         "iat": int(now.timestamp()),
+        # Unique per login, so revoking one token never revokes another
+        "jti": uuid.uuid4().hex,
     }
     token = jwt.encode(payload, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
     return token
@@ -73,13 +77,25 @@ def create_jwt_token(email: str) -> str:
 def verify_token(token: Optional[str]) -> dict:
     """
     Verify JWT token and return decoded payload.
-    Raises HTTPException if token is invalid or expired.
+    Raises HTTPException if token is invalid, expired or revoked.
+    Verified tokens are cached until they expire; the returned payload may
+    be shared between requests and must not be modified.
     """
     if not token:
         raise HTTPException(status_code=401, detail="Authentication required")
 
+    digest = token_digest(token)
+    if digest in revoked_tokens:
+        raise HTTPException(status_code=401, detail="Token revoked")
+    if token_cache is not None:
+        payload = token_cache.get(digest)
+        if payload is not None:
+            return payload
+
     try:
         payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
+        if token_cache is not None:
+            token_cache.put(digest, payload)
         return payload
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
@@ -179,10 +195,21 @@ async def logout(
     credentials: Optional[HTTPAuthorizationCredentials] = Depends(security),
 ):
     """
-    Logout user by clearing cookie.
-    With JWT tokens, we just delete the cookie - the token itself becomes invalid
-    when it expires. For immediate invalidation, you'd need a token blacklist.
+    Logout user by revoking the presented token and clearing the cookie.
+    The revocation holds on every worker until the token would have expired.
     """
+    token = get_token_from_request(request, credentials)
+    if token:
+        try:
+            payload = verify_token(token)
+        except HTTPException:
+            payload = None  # already expired, revoked or invalid
+        if payload is not None:
+            digest = token_digest(token)
+            await revoked_tokens.revoke(digest, payload["exp"])
+            if token_cache is not None:
+                token_cache.invalidate(digest)
+
     response.delete_cookie(key="session_token", path="/")
     return {"message": "Logged out successfully"}
 
@@ -224,16 +251,13 @@ async def get_current_user_obj(
     Dependency function to get current User object from JWT token.
     Use this in other endpoints that require the full User object.
     Supports both Authorization header and cookie-based auth.
+    The user comes from the user cache and is detached from `db`.
     """
-    from sqlalchemy import select
-
     token = get_token_from_request(request, credentials)
     payload = verify_token(token)
     email = payload["email"]
 
-    # Get user from database using async query
-    result = await db.execute(select(User).filter(User.email == email))
-    user = result.scalar_one_or_none()
+    user = await get_user(email, db)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
@@ -1,40 +1,231 @@
-from fastapi import APIRouter, Depends, HTTPException
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import and_, cast, func, or_, select, tuple_
+from sqlalchemy.dialects.postgresql import REAL
 from sqlalchemy.orm import selectinload
 
 from app.utils.database import get_db
-from app.utils.utils import timer
+from app.utils.utils import timer, encode_cursor, decode_cursor
 from app.views.auth import get_current_user_obj
 from app.models.database import Conversation, Message
 
 conversation_router = APIRouter(prefix="/c")
 
+SNIPPET_LENGTH = 120
+SEARCH_CONFIG = "english"
+SEARCH_HEADLINE_OPTIONS = "StartSel=<mark>, StopSel=</mark>, MaxFragments=2, MaxWords=20"
+
 
 @conversation_router.get("/list")
 @timer
 async def list_conversations(
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
     user=Depends(get_current_user_obj),
     db: AsyncSession = Depends(get_db),
 ):
-    # Filter conversations by user email
-    result = await db.execute(
-        select(Conversation)
+    """
+    List the user's conversations, most recently updated first.
+    Keyset-paginated on (updated_at, id): pass the returned next_cursor back
+    as `cursor` to fetch the next page. Conversations without updated_at
+    sort first, as Postgres orders NULLs in a descending index scan.
+    """
+    # Latest message content per conversation, resolved through
+    # idx_messages_conversation_id (one index probe per returned row)
+    snippet = (
+        select(func.left(Message.content, SNIPPET_LENGTH))
+        .where(Message.conversation_id == Conversation.id)
+        .order_by(Message.created_at.desc())
+        .limit(1)
+        .correlate(Conversation)
+        .scalar_subquery()
+    )
+
+    query = (
+        select(
+            Conversation.id,
+            Conversation.title,
+            Conversation.updated_at,
+            snippet.label("snippet"),
+        )
         .filter(Conversation.user_email == user.email, Conversation.hidden == False)
-        .order_by(Conversation.updated_at.desc())
+        .order_by(Conversation.updated_at.desc(), Conversation.id.desc())
+        .limit(limit + 1)
     )
-    conversations = result.scalars().all()
+
+    if cursor:
+        try:
+            updated_at, conversation_id = decode_cursor(cursor)
+            if not isinstance(conversation_id, str):
+                raise ValueError("Invalid cursor")
+            if updated_at is not None:
+                updated_at = datetime.fromisoformat(updated_at)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        if updated_at is None:
+            # Still among the undated rows: the rest of them, then every dated one
+            query = query.filter(
+                or_(
+                    and_(
+                        Conversation.updated_at.is_(None),
+                        Conversation.id < conversation_id,
+                    ),
+                    Conversation.updated_at.is_not(None),
+                )
+            )
+        else:
+            # A row comparison with NULL is never true, so undated rows (all
+            # on earlier pages) drop out here
+            query = query.filter(
+                tuple_(Conversation.updated_at, Conversation.id)
+                < tuple_(updated_at, conversation_id)
+            )
+
+    result = await db.execute(query)
+    rows = result.all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].updated_at, rows[-1].id)
 
     # Format response
-    return [
-        {
-            "id": conv.id,
-            "title": conv.title,
-            "updated_at": conv.updated_at.isoformat() if conv.updated_at else None,
-            "snippet": "",  # Could add snippet logic here
-        }
-        for conv in conversations
-    ]
+    return {
+        "conversations": [
+            {
+                "id": row.id,
+                "title": row.title,
+                "updated_at": row.updated_at.isoformat() if row.updated_at else None,
+                "snippet": row.snippet or "",
+            }
+            for row in rows
+        ],
+        "next_cursor": next_cursor,
+    }
+
+
+def build_search_query(
+    email: str, q: str, limit: int, after: Optional[tuple[float, str]] = None
+):
+    """
+    Build the full-text search statement used by /c/search.
+    Matches are grouped per conversation, ranked by the best message (ts_rank)
+    and keyset-paginated on (rank, conversation id). Fetches limit + 1 rows so
+    callers can tell whether another page exists.
+    """
+    tsquery = func.websearch_to_tsquery(SEARCH_CONFIG, q)
+
+    # Matching messages; the @@ predicate is served by idx_messages_ts_vector
+    hits = (
+        select(
+            Message.conversation_id,
+            Message.id.label("message_id"),
+            Message.content,
+            Message.created_at,
+            func.ts_rank(Message.content_tsv, tsquery).label("rank"),
+        )
+        .join(Conversation, Conversation.id == Message.conversation_id)
+        .filter(
+            Conversation.user_email == email,
+            Conversation.hidden == False,
+            Message.content_tsv.op("@@")(tsquery),
+        )
+        .cte("hits")
+    )
+
+    # Best hit per conversation plus the number of hits in that conversation
+    ranked = select(
+        hits,
+        func.count().over(partition_by=hits.c.conversation_id).label("hit_count"),
+        func.row_number()
+        .over(
+            partition_by=hits.c.conversation_id,
+            order_by=(hits.c.rank.desc(), hits.c.created_at.desc()),
+        )
+        .label("position"),
+    ).subquery("ranked")
+
+    page = select(ranked).filter(ranked.c.position == 1)
+    if after:
+        rank, conversation_id = after
+        page = page.filter(
+            tuple_(ranked.c.rank, ranked.c.conversation_id)
+            < tuple_(cast(rank, REAL), conversation_id)
+        )
+    page = (
+        page.order_by(ranked.c.rank.desc(), ranked.c.conversation_id.desc())
+        .limit(limit + 1)
+        .subquery("page")
+    )
+
+    # ts_headline is expensive, so only compute it for the rows being returned
+    return (
+        select(
+            page.c.conversation_id,
+            page.c.message_id,
+            page.c.created_at,
+            page.c.rank,
+            page.c.hit_count,
+            Conversation.title,
+            Conversation.updated_at,
+            func.ts_headline(
+                SEARCH_CONFIG, page.c.content, tsquery, SEARCH_HEADLINE_OPTIONS
+            ).label("headline"),
+        )
+        .join(Conversation, Conversation.id == page.c.conversation_id)
+        .order_by(page.c.rank.desc(), page.c.conversation_id.desc())
+    )
+
+
+@conversation_router.get("/search")
+@timer
+async def search_conversations(
+    q: str = Query(..., min_length=1, max_length=256),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    user=Depends(get_current_user_obj),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Full-text search over the user's messages, grouped by conversation.
+    Returns highlighted snippets of the best-matching message per conversation.
+    """
+    after = None
+    if cursor:
+        try:
+            rank, conversation_id = decode_cursor(cursor)
+            after = (float(rank), str(conversation_id))
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    result = await db.execute(build_search_query(user.email, q, limit, after))
+    rows = result.all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].rank, rows[-1].conversation_id)
+
+    return {
+        "results": [
+            {
+                "id": row.conversation_id,
+                "title": row.title,
+                "updated_at": row.updated_at.isoformat() if row.updated_at else None,
+                "rank": row.rank,
+                "hits": row.hit_count,
+                "message_id": row.message_id,
+                "message_created_at": (
+                    row.created_at.isoformat() if row.created_at else None
+                ),
+                "snippet": row.headline,
+            }
+            for row in rows
+        ],
+        "next_cursor": next_cursor,
+    }
 
 
 @conversation_router.get("/{conversation_id}")
@@ -1,56 +1,62 @@
 from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 from datetime import datetime, timedelta
-from typing import Optional, Dict
+from typing import AsyncIterator, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import delete, insert, select
+from cryptography.fernet import Fernet
+import json
+import os
 import uuid
 
-from app.utils.database import get_db
+from app.utils.database import SessionLocal, get_db
 from app.utils.auth import verify_password
 from app.utils.encryption import (
-    encrypt_password,
-    decrypt_password,
     derive_key_from_password,
+    fernet_decrypt,
+    fernet_decrypt_many,
+    fernet_encrypt,
+    fernet_encrypt_many,
 )
+from app.utils.executor import run_cpu
+from app.utils.unlock import get_unlock_store
 from app.models.database import UserKeys, User
 from app.views.auth import get_token_from_request, verify_token, get_current_email
 
 keys_router = APIRouter(prefix="/keys")
 security = HTTPBearer(auto_error=False)
 
-# In-memory storage for unlock sessions
-# Stores: email -> (unlock_timestamp, derived_encryption_key)
-# In production, consider using Redis or similar
-unlock_sessions: Dict[str, tuple[datetime, bytes]] = {}
 UNLOCK_DURATION = timedelta(minutes=5)
 
+# Items per /keys/batch or /keys/decrypt call, and lines per /keys/import
+KEYS_BATCH_MAX = int(os.getenv("KEYS_BATCH_MAX", "1000"))
+KEYS_IMPORT_MAX = int(os.getenv("KEYS_IMPORT_MAX", "10000"))
+# Rows per query partition, insert and executor job in the bulk endpoints
+KEYS_CHUNK_SIZE = 256
+NDJSON = "application/x-ndjson"
+# Longest /keys/import line, in bytes
+NDJSON_MAX_LINE = 64 * 1024
 
-def is_unlocked(email: str) -> bool:
+
+async def is_unlocked(email: str) -> bool:
     """Check if user's keys are currently unlocked."""
-    if email not in unlock_sessions:
-        return False
-    unlock_time, _ = unlock_sessions[email]
-    if datetime.now() > unlock_time + UNLOCK_DURATION:
-        # Session expired
-        del unlock_sessions[email]
-        return False
-    return True
+    return await get_encryption_key(email) is not None
 
 
-def get_encryption_key(email: str) -> Optional[bytes]:
+async def get_encryption_key(email: str) -> Optional[bytes]:
     """Get the stored encryption key for a user if unlocked."""
-    if not is_unlocked(email):
-        return None
-    _, encryption_key = unlock_sessions[email]
-    return encryption_key
+    return await get_unlock_store().get(email)
 
 
-def unlock_user(email: str, user_password: str):
+async def unlock_user(email: str, user_password: str):
     """Unlock user's keys for 5 minutes and store derived encryption key."""
-    encryption_key = derive_key_from_password(user_password)
-    unlock_sessions[email] = (datetime.now(), encryption_key)
+    # PBKDF2 takes tens of milliseconds; keep it off the event loop
+    encryption_key = await run_cpu(derive_key_from_password, user_password)
+    await get_unlock_store().put(
+        email, encryption_key, UNLOCK_DURATION.total_seconds()
+    )
 
 
 class UnlockRequest(BaseModel):
@@ -82,6 +88,140 @@ class KeyDetailResponse(BaseModel):
     updated_at: str
 
 
+class KeyBatchUpdate(KeyUpdateRequest):
+    id: str
+
+
+class KeyBatchRequest(BaseModel):
+    create: list[KeyCreateRequest] = []
+    update: list[KeyBatchUpdate] = []
+    delete: list[str] = []
+
+
+class KeyBatchResponse(BaseModel):
+    created: list[KeyResponse]
+    updated: list[KeyResponse]
+    deleted: list[str]
+
+
+class KeyDecryptRequest(BaseModel):
+    ids: Optional[list[str]] = None  # every key if omitted
+
+
+def key_response(key: UserKeys) -> KeyResponse:
+    return KeyResponse(
+        id=key.id,
+        key=key.key,
+        created_at=key.created_at.isoformat(),
+        updated_at=key.updated_at.isoformat(),
+    )
+
+
+async def require_encryption_key(email: str) -> bytes:
+    """Return the user's encryption key, or raise 403 if keys are locked."""
+    encryption_key = await get_encryption_key(email)
+    if not encryption_key:
+        raise HTTPException(
+            status_code=403,
+            detail="Keys are locked. Please verify your password first.",
+        )
+    return encryption_key
+
+
+async def decrypted_keys(
+    user_email: str, encryption_key: bytes, ids: Optional[list[str]] = None
+) -> AsyncIterator[dict]:
+    """
+    Yield the user's keys with decrypted passwords, newest first. Rows are
+    read and decrypted KEYS_CHUNK_SIZE at a time, one executor job per chunk
+    and one Fernet for the whole stream. A key that fails to decrypt is
+    yielded with an "error".
+    """
+    fernet = Fernet(encryption_key)
+    query = (
+        select(
+            UserKeys.id,
+            UserKeys.key,
+            UserKeys.encrypted_password,
+            UserKeys.created_at,
+            UserKeys.updated_at,
+        )
+        .filter(UserKeys.user_email == user_email)
+        .order_by(UserKeys.updated_at.desc(), UserKeys.id)
+        .execution_options(yield_per=KEYS_CHUNK_SIZE)
+    )
+    if ids is not None:
+        query = query.filter(UserKeys.id.in_(ids))
+
+    # Own session: a streamed response outlives the request's dependencies
+    async with SessionLocal() as db:
+        result = await db.stream(query)
+        async for rows in result.partitions():
+            passwords = await run_cpu(
+                fernet_decrypt_many, fernet, [row.encrypted_password for row in rows]
+            )
+            for row, password in zip(rows, passwords):
+                item = {
+                    "id": row.id,
+                    "key": row.key,
+                    "created_at": row.created_at.isoformat(),
+                    "updated_at": row.updated_at.isoformat(),
+                }
+                if password is None:
+                    item["error"] = "Failed to decrypt password"
+                else:
+                    item["password"] = password
+                yield item
+
+
+async def ndjson_lines(items: AsyncIterator[dict]) -> AsyncIterator[str]:
+    async for item in items:
+        yield json.dumps(item) + "\n"
+
+
+def parse_ndjson_line(line_number: int, line: bytes) -> object:
+    if len(line) > NDJSON_MAX_LINE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Line {line_number}: longer than {NDJSON_MAX_LINE} bytes",
+        )
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        # JSONDecodeError, or UnicodeDecodeError for a line that isn't UTF-8
+        raise HTTPException(
+            status_code=400, detail=f"Line {line_number}: Invalid JSON: {str(e)}"
+        )
+
+
+async def read_ndjson(request: Request) -> AsyncIterator[tuple[int, object]]:
+    """
+    Parse an NDJSON request body as it arrives, yielding (line number, value).
+    A line that is not valid JSON or longer than NDJSON_MAX_LINE is a 400.
+    """
+    # Pieces of the line that is still unterminated
+    tail: list[bytes] = []
+    tail_size = 0
+    line_number = 0
+    async for chunk in request.stream():
+        *lines, rest = chunk.split(b"\n")
+        for line in lines:
+            line_number += 1
+            if tail:
+                line = b"".join(tail) + line
+                tail, tail_size = [], 0
+            if line.strip():
+                yield line_number, parse_ndjson_line(line_number, line)
+        if rest:
+            tail.append(rest)
+            tail_size += len(rest)
+            if tail_size > NDJSON_MAX_LINE:
+                parse_ndjson_line(line_number + 1, b"".join(tail))
+    line = b"".join(tail)
+    if line.strip():
+        yield line_number + 1, parse_ndjson_line(line_number + 1, line)
+
+
 @keys_router.post("/unlock")
 async def unlock_keys(
     request: UnlockRequest,
@@ -97,7 +237,7 @@ async def unlock_keys(
         raise HTTPException(status_code=401, detail="Invalid password")
 
     # Unlock for 5 minutes and store encryption key
-    unlock_user(user_email, request.password)
+    await unlock_user(user_email, request.password)
     return {"message": "Keys unlocked for 5 minutes", "unlocked": True}
 
 
@@ -129,6 +269,191 @@ async def list_keys(
     ]
 
 
+@keys_router.post("/batch")
+async def batch_keys(
+    request: KeyBatchRequest,
+    user_email: str = Depends(get_current_email),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Create, update and delete many keys in one transaction. If any update or
+    delete names a key that doesn't exist, nothing is changed.
+    Requires user to be unlocked when any password is set.
+    """
+    total = len(request.create) + len(request.update) + len(request.delete)
+    if total > KEYS_BATCH_MAX:
+        raise HTTPException(
+            status_code=400, detail=f"At most {KEYS_BATCH_MAX} items per batch"
+        )
+    ids = [item.id for item in request.update] + request.delete
+    if len(set(ids)) != len(ids):
+        raise HTTPException(
+            status_code=400, detail="Each key id may appear only once per batch"
+        )
+
+    # Encrypt every new password in one executor job with one Fernet
+    new_passwords = [item.password for item in request.create] + [
+        item.password for item in request.update if item.password is not None
+    ]
+    encrypted = []
+    if new_passwords:
+        encryption_key = await require_encryption_key(user_email)
+        encrypted = await run_cpu(
+            fernet_encrypt_many, Fernet(encryption_key), new_passwords
+        )
+    encrypted = iter(encrypted)
+
+    now = datetime.now()
+    created = []
+    for item in request.create:
+        key = UserKeys(
+            id=str(uuid.uuid4()),
+            user_email=user_email,
+            key=item.key,
+            encrypted_password=next(encrypted),
+            created_at=now,
+            updated_at=now,
+        )
+        db.add(key)
+        created.append(key)
+
+    updated = []
+    if request.update:
+        result = await db.execute(
+            select(UserKeys).filter(
+                UserKeys.id.in_([item.id for item in request.update]),
+                UserKeys.user_email == user_email,
+            )
+        )
+        existing = {key.id: key for key in result.scalars()}
+        missing = [item.id for item in request.update if item.id not in existing]
+        if missing:
+            raise HTTPException(
+                status_code=404, detail=f"Keys not found: {', '.join(missing)}"
+            )
+        for item in request.update:
+            key = existing[item.id]
+            if item.key is not None:
+                key.key = item.key
+            if item.password is not None:
+                key.encrypted_password = next(encrypted)
+            key.updated_at = now
+            updated.append(key)
+
+    if request.delete:
+        result = await db.execute(
+            delete(UserKeys).where(
+                UserKeys.id.in_(request.delete), UserKeys.user_email == user_email
+            )
+        )
+        if result.rowcount != len(request.delete):
+            await db.rollback()
+            raise HTTPException(status_code=404, detail="Keys to delete not found")
+
+    await db.commit()
+
+    return KeyBatchResponse(
+        created=[key_response(key) for key in created],
+        updated=[key_response(key) for key in updated],
+        deleted=request.delete,
+    )
+
+
+@keys_router.post("/decrypt")
+async def decrypt_keys(
+    body: KeyDecryptRequest,
+    request: Request,
+    user_email: str = Depends(get_current_email),
+):
+    """
+    Fetch and decrypt many keys in one call (every key if ids is omitted).
+    Returns a JSON list, or streams NDJSON (one key per line) when the client
+    sends Accept: application/x-ndjson. Requires user to be unlocked.
+    """
+    if body.ids is not None and len(body.ids) > KEYS_BATCH_MAX:
+        raise HTTPException(
+            status_code=400, detail=f"At most {KEYS_BATCH_MAX} ids per request"
+        )
+    encryption_key = await require_encryption_key(user_email)
+
+    items = decrypted_keys(user_email, encryption_key, body.ids)
+    if NDJSON in request.headers.get("accept", ""):
+        return StreamingResponse(ndjson_lines(items), media_type=NDJSON)
+    return [item async for item in items]
+
+
+@keys_router.get("/export")
+async def export_keys(user_email: str = Depends(get_current_email)):
+    """
+    Stream every key with its decrypted password as NDJSON.
+    Requires user to be unlocked.
+    """
+    encryption_key = await require_encryption_key(user_email)
+    return StreamingResponse(
+        ndjson_lines(decrypted_keys(user_email, encryption_key)),
+        media_type=NDJSON,
+        headers={"Content-Disposition": 'attachment; filename="keys.ndjson"'},
+    )
+
+
+@keys_router.post("/import")
+async def import_keys(
+    request: Request,
+    user_email: str = Depends(get_current_email),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Import keys from an NDJSON body, one {"key": ..., "password": ...} object
+    per line, in a single transaction: a bad line imports nothing.
+    Requires user to be unlocked.
+    """
+    fernet = Fernet(await require_encryption_key(user_email))
+
+    pending: list[KeyCreateRequest] = []
+    imported = 0
+
+    async def insert_pending():
+        nonlocal imported
+        encrypted = await run_cpu(
+            fernet_encrypt_many, fernet, [item.password for item in pending]
+        )
+        now = datetime.now()
+        await db.execute(
+            insert(UserKeys),
+            [
+                {
+                    "id": str(uuid.uuid4()),
+                    "user_email": user_email,
+                    "key": item.key,
+                    "encrypted_password": encrypted_password,
+                    "created_at": now,
+                    "updated_at": now,
+                }
+                for item, encrypted_password in zip(pending, encrypted)
+            ],
+        )
+        imported += len(pending)
+        pending.clear()
+
+    async for line_number, value in read_ndjson(request):
+        if imported + len(pending) >= KEYS_IMPORT_MAX:
+            raise HTTPException(
+                status_code=400,
+                detail=f"At most {KEYS_IMPORT_MAX} keys per import",
+            )
+        try:
+            pending.append(KeyCreateRequest.model_validate(value))
+        except ValidationError as e:
+            raise HTTPException(status_code=400, detail=f"Line {line_number}: {str(e)}")
+        if len(pending) >= KEYS_CHUNK_SIZE:
+            await insert_pending()
+    if pending:
+        await insert_pending()
+
+    await db.commit()
+    return {"imported": imported}
+
+
 @keys_router.get("/{key_id}")
 async def get_key(
     key_id: str,
@@ -142,7 +467,7 @@ async def get_key(
     """
 
     # Check if unlocked and get encryption key
-    encryption_key = get_encryption_key(user_email)
+    encryption_key = await get_encryption_key(user_email)
     if not encryption_key:
         raise HTTPException(
             status_code=403,
@@ -161,13 +486,10 @@ async def get_key(
         raise HTTPException(status_code=404, detail="Key not found")
 
     # Decrypt password using stored encryption key
-    from cryptography.fernet import Fernet
-    import base64
-
     try:
-        fernet = Fernet(encryption_key)
-        encrypted_bytes = base64.urlsafe_b64decode(key.encrypted_password.encode())
-        decrypted_password = fernet.decrypt(encrypted_bytes).decode()
+        decrypted_password = await run_cpu(
+            fernet_decrypt, encryption_key, key.encrypted_password
+        )
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Failed to decrypt password: {str(e)}"
@@ -248,7 +570,7 @@ async def create_key(
     Create a new key. Requires user to be unlocked.
     """
     # Check if unlocked and get encryption key
-    encryption_key = get_encryption_key(user_email)
+    encryption_key = await get_encryption_key(user_email)
     if not encryption_key:
         raise HTTPException(
             status_code=403,
@@ -256,12 +578,7 @@ async def create_key(
         )
 
     # Encrypt the password using stored encryption key
-    from cryptography.fernet import Fernet
-    import base64
-
-    fernet = Fernet(encryption_key)
-    encrypted = fernet.encrypt(request.password.encode())
-    encrypted_password = base64.urlsafe_b64encode(encrypted).decode()
+    encrypted_password = await run_cpu(fernet_encrypt, encryption_key, request.password)
 
     # Create new key
     key_id = str(uuid.uuid4())
@@ -295,7 +612,7 @@ async def update_key(
     Update a key. Requires user to be unlocked.
     """
     # Check if unlocked and get encryption key
-    encryption_key = get_encryption_key(user_email)
+    encryption_key = await get_encryption_key(user_email)
     if not encryption_key:
         raise HTTPException(
             status_code=403,
@@ -317,12 +634,9 @@ async def update_key(
         key.key = request.key
     if request.password is not None:
         # Encrypt the new password
-        from cryptography.fernet import Fernet
-        import base64
-
-        fernet = Fernet(encryption_key)
-        encrypted = fernet.encrypt(request.password.encode())
-        key.encrypted_password = base64.urlsafe_b64encode(encrypted).decode()
+        key.encrypted_password = await run_cpu(
+            fernet_encrypt, encryption_key, request.password
+        )
 
     key.updated_at = datetime.now()
     await db.commit()
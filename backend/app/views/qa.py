@@ -1,6 +1,9 @@
+import asyncio
+from contextlib import aclosing, asynccontextmanager
 from datetime import datetime
+import os
 import time
-from typing import Optional
+from typing import Coroutine, Optional
 import uuid
 from fastapi import (
     APIRouter,
@@ -11,18 +14,133 @@ from fastapi import (
     WebSocketDisconnect,
 )
 from pydantic import BaseModel
+from sqlalchemy import update
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, text
 
 from app import logger
+from app.utils.checkpoints import (
+    DONE,
+    FAILED,
+    INTERRUPTED,
+    STREAMING,
+    StreamCheckpoint,
+    checkpoints,
+)
+from app.utils.context import (
+    CONNECTION_HISTORY_CACHE_SIZE,
+    HistoryCache,
+    estimate_tokens,
+    fetch_recent_history,
+    fit_to_budget,
+    history_cache,
+)
 from app.utils.database import get_db
-from app.utils.llm import call_openai
+from app.utils.llm import LLM_MODEL, continuation_messages, get_provider
+from app.utils.metrics import (
+    llm_tokens,
+    qa_phase_duration,
+    ws_connections,
+    ws_query_duration,
+    ws_streams_in_flight,
+)
+from app.utils.persistence import message_writer
+from app.utils.scheduler import llm_user
+from app.utils.tracing import DEBUG, current_trace, trace_queries
+from app.utils.streaming import (
+    MAX_FLUSH_BYTES,
+    MAX_FLUSH_MS,
+    WS_FLUSH_BYTES,
+    WS_FLUSH_MS,
+    ChunkBuffer,
+    check_frame_format,
+    encode_frame,
+)
 from app.models.database import Conversation, Message
 from app.utils.utils import timer
+from app.utils.auth import get_user
 from app.views.auth import get_current_user_obj, verify_token, get_token_from_request
 
 qa_router = APIRouter()
 
+WS_MAX_CONCURRENT_QUERIES = int(os.getenv("WS_MAX_CONCURRENT_QUERIES", "4"))
+# Answers a user may have generating at once, across all their connections
+WS_MAX_ANSWERS_PER_USER = int(os.getenv("WS_MAX_ANSWERS_PER_USER", "8"))
+
+# Metric children resolved once so recording is a plain method call
+auth_seconds = qa_phase_duration.labels("auth")
+history_seconds = qa_phase_duration.labels("history")
+first_token_seconds = qa_phase_duration.labels("first_token")
+stream_seconds = qa_phase_duration.labels("stream")
+persist_seconds = qa_phase_duration.labels("persist")
+query_done_seconds = ws_query_duration.labels("done")
+query_cancelled_seconds = ws_query_duration.labels("cancelled")
+query_failed_seconds = ws_query_duration.labels("error")
+query_seconds = {
+    "done": query_done_seconds,
+    "cancelled": query_cancelled_seconds,
+    "error": query_failed_seconds,
+}
+input_tokens = llm_tokens.labels(LLM_MODEL, "input")
+output_tokens = llm_tokens.labels(LLM_MODEL, "output")
+
+# Query tasks running on every connection in this worker. On shutdown the
+# launcher calls drain_queries() before the server closes the sockets
+active_queries: set[asyncio.Task] = set()
+draining = False
+
+# Answers generating in this worker: user email -> query_id -> task. Kept
+# apart from the checkpoint store, which may evict an answer still running
+running_answers: dict[str, dict[str, asyncio.Task]] = {}
+
+
+def forget_answer(email: str, query_id: str, task: asyncio.Task):
+    answers = running_answers.get(email)
+    if answers and answers.get(query_id) is task:
+        del answers[query_id]
+        if not answers:
+            del running_answers[email]
+
+
+# [lock, number of answers holding or waiting for it] per conversation.
+# Shared by every connection, since an answer outlives the one that asked
+conversation_locks: dict[str, list] = {}
+
+
+@asynccontextmanager
+async def conversation_lock(conversation_id: str):
+    """Hold the conversation so its turns are answered one at a time."""
+    entry = conversation_locks.setdefault(conversation_id, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            del conversation_locks[conversation_id]
+
+
+async def drain_queries(timeout: float) -> int:
+    """
+    Refuse new queries and wait up to timeout seconds for the running ones
+    to finish streaming; cancel whatever is left. Returns how many were
+    cancelled.
+    """
+    global draining
+    draining = True
+    if active_queries:
+        logger.info(f"Draining {len(active_queries)} in-flight queries")
+        _, pending = await asyncio.wait(set(active_queries), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning(
+                f"Cancelled {len(pending)} queries still running after {timeout}s"
+            )
+            await asyncio.gather(*pending, return_exceptions=True)
+        return len(pending)
+    return 0
+
 
 class QaRequest(BaseModel):
     conversation_id: Optional[str] = None
@@ -40,253 +158,669 @@ async def qa(
     return JSONResponse(content={"message": "Deprecated"}, status_code=410)
 
 
-@qa_router.websocket("/ws")
-async def qa_websocket(websocket: WebSocket):
+async def save_message(message: Message):
+    """Hand a message to the write-behind writer."""
+    with persist_seconds.time():
+        await message_writer.enqueue(
+            message.id,
+            message.conversation_id,
+            message.role,
+            message.content,
+            message.created_at,
+        )
+
+
+async def update_message(conversation_id: str, message_id: str, content: str) -> bool:
     """
-    WebSocket endpoint for streaming QA responses.
-    Protocol:
-    - Client sends: { "type": "query", "conversation_id": "...", "message": "..." }
-    - Server sends chunks: { "type": "chunk", "query_id": "...", "content": "...", "conversation_id": "..." }
-    - Server sends done: { "type": "done", "query_id": "...", "content": "...", "conversation_id": "...", "created_at": "..." }
-    - Server sends error: { "type": "error", "query_id": "...", "content": "..." }
+    Rewrite a saved message's content, once its queued write has landed.
+    Returns False if there was no such row, e.g. the writer dropped it.
     """
-    await websocket.accept()
-
     from app.utils.database import SessionLocal
-    from app.models.database import User
 
+    await message_writer.flush_conversation(conversation_id)
     async with SessionLocal() as db:
-        try:
-            # Get authentication token from query params or cookie
-            token = None
-            if "token" in websocket.query_params:
-                token = websocket.query_params["token"]
-            elif "session_token" in websocket.cookies:
-                token = websocket.cookies["session_token"]
-
-            if not token:
-                await websocket.send_json(
-                    {"type": "error", "content": "Authentication required"}
-                )
-                await websocket.close()
-                return
+        result = await db.execute(
+            update(Message).where(Message.id == message_id).values(content=content)
+        )
+        await db.commit()
+    if not result.rowcount:
+        logger.warning(f"Message {message_id} was never saved; saving it again")
+    return bool(result.rowcount)
 
-            # Verify token and get user
-            try:
-                payload = verify_token(token)
-                email = payload["email"]
 
-                result = await db.execute(select(User).filter(User.email == email))
-                user = result.scalar_one_or_none()
-                if not user:
-                    raise HTTPException(status_code=404, detail="User not found")
-            except Exception as e:
-                await websocket.send_json(
-                    {"type": "error", "content": f"Authentication failed: {str(e)}"}
-                )
-                await websocket.close()
-                return
+def record_message(
+    cache: HistoryCache, conversation_id: str, version: datetime, message: Message
+):
+    """Keep the history cache in step with a message this handler just saved."""
+    entry = {"role": message.role, "content": message.content}
+    cache.append(conversation_id, version, message.created_at, entry)
 
-            # Main message loop - handle multiple queries on one connection
-            while True:
-                data = await websocket.receive_json()
-
-                if data.get("type") != "query":
-                    await websocket.send_json(
-                        {
-                            "type": "error",
-                            "content": "Invalid message type. Expected 'query'",
-                        }
-                    )
-                    continue
 
-                query_id = str(uuid.uuid4())
-                conversation_id = data.get("conversation_id") or str(uuid.uuid4())
-                message = data.get("message", "")
+class QaConnection:
+    """
+    One authenticated /ws connection. Each query runs as its own task, up to
+    WS_MAX_CONCURRENT_QUERIES at a time; frames from concurrent queries are
+    serialized through a single send lock. The answer itself is generated in
+    a separate task into a checkpoint, which the query task follows, so it
+    survives the connection and can be resumed from another one. A user has
+    at most WS_MAX_ANSWERS_PER_USER answers generating, however many
+    connections they open or drop. Answers on
+    the same conversation still run one after another so each turn sees the
+    previous one.
+    """
 
-                # Start timing for this query
-                query_start_time = time.time()
+    def __init__(self, websocket: WebSocket, user, cache: HistoryCache):
+        self.websocket = websocket
+        self.user = user
+        self.cache = cache
+        self.tasks: dict[str, asyncio.Task] = {}
+        self._send_lock = asyncio.Lock()
+        # Per-connection streaming options, negotiated with a "config" message
+        self.frame_format = "json"
+        self.flush_ms = WS_FLUSH_MS
+        self.flush_bytes = WS_FLUSH_BYTES
+        self.done_content = True
+
+    async def send(self, frame: dict, then_format: Optional[str] = None):
+        """
+        Send one frame. then_format switches the format for the frames after
+        this one, under the same lock so no frame goes out in between.
+        """
+        async with self._send_lock:
+            frame_format = self.frame_format
+            data = encode_frame(frame, frame_format)
+            if frame_format == "json":
+                await self.websocket.send_text(data)
+            else:
+                await self.websocket.send_bytes(data)
+            if then_format is not None:
+                self.frame_format = then_format
+
+    async def configure(self, data: dict):
+        """Apply streaming options sent by the client and echo the result."""
+        try:
+            frame_format = data.get("format", self.frame_format)
+            check_frame_format(frame_format)
+            flush_ms = int(data.get("flush_ms", self.flush_ms))
+            flush_bytes = int(data.get("flush_bytes", self.flush_bytes))
+            done_content = data.get("done_content", self.done_content)
+            if not isinstance(done_content, bool):
+                raise ValueError("done_content must be a boolean")
+            if not 0 <= flush_ms <= MAX_FLUSH_MS:
+                raise ValueError(f"flush_ms must be between 0 and {MAX_FLUSH_MS}")
+            if not 1 <= flush_bytes <= MAX_FLUSH_BYTES:
+                raise ValueError(f"flush_bytes must be between 1 and {MAX_FLUSH_BYTES}")
+        except (TypeError, ValueError) as e:
+            await self.error(f"Invalid config: {str(e)}")
+            return
+
+        self.flush_ms, self.flush_bytes = flush_ms, flush_bytes
+        self.done_content = done_content
+        # Reply in the old format so the client sees the switch take effect
+        await self.send(
+            {
+                "type": "config",
+                "format": frame_format,
+                "flush_ms": flush_ms,
+                "flush_bytes": flush_bytes,
+                "done_content": done_content,
+            },
+            then_format=frame_format,
+        )
+
+    async def error(self, content: str, query_id: Optional[str] = None):
+        frame = {"type": "error", "content": content}
+        if query_id:
+            frame["query_id"] = query_id
+        await self.send(frame)
+
+    async def run(self):
+        """Main message loop - dispatch queries and cancellations."""
+        try:
+            while True:
+                data = await self.websocket.receive_json()
+                message_type = data.get("type")
 
-                if not message:
-                    await websocket.send_json(
-                        {
-                            "type": "error",
-                            "query_id": query_id,
-                            "content": "Message is required",
-                        }
-                    )
+                if message_type == "config":
+                    await self.configure(data)
+                    continue
+
+                if message_type == "cancel":
+                    query_id = data.get("query_id")
+                    answer = running_answers.get(self.user.email, {}).get(query_id)
+                    if answer:
+                        # Stops the answer; whoever follows it is told
+                        answer.cancel()
+                    elif query_id in self.tasks:
+                        self.tasks[query_id].cancel()
+                    else:
+                        await self.error("Unknown query_id", query_id)
                     continue
 
-                try:
-                    uuid.UUID(conversation_id)
-                except ValueError:
-                    await websocket.send_json(
-                        {
-                            "type": "error",
-                            "query_id": query_id,
-                            "content": "Invalid conversation_id",
-                        }
+                if message_type not in ("query", "resume"):
+                    await self.error(
+                        "Invalid message type. "
+                        "Expected 'query', 'resume', 'cancel' or 'config'"
                     )
                     continue
 
-                # Validate entities
-                for entity in data.get("entities", []):
-                    start, end, entity_id = entity["start"], entity["end"], entity["id"]
-                    extracted_message = message[start:end]
-                    if extracted_message != entity_id:
-                        await websocket.send_json(
-                            {
-                                "type": "error",
-                                "query_id": query_id,
-                                "content": f"Invalid entity: {extracted_message} != {entity_id}",
-                            }
-                        )
-                        continue
-
-                # Fetch conversation history
-                conversation = await db.get(Conversation, conversation_id)
-                messages = []
-                if conversation:
-                    if conversation.user_email != user.email or conversation.hidden:
-                        await websocket.send_json(
-                            {
-                                "type": "error",
-                                "query_id": query_id,
-                                "content": "Conversation not found",
-                            }
-                        )
-                        continue
-
-                    messages_result = await db.execute(
-                        select(Message)
-                        .filter(Message.conversation_id == conversation_id)
-                        .order_by(Message.created_at.asc())
+                if message_type == "resume" and not data.get("query_id"):
+                    await self.error("query_id is required to resume")
+                    continue
+                query_id = data.get("query_id") or str(uuid.uuid4())
+                if query_id in self.tasks:
+                    await self.error("Duplicate query_id", query_id)
+                    continue
+                if draining:
+                    await self.error(
+                        "Server is shutting down, reconnect and retry", query_id
                     )
-                    db_messages = messages_result.scalars().all()
-                    messages = [
-                        {"role": msg.role, "content": msg.content}
-                        for msg in db_messages
-                    ]
-
-                messages.append({"role": "user", "content": message})
-
-                # Create conversation if it doesn't exist
-                if not conversation:
-                    conversation = Conversation(
-                        id=conversation_id,
-                        user_email=user.email,
-                        title=message[:100],
+                    continue
+                if len(self.tasks) >= WS_MAX_CONCURRENT_QUERIES:
+                    await self.error(
+                        f"Too many concurrent queries (limit {WS_MAX_CONCURRENT_QUERIES})",
+                        query_id,
                     )
-                    db.add(conversation)
-                    await db.flush()
+                    continue
+
+                task = asyncio.create_task(self.run_query(query_id, data))
+                self.tasks[query_id] = task
+                active_queries.add(task)
+                task.add_done_callback(lambda _, q=query_id: self.tasks.pop(q, None))
+                task.add_done_callback(active_queries.discard)
+        finally:
+            # Stop following; the answers keep generating for a resume
+            for task in list(self.tasks.values()):
+                task.cancel()
+            await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+
+    async def run_query(self, query_id: str, data: dict):
+        start = time.perf_counter()
+        # Each query task has its own context; queue LLM calls under this user
+        llm_user.set(self.user.email)
+        try:
+            with trace_queries("ws", query_id):
+                if data.get("type") == "resume":
+                    outcome = await self.handle_resume(query_id, data)
+                else:
+                    outcome = await self.handle_query(query_id, data)
+            query_seconds[outcome].observe(time.perf_counter() - start)
+        except asyncio.CancelledError:
+            query_cancelled_seconds.observe(time.perf_counter() - start)
+            logger.info(f"WebSocket query {query_id} cancelled")
+            try:
+                await self.send({"type": "cancelled", "query_id": query_id})
+            except Exception:
+                pass
+        except WebSocketDisconnect:
+            pass
+        except Exception as e:
+            query_failed_seconds.observe(time.perf_counter() - start)
+            logger.error(f"WebSocket query {query_id} failed: {str(e)}")
+            try:
+                await self.error(f"Error: {str(e)}", query_id)
+            except Exception:
+                pass
+
+    async def handle_query(self, query_id: str, data: dict) -> str:
+        conversation_id = data.get("conversation_id") or str(uuid.uuid4())
+        message = data.get("message", "")
 
-                # Save user message to database
-                user_tsv_result = await db.execute(
-                    text("SELECT to_tsvector('english', :content)"),
-                    {"content": message},
+        if not message:
+            await self.error("Message is required", query_id)
+            return "error"
+
+        try:
+            uuid.UUID(conversation_id)
+        except ValueError:
+            await self.error("Invalid conversation_id", query_id)
+            return "error"
+
+        # Validate entities
+        for entity in data.get("entities", []):
+            start, end, entity_id = entity["start"], entity["end"], entity["id"]
+            extracted_message = message[start:end]
+            if extracted_message != entity_id:
+                await self.error(
+                    f"Invalid entity: {extracted_message} != {entity_id}", query_id
                 )
-                user_tsv = user_tsv_result.scalar()
-
-                user_message = Message(
-                    id=str(uuid.uuid4()),
-                    conversation_id=conversation_id,
-                    role="user",
-                    content=message,
-                    content_tsv=user_tsv,
-                    created_at=datetime.now(),
+                return "error"
+
+        if not await self.admit_answer(query_id):
+            return "error"
+        checkpoint = checkpoints.create(query_id, self.user.email, conversation_id)
+        self.start_generation(checkpoint, self.answer(checkpoint, message))
+        return await self.follow(checkpoint)
+
+    async def handle_resume(self, query_id: str, data: dict) -> str:
+        """
+        Send the chunks of an answer after last_seq (or the text after a byte
+        offset), then follow it. An interrupted answer is generated on from
+        its partial text.
+        """
+        checkpoint = checkpoints.get(query_id, self.user.email)
+        if checkpoint is None:
+            await self.error("Nothing to resume for query_id", query_id)
+            return "error"
+        try:
+            if "last_seq" in data:
+                offset, text = None, ""
+                seq = int(data["last_seq"])
+                if not 0 <= seq <= checkpoint.seq:
+                    raise ValueError(seq)
+            else:
+                offset, seq, text = checkpoint.since(int(data.get("offset", 0)))
+        except (TypeError, ValueError):
+            await self.error("Invalid last_seq or offset", query_id)
+            return "error"
+
+        resumed = {
+            "type": "resumed",
+            "query_id": query_id,
+            "conversation_id": checkpoint.conversation_id,
+            "seq": seq,
+        }
+        if offset is not None:
+            resumed["offset"] = offset
+        await self.send(resumed)
+        if text:
+            await self.send_chunk(checkpoint, text, seq)
+
+        answers = running_answers.get(self.user.email, {})
+        if checkpoint.status == INTERRUPTED and query_id not in answers:
+            if not await self.admit_answer(query_id):
+                return "error"
+            self.start_generation(checkpoint, self.continue_answer(checkpoint))
+        return await self.follow(checkpoint, seq)
+
+    async def admit_answer(self, query_id: str) -> bool:
+        """Check the user's answers in progress on every connection."""
+        answers = running_answers.get(self.user.email, {})
+        if query_id in answers:
+            await self.error("Duplicate query_id", query_id)
+            return False
+        if len(answers) >= WS_MAX_ANSWERS_PER_USER:
+            await self.error(
+                f"Too many answers in progress (limit {WS_MAX_ANSWERS_PER_USER})",
+                query_id,
+            )
+            return False
+        return True
+
+    def start_generation(self, checkpoint: StreamCheckpoint, answer: Coroutine):
+        """
+        Run answer in its own task, which outlives this connection, once the
+        conversation's previous answers are done.
+        """
+        email, query_id = self.user.email, checkpoint.query_id
+        checkpoint.restart()
+        task = asyncio.create_task(self.generation(checkpoint, answer))
+        running_answers.setdefault(email, {})[query_id] = task
+        active_queries.add(task)
+        task.add_done_callback(active_queries.discard)
+        task.add_done_callback(lambda _: forget_answer(email, query_id, task))
+
+    async def generation(self, checkpoint: StreamCheckpoint, answer: Coroutine):
+        query_id = checkpoint.query_id
+        try:
+            async with conversation_lock(checkpoint.conversation_id):
+                await answer
+        except asyncio.CancelledError:
+            logger.info(f"WebSocket query {query_id} cancelled")
+            # Cancelled before it got to the model
+            if checkpoint.status == STREAMING:
+                checkpoint.cancelled = True
+                checkpoint.finish(FAILED)
+            raise
+        except Exception as e:
+            logger.error(f"WebSocket query {query_id} failed: {str(e)}")
+            if checkpoint.status == STREAMING:
+                checkpoint.fail(f"Error: {str(e)}")
+
+    async def follow(self, checkpoint: StreamCheckpoint, seq: int = 0) -> str:
+        """
+        Send the answer's chunks after seq as they arrive, then how it ended.
+        Returns "done", "cancelled" or "error".
+        """
+        position = None
+        while True:
+            version = checkpoint.version
+            status = checkpoint.status
+            if status == STREAMING and checkpoint.position != position:
+                position = checkpoint.position
+                await self.send(
+                    {
+                        "type": "queued",
+                        "query_id": checkpoint.query_id,
+                        "conversation_id": checkpoint.conversation_id,
+                        "position": position,
+                    }
                 )
-                db.add(user_message)
-                await db.commit()
-
-                # Stream OpenAI response
-                full_response = ""
-                try:
-                    stream = await call_openai(
-                        model="gpt-5-nano",
-                        messages=messages,
-                        stream=True,
-                        reasoning={"effort": "minimal"},
+            chunks = checkpoint.chunks_after(seq)
+            if chunks:
+                seq = await self.send_chunks(checkpoint, chunks)
+            if status != STREAMING:
+                break
+            await checkpoint.wait(version)
+
+        if status == DONE:
+            await self.done(checkpoint)
+            return "done"
+        if checkpoint.cancelled:
+            await self.send({"type": "cancelled", "query_id": checkpoint.query_id})
+            return "cancelled"
+        frame = {
+            "type": "error",
+            "query_id": checkpoint.query_id,
+            "content": checkpoint.error or "Answer interrupted",
+        }
+        if status == INTERRUPTED:
+            frame.update(resumable=True, offset=checkpoint.size, seq=checkpoint.seq)
+        await self.send(frame)
+        return "error"
+
+    async def send_chunks(
+        self, checkpoint: StreamCheckpoint, chunks: list[tuple[int, str]]
+    ) -> int:
+        """
+        Send chunks, joining ones that piled up into frames of about
+        flush_bytes of UTF-8 text. Returns the seq of the last one.
+        """
+        batch, size = [], 0
+        for seq, text in chunks:
+            batch.append(text)
+            size += len(text.encode())
+            if size >= self.flush_bytes:
+                await self.send_chunk(checkpoint, "".join(batch), seq)
+                batch, size = [], 0
+        if batch:
+            await self.send_chunk(checkpoint, "".join(batch), seq)
+        return seq
+
+    async def send_chunk(self, checkpoint: StreamCheckpoint, text: str, seq: int):
+        await self.send(
+            {
+                "type": "chunk",
+                "query_id": checkpoint.query_id,
+                "content": text,
+                "conversation_id": checkpoint.conversation_id,
+                "seq": seq,
+            }
+        )
+
+    async def continue_answer(self, checkpoint: StreamCheckpoint):
+        request = continuation_messages(checkpoint.messages, checkpoint.text())
+        await self.generate(checkpoint, request)
+
+    async def answer(self, checkpoint: StreamCheckpoint, message: str):
+        from app.utils.database import SessionLocal
+
+        conversation_id = checkpoint.conversation_id
+        cache = self.cache
+        history_start = time.perf_counter()
+        async with SessionLocal() as db:
+            # Fetch conversation history; populate_existing refreshes
+            # updated_at so writes from other connections are noticed
+            conversation = await db.get(
+                Conversation, conversation_id, populate_existing=True
+            )
+            messages = []
+            version = None
+            if conversation:
+                if conversation.user_email != self.user.email or conversation.hidden:
+                    checkpoint.fail("Conversation not found")
+                    return
+
+                version = conversation.updated_at
+                pending = message_writer.pending(conversation_id) > 0
+                cached = cache.get(conversation_id, version, pending)
+                if cached:
+                    history, has_more = list(cached.messages), cached.has_more
+                    version = cached.version
+                else:
+                    if pending:
+                        # Our own queued messages must be visible to the reload.
+                        # Release the connection first: the writer needs one
+                        await db.commit()
+                        await message_writer.flush_conversation(conversation_id)
+                        await db.refresh(conversation)
+                        version = conversation.updated_at
+                    history, has_more = await fetch_recent_history(db, conversation_id)
+                    cache.put(conversation_id, version, history, has_more)
+
+                context = fit_to_budget(
+                    history,
+                    reserved_tokens=estimate_tokens(message),
+                    has_more=has_more,
+                )
+                if context.truncated:
+                    logger.info(
+                        f"Context for {conversation_id} truncated: "
+                        f"kept {len(context.messages)} messages "
+                        f"(~{context.tokens} tokens), dropped {context.dropped}, "
+                        f"older history omitted: {context.has_more}"
                     )
+                messages = context.messages
 
-                    async for event in stream:
-                        # Extract chunk from event based on OpenAI streaming format
-                        chunk = None
-
-                        if event.type == "response.created":
-                            # response created, send initial chunk
-                            continue
-                        elif event.type == "response.output_text.delta":
-                            chunk = event.delta
-                        else:
-                            continue
-
-                        if chunk:
-                            full_response += chunk
-                            await websocket.send_json(
-                                {
-                                    "type": "chunk",
-                                    "query_id": query_id,
-                                    "content": chunk,
-                                    "conversation_id": conversation_id,
-                                }
-                            )
-                except Exception as stream_error:
-                    await websocket.send_json(
-                        {
-                            "type": "error",
-                            "query_id": query_id,
-                            "content": f"Streaming error: {str(stream_error)}",
-                        }
-                    )
-                    continue
+            messages.append({"role": "user", "content": message})
 
-                # Save assistant message to database
-                assistant_tsv_result = await db.execute(
-                    text("SELECT to_tsvector('english', :content)"),
-                    {"content": full_response},
-                )
-                assistant_tsv = assistant_tsv_result.scalar()
-
-                assistant_message = Message(
-                    id=str(uuid.uuid4()),
-                    conversation_id=conversation_id,
-                    role="assistant",
-                    content=full_response,
-                    content_tsv=assistant_tsv,
-                    created_at=datetime.now(),
+            # Create conversation if it doesn't exist; this is the only
+            # write left on the request path, once per conversation
+            if not conversation:
+                conversation = Conversation(
+                    id=conversation_id,
+                    user_email=self.user.email,
+                    title=message[:100],
                 )
-                db.add(assistant_message)
+                db.add(conversation)
                 await db.commit()
+                # Until the writer catches up, the database stays at this version
+                version = conversation.updated_at
+                cache.put(conversation_id, version, [])
+        history_seconds.observe(time.perf_counter() - history_start)
+
+        # Queue user message for the background writer
+        user_message = Message(
+            id=str(uuid.uuid4()),
+            conversation_id=conversation_id,
+            role="user",
+            content=message,
+            created_at=datetime.now(),
+        )
+        await save_message(user_message)
+        record_message(cache, conversation_id, version, user_message)
+        version = user_message.created_at
+
+        checkpoint.messages = messages
+        await self.generate(checkpoint, messages, version)
+
+    async def generate(
+        self,
+        checkpoint: StreamCheckpoint,
+        messages: list[dict],
+        version: Optional[datetime] = None,
+    ):
+        """
+        Stream the answer to messages into the checkpoint, then save it. If
+        the stream fails or is cancelled, the text so far is saved and the
+        checkpoint is left to be resumed.
+        """
+
+        async def add_chunk(text: str):
+            checkpoint.append(text)
+
+        # Coalesce small deltas into fewer chunks, and so fewer frames
+        buffer = ChunkBuffer(add_chunk, self.flush_bytes, self.flush_ms / 1000)
+        stream_start = time.perf_counter()
+        first_token = None
+        ws_streams_in_flight.inc()
+        try:
+            events = get_provider().stream(
+                LLM_MODEL, messages, reasoning={"effort": "minimal"}
+            )
+            # aclosing aborts the upstream request if we stop reading early
+            async with aclosing(events):
+                async for event in events:
+                    if event.type == "delta":
+                        if first_token is None:
+                            first_token = time.perf_counter()
+                            first_token_seconds.observe(first_token - stream_start)
+                        await buffer.write(event.text)
+                    elif event.type == "queued":
+                        checkpoint.set_position(event.position)
+                    elif event.type == "done" and event.usage:
+                        input_tokens.inc(event.usage.get("input_tokens") or 0)
+                        output_tokens.inc(event.usage.get("output_tokens") or 0)
+            await buffer.flush()
+            if first_token is not None:
+                stream_seconds.observe(time.perf_counter() - first_token)
+        except asyncio.CancelledError:
+            await buffer.flush()
+            checkpoint.cancelled = True
+            await self.save_answer(checkpoint, version, INTERRUPTED)
+            raise
+        except Exception as stream_error:
+            await buffer.flush()
+            checkpoint.error = f"Streaming error: {str(stream_error)}"
+            await self.save_answer(checkpoint, version, INTERRUPTED)
+            return
+        finally:
+            ws_streams_in_flight.dec()
+            buffer.cancel()
+
+        await self.save_answer(checkpoint, version, DONE)
+
+    async def save_answer(
+        self, checkpoint: StreamCheckpoint, version: Optional[datetime], status: str
+    ):
+        """
+        Queue the answer so far as the assistant message and mark the
+        checkpoint. A resumed answer rewrites the partial message saved when
+        it was interrupted, keeping its place in the conversation.
+        """
+        content = checkpoint.text()
+        conversation_id = checkpoint.conversation_id
+        if checkpoint.message_id and await update_message(
+            conversation_id, checkpoint.message_id, content
+        ):
+            self.cache.invalidate(conversation_id)
+        elif content:
+            assistant_message = Message(
+                id=checkpoint.message_id or str(uuid.uuid4()),
+                conversation_id=conversation_id,
+                role="assistant",
+                content=content,
+                created_at=datetime.now(),
+            )
+            await save_message(assistant_message)
+            if version:
+                record_message(self.cache, conversation_id, version, assistant_message)
+            else:
+                self.cache.invalidate(conversation_id)
+            checkpoint.message_id = assistant_message.id
+        checkpoint.finish(status)
+
+    async def done(self, checkpoint: StreamCheckpoint):
+        # Clients that keep the streamed chunks can opt out of receiving the
+        # whole response a second time
+        done = {
+            "type": "done",
+            "query_id": checkpoint.query_id,
+            "conversation_id": checkpoint.conversation_id,
+            "created_at": datetime.now().isoformat(),
+        }
+        if self.done_content:
+            done["content"] = checkpoint.text()
+        if DEBUG:
+            done["db"] = current_trace().summary()
+        await self.send(done)
 
-                # Log timing for this query
-                query_end_time = time.time()
-                query_duration = query_end_time - query_start_time
-                logger.info(
-                    f"WebSocket query {query_id} took {query_duration:.4f} seconds"
-                )
 
-                # Send completion message
-                await websocket.send_json(
-                    {
-                        "type": "done",
-                        "query_id": query_id,
-                        "content": full_response,
-                        "conversation_id": conversation_id,
-                        "created_at": datetime.now().isoformat(),
-                    }
-                )
+@qa_router.websocket("/ws")
+async def qa_websocket(websocket: WebSocket):
+    """
+    WebSocket endpoint for streaming QA responses.
+    Several queries may be in flight on one connection; every frame carries
+    the query_id it belongs to.
+    Protocol:
+    - Client sends: { "type": "query", "query_id": "..." (optional), "conversation_id": "...", "message": "..." }
+    - Client sends: { "type": "cancel", "query_id": "..." } to abort an in-flight query
+    - Client sends: { "type": "resume", "query_id": "...", "last_seq": 12 } after reconnecting to
+      receive the chunks after seq 12, then the rest of the answer live; { ..., "offset": 1234 }
+      instead replays the text from that UTF-8 byte offset as one chunk. Answers keep generating
+      when the socket drops. An answer whose stream failed or was cancelled is generated on from
+      its partial text. Answers can be resumed for STREAM_CHECKPOINT_TTL seconds after they last
+      changed, on the worker that generated them
+    - Client sends: { "type": "config", "format": "json" | "msgpack", "flush_ms": 20, "flush_bytes": 1024, "done_content": true }
+      to tune chunk coalescing (flush_ms 0 sends every delta) and whether done repeats the
+      full response; the server replies with the effective config and uses the new format
+      from then on
+    - Server sends config: { "type": "config", "format": "...", "flush_ms": ..., "flush_bytes": ..., "done_content": ... }
+    - Server sends queued: { "type": "queued", "query_id": "...", "conversation_id": "...", "position": 3 }
+      while the query waits for the LLM scheduler (position 1 is next)
+    - Server sends chunks: { "type": "chunk", "query_id": "...", "content": "...", "conversation_id": "...", "seq": 12 }
+      seq is the number of the last chunk of the answer the frame contains
+    - Server sends done: { "type": "done", "query_id": "...", "content": "..." (unless done_content is false), "conversation_id": "...", "created_at": "..." }
+      With DEBUG set, done also carries "db": { "queries": ..., "time_ms": ..., "repeated": ... } for the query
+    - Server sends resumed: { "type": "resumed", "query_id": "...", "conversation_id": "...", "seq": 12, "offset": 1232 }
+      with the seq the replay follows on from, or for an offset resume, the offset it starts at (moved
+      back to a character boundary if needed) and the seq it runs up to
+    - Server sends cancelled: { "type": "cancelled", "query_id": "..." }
+    - Server sends error: { "type": "error", "query_id": "...", "content": "..." }
+      A stream that failed after retries adds "resumable": true, "offset" and "seq" of the text so far
+    """
+    await websocket.accept()
 
-        except WebSocketDisconnect:
-            logger.info("WebSocket disconnected")
+    from app.utils.database import SessionLocal
+
+    try:
+        # Get authentication token from query params or cookie
+        token = None
+        if "token" in websocket.query_params:
+            token = websocket.query_params["token"]
+        elif "session_token" in websocket.cookies:
+            token = websocket.cookies["session_token"]
+
+        if not token:
+            await websocket.send_json(
+                {"type": "error", "content": "Authentication required"}
+            )
+            await websocket.close()
+            return
+
+        # Verify token and get user
+        try:
+            with auth_seconds.time():
+                payload = verify_token(token)
+                email = payload["email"]
+
+                async with SessionLocal() as db:
+                    user = await get_user(email, db)
+            if not user:
+                raise HTTPException(status_code=404, detail="User not found")
         except Exception as e:
-            logger.error(f"WebSocket error: {str(e)}")
-            try:
-                await websocket.send_json(
-                    {"type": "error", "content": f"Error: {str(e)}"}
-                )
-            except:
-                pass
-            try:
-                await websocket.close()
-            except:
-                pass
+            await websocket.send_json(
+                {"type": "error", "content": f"Authentication failed: {str(e)}"}
+            )
+            await websocket.close()
+            return
+
+        cache = history_cache or HistoryCache(CONNECTION_HISTORY_CACHE_SIZE)
+        ws_connections.inc()
+        try:
+            await QaConnection(websocket, user, cache).run()
+        finally:
+            ws_connections.dec()
+
+    except WebSocketDisconnect:
+        logger.info("WebSocket disconnected")
+    except Exception as e:
+        logger.error(f"WebSocket error: {str(e)}")
+        try:
+            await websocket.send_json({"type": "error", "content": f"Error: {str(e)}"})
+        except:
+            pass
+        try:
+            await websocket.close()
+        except:
+            pass
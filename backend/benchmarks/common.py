@@ -0,0 +1,63 @@
+"""
+Shared helpers for the benchmark scripts.
+"""
+
+import json
+import os
+import resource
+import statistics
+import subprocess
+import time
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(samples: list[float]) -> dict:
+    """Latency summary in the units of the samples (milliseconds by convention)."""
+    if not samples:
+        return {"count": 0}
+    return {
+        "count": len(samples),
+        "p50": round(percentile(samples, 50), 3),
+        "p95": round(percentile(samples, 95), 3),
+        "p99": round(percentile(samples, 99), 3),
+        "mean": round(statistics.mean(samples), 3),
+        "max": round(max(samples), 3),
+    }
+
+
+def rss_bytes() -> int:
+    """Current resident set size of this process."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # Peak rather than current RSS, but better than nothing
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def git_revision() -> str:
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def write_results(name: str, results: dict, directory: str) -> str:
+    """Store results as JSON named after the benchmark, revision and time."""
+    os.makedirs(directory, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    path = os.path.join(directory, f"{name}-{results['revision']}-{stamp}.json")
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+    return path
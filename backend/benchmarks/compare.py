@@ -0,0 +1,65 @@
+"""
+Compare two benchmark result files produced by benchmarks/load.py.
+
+    python -m benchmarks.compare benchmarks/results/old.json benchmarks/results/new.json
+
+Prints per-phase changes in throughput and latency percentiles and exits with
+status 1 if any p99 latency regressed by more than --threshold percent.
+"""
+
+import argparse
+import json
+import sys
+
+METRICS = [
+    ("throughput", lambda p: p.get("throughput_rps", p.get("throughput_qps"))),
+    ("p50_ms", lambda p: p["latency_ms"].get("p50")),
+    ("p99_ms", lambda p: p["latency_ms"].get("p99")),
+    ("ttfc_p99_ms", lambda p: p.get("time_to_first_chunk_ms", {}).get("p99")),
+    ("db_queries", lambda p: p.get("db_queries_per_request")),
+]
+
+
+def change(old, new) -> str:
+    if old in (None, 0) or new is None:
+        return "n/a"
+    return f"{(new - old) / old * 100:+.1f}%"
+
+
+def main(args) -> int:
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    print(f"{old['revision']} -> {new['revision']}")
+    regressed = False
+    for phase, new_phase in new["phases"].items():
+        old_phase = old["phases"].get(phase)
+        if old_phase is None:
+            continue
+        print(f"\n{phase}")
+        for name, get in METRICS:
+            before, after = get(old_phase), get(new_phase)
+            if before is None and after is None:
+                continue
+            print(f"  {name:<12} {before!s:>12} {after!s:>12} {change(before, after):>9}")
+
+        old_p99, new_p99 = get_p99(old_phase), get_p99(new_phase)
+        if old_p99 and new_p99 and (new_p99 - old_p99) / old_p99 * 100 > args.threshold:
+            regressed = True
+            print(f"  REGRESSION: p99 up more than {args.threshold}%")
+
+    return 1 if regressed else 0
+
+
+def get_p99(phase: dict):
+    return phase["latency_ms"].get("p99")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=10.0)
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,314 @@
+"""
+End-to-end load benchmark for the FastAPI app.
+
+Starts create_app() in-process under uvicorn with the mock LLM provider,
+against the Postgres database in DATABASE_URL (use a scratch database), and
+drives /auth/login, /c/list, /c/{id}, /keys and many concurrent /ws streaming
+sessions. Reports throughput, p50/p95/p99 latency, time to first chunk,
+memory per WebSocket connection and DB queries per request, and stores the
+results as JSON so runs on different commits can be compared with
+benchmarks/compare.py.
+
+Run from the backend directory:
+    python -m benchmarks.load --sessions 1000 --queries-per-session 3
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+import uuid
+
+# The mock provider must be selected before the app modules read the env
+os.environ.setdefault("LLM_PROVIDER", "mock")
+
+import httpx
+import uvicorn
+import websockets
+from sqlalchemy import event
+
+from app import create_app
+from app.utils.database import engine
+from app.views.qa import WS_MAX_ANSWERS_PER_USER
+from benchmarks.common import rss_bytes, summarize, git_revision, write_results
+
+# Per-request INFO lines from @timer would dominate the run
+logging.getLogger().setLevel(logging.WARNING)
+
+PASSWORD = "bench-password"
+# Start of the error a query gets when its user is at WS_MAX_ANSWERS_PER_USER
+CAPPED_ERROR = "Too many answers in progress"
+
+
+class QueryCounter:
+    """Counts statements executed by the app's engine."""
+
+    def __init__(self):
+        self.count = 0
+        event.listen(engine.sync_engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+async def start_server(host: str, port: int) -> tuple[uvicorn.Server, asyncio.Task]:
+    config = uvicorn.Config(create_app(), host=host, port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.05)
+    return server, task
+
+
+async def ensure_users(client: httpx.AsyncClient, count: int) -> list[str]:
+    """Register (or log in) benchmark users and return their tokens."""
+    tokens = []
+    for i in range(count):
+        body = {"email": f"bench-load-{i}@example.com", "password": PASSWORD}
+        response = await client.post("/auth/register", json=body)
+        if response.status_code == 400:
+            response = await client.post("/auth/login", json=body)
+        response.raise_for_status()
+        tokens.append(response.json()["token"])
+    return tokens
+
+
+async def run_phase(name, requests: int, concurrency: int, call, counter) -> dict:
+    """Run `requests` calls of call(i) with bounded concurrency."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async def one(i):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                response = await call(i)
+                if response.status_code >= 400:
+                    errors += 1
+            except Exception:
+                errors += 1
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    queries_before = counter.count
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - start
+
+    result = {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "throughput_rps": round(requests / elapsed, 2),
+        "latency_ms": summarize(latencies),
+        "db_queries_per_request": round((counter.count - queries_before) / requests, 2),
+    }
+    print(f"{name}: {json.dumps(result)}")
+    return result
+
+
+async def ws_session(url: str, token: str, queries: int, ready, go, stats: dict):
+    """One streaming client: connect, wait for the start signal, run queries."""
+    conversation_id = str(uuid.uuid4())
+    signalled = False
+    try:
+        async with websockets.connect(f"{url}?token={token}", max_size=None) as ws:
+            signalled = True
+            ready()
+            await go.wait()
+            for i in range(queries):
+                start = time.perf_counter()
+                first_chunk = None
+                await ws.send(
+                    json.dumps(
+                        {
+                            "type": "query",
+                            "conversation_id": conversation_id,
+                            "message": f"benchmark question {i}",
+                        }
+                    )
+                )
+                while True:
+                    frame = json.loads(await ws.recv())
+                    if frame["type"] == "chunk" and first_chunk is None:
+                        first_chunk = time.perf_counter()
+                    elif frame["type"] == "done":
+                        break
+                    elif frame["type"] == "error":
+                        raise RuntimeError(frame["content"])
+                end = time.perf_counter()
+                stats["total"].append((end - start) * 1000)
+                if first_chunk is not None:
+                    stats["ttfc"].append((first_chunk - start) * 1000)
+    except Exception as e:
+        stats["errors"] += 1
+        stats["last_error"] = str(e)
+        if str(e).startswith(CAPPED_ERROR):
+            stats["capped"] += 1
+        if not signalled:
+            ready()
+
+
+async def run_ws_phase(url, tokens, sessions, queries, counter) -> dict:
+    stats = {"total": [], "ttfc": [], "errors": 0, "capped": 0, "last_error": None}
+    connected = 0
+    all_connected = asyncio.Event()
+    go = asyncio.Event()
+
+    def ready():
+        nonlocal connected
+        connected += 1
+        if connected == sessions:
+            all_connected.set()
+
+    rss_before = rss_bytes()
+    queries_before = counter.count
+    tasks = [
+        asyncio.create_task(
+            ws_session(url, tokens[i % len(tokens)], queries, ready, go, stats)
+        )
+        for i in range(sessions)
+    ]
+    await all_connected.wait()
+    # Includes the client side of each socket since both run in this process
+    memory_per_connection = (rss_bytes() - rss_before) / sessions
+
+    start = time.perf_counter()
+    go.set()
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+
+    completed = len(stats["total"])
+    result = {
+        "sessions": sessions,
+        "queries_per_session": queries,
+        "errors": stats["errors"],
+        "capped": stats["capped"],
+        "last_error": stats["last_error"],
+        "throughput_qps": round(completed / elapsed, 2),
+        "latency_ms": summarize(stats["total"]),
+        "time_to_first_chunk_ms": summarize(stats["ttfc"]),
+        "memory_per_connection_bytes": round(memory_per_connection),
+        "db_queries_per_request": round(
+            (counter.count - queries_before) / max(1, completed), 2
+        ),
+    }
+    print(f"ws: {json.dumps(result)}")
+    return result
+
+
+async def main(args):
+    # Each session has one answer in flight at a time, so spreading them over
+    # enough users keeps every user under WS_MAX_ANSWERS_PER_USER
+    users = max(args.users, math.ceil(args.sessions / WS_MAX_ANSWERS_PER_USER))
+    if users > args.users:
+        print(
+            f"using {users} users so {args.sessions} sessions stay within "
+            f"WS_MAX_ANSWERS_PER_USER={WS_MAX_ANSWERS_PER_USER}"
+        )
+        args.users = users
+
+    counter = QueryCounter()
+    server, serve_task = await start_server(args.host, args.port)
+    base_url = f"http://{args.host}:{args.port}"
+    limits = httpx.Limits(max_connections=args.concurrency)
+
+    try:
+        async with httpx.AsyncClient(base_url=base_url, limits=limits) as client:
+            tokens = await ensure_users(client, args.users)
+
+            def auth(i):
+                return {"Authorization": f"Bearer {tokens[i % len(tokens)]}"}
+
+            phases = {}
+            phases["login"] = await run_phase(
+                "login",
+                args.requests,
+                args.concurrency,
+                lambda i: client.post(
+                    "/auth/login",
+                    json={
+                        "email": f"bench-load-{i % args.users}@example.com",
+                        "password": PASSWORD,
+                    },
+                ),
+                counter,
+            )
+
+            phases["ws"] = await run_ws_phase(
+                f"ws://{args.host}:{args.port}/ws",
+                tokens,
+                args.sessions,
+                args.queries_per_session,
+                counter,
+            )
+            if phases["ws"]["capped"]:
+                raise RuntimeError(
+                    f"{phases['ws']['capped']} ws sessions hit the per-user answer "
+                    "cap; the results would not measure the intended load"
+                )
+
+            phases["list"] = await run_phase(
+                "list",
+                args.requests,
+                args.concurrency,
+                lambda i: client.get("/c/list", headers=auth(i)),
+                counter,
+            )
+
+            # Conversations created by the ws phase, one per user
+            conversation_ids = []
+            for i in range(len(tokens)):
+                response = await client.get("/c/list?limit=1", headers=auth(i))
+                conversations = response.json().get("conversations", [])
+                conversation_ids.append(conversations[0]["id"] if conversations else "")
+
+            phases["conversation"] = await run_phase(
+                "conversation",
+                args.requests,
+                args.concurrency,
+                lambda i: client.get(
+                    f"/c/{conversation_ids[i % len(tokens)]}", headers=auth(i)
+                ),
+                counter,
+            )
+
+            phases["keys"] = await run_phase(
+                "keys",
+                args.requests,
+                args.concurrency,
+                lambda i: client.get("/keys", headers=auth(i)),
+                counter,
+            )
+    finally:
+        # Runs the app's lifespan shutdown, which drains the message writer
+        server.should_exit = True
+        await serve_task
+
+    results = {
+        "benchmark": "load",
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": vars(args),
+        "phases": phases,
+    }
+    path = write_results("load", results, args.output)
+    print(f"results written to {path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--queries-per-session", type=int, default=3)
+    parser.add_argument("--output", default="benchmarks/results")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,114 @@
+"""
+Tune password hashing cost against login latency.
+
+For each candidate scheme and cost, measures the time of a single hash and
+the p50/p99 latency of a burst of concurrent logins pushed through a CPU pool
+and limiter sized like the app's (CRYPTO_WORKERS, PASSWORD_HASH_CONCURRENCY).
+Prints the most expensive setting whose burst p99 stays within the target,
+as env settings to paste into app/envs/.env.
+
+Needs no database. Run from the backend directory:
+    python -m benchmarks.passwords --logins 50 --target-p99-ms 500
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+from app.utils.auth import (
+    PASSWORD_HASH_CONCURRENCY,
+    check_password_hash,
+    make_password_hash,
+)
+from app.utils.executor import CRYPTO_WORKERS, CpuPool
+from benchmarks.common import git_revision, summarize, write_results
+
+CANDIDATES = [
+    ("scrypt", {"n": 8192}),
+    ("scrypt", {"n": 16384}),
+    ("scrypt", {"n": 32768}),
+    ("scrypt", {"n": 65536}),
+    ("pbkdf2_sha256", {"iterations": 200000}),
+    ("pbkdf2_sha256", {"iterations": 600000}),
+    ("pbkdf2_sha256", {"iterations": 1000000}),
+]
+
+ENV_NAMES = {"n": "SCRYPT_N", "iterations": "PBKDF2_ITERATIONS"}
+
+
+async def login_burst(stored: str, logins: int, pool: CpuPool, concurrency: int) -> list:
+    slots = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one():
+        start = time.perf_counter()
+        async with slots:
+            assert await pool.run(check_password_hash, "bench-password", stored)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    await asyncio.gather(*(one() for _ in range(logins)))
+    return latencies
+
+
+async def main(args):
+    pool = CpuPool("thread", workers=args.workers)
+    results = []
+    try:
+        for hasher, params in CANDIDATES:
+            stored = make_password_hash("bench-password", hasher, **params)
+            single = []
+            for _ in range(args.samples):
+                start = time.perf_counter()
+                check_password_hash("bench-password", stored)
+                single.append((time.perf_counter() - start) * 1000)
+            burst = await login_burst(stored, args.logins, pool, args.concurrency)
+            result = {
+                "hasher": hasher,
+                "params": params,
+                "single_ms": summarize(single),
+                "burst_ms": summarize(burst),
+            }
+            results.append(result)
+            print(
+                f"{hasher:<14} {json.dumps(params):<22} single p50 "
+                f"{result['single_ms']['p50']:>8.1f}ms  burst p99 "
+                f"{result['burst_ms']['p99']:>8.1f}ms"
+            )
+    finally:
+        pool.shutdown()
+
+    within = [r for r in results if r["burst_ms"]["p99"] <= args.target_p99_ms]
+    if within:
+        # Cost is what the attacker pays per guess; pick the slowest that fits
+        best = max(within, key=lambda r: r["single_ms"]["p50"])
+        settings = [f"PASSWORD_HASHER={best['hasher']}"] + [
+            f"{ENV_NAMES[k]}={v}" for k, v in best["params"].items()
+        ]
+        print(f"\nrecommended for p99 <= {args.target_p99_ms}ms: {' '.join(settings)}")
+    else:
+        print(f"\nno candidate meets p99 <= {args.target_p99_ms}ms at this burst size")
+
+    path = write_results(
+        "passwords",
+        {
+            "benchmark": "passwords",
+            "revision": git_revision(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "config": vars(args),
+            "candidates": results,
+        },
+        args.output,
+    )
+    print(f"results written to {path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--samples", type=int, default=10)
+    parser.add_argument("--logins", type=int, default=50, help="concurrent logins")
+    parser.add_argument("--workers", type=int, default=CRYPTO_WORKERS)
+    parser.add_argument("--concurrency", type=int, default=PASSWORD_HASH_CONCURRENCY)
+    parser.add_argument("--target-p99-ms", type=float, default=500)
+    parser.add_argument("--output", default="benchmarks/results")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,199 @@
+"""
+Benchmark for /c/search over a synthetic message corpus.
+
+Builds a corpus of conversations and messages (1M messages by default) in the
+database pointed to by DATABASE_URL, verifies that the search plan uses the
+GIN index instead of a sequential scan on messages, then runs a mix of
+queries and reports p50/p99 latency.
+
+Run from the backend directory against a scratch database:
+    python -m benchmarks.search --messages 1000000 --queries 500
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+
+from sqlalchemy import text
+
+from app.utils.database import engine, init_models
+from app.views.conversation import build_search_query
+from benchmarks.common import percentile
+
+PREFIX = "bench-search"
+
+# Skewed vocabulary so some terms are very common and others are rare
+VOCABULARY = """
+the model python error database query index latency token stream socket
+function class async await deploy server client request response cache
+memory thread process worker cluster replica shard vacuum analyze explain
+postgres sqlite redis kafka docker kubernetes nginx uvicorn fastapi react
+vite tailwind component state hook effect render router endpoint cookie
+password encryption fernet pbkdf2 scrypt hash salt secret jwt session
+migration schema table column foreign primary unique constraint trigger
+gin btree hash brin partial covering composite histogram percentile
+benchmark throughput regression profile flamegraph allocation garbage
+collector generator iterator coroutine semaphore mutex deadlock timeout
+retry backoff jitter circuit breaker queue batch buffer flush window
+recipe travel budget weather garden music history novel poem painting
+football chess astronomy volcano glacier rainforest desert ocean island
+""".split()
+
+
+async def build_corpus(users: int, conversations: int, messages: int, batch: int):
+    async with engine.begin() as conn:
+        await conn.execute(
+            text(
+                "INSERT INTO users (email, password_hash, salt, created_at, updated_at) "
+                "SELECT :prefix || '-user-' || g || '@example.com', '', '', now(), now() "
+                "FROM generate_series(1, :users) g ON CONFLICT DO NOTHING"
+            ),
+            {"prefix": PREFIX, "users": users},
+        )
+        await conn.execute(
+            text(
+                "INSERT INTO conversations "
+                "(id, user_email, title, hidden, created_at, updated_at) "
+                "SELECT :prefix || '-conv-' || g, "
+                ":prefix || '-user-' || (g % :users + 1) || '@example.com', "
+                "'Conversation ' || g, false, now(), now() - g * interval '1 second' "
+                "FROM generate_series(1, :conversations) g ON CONFLICT DO NOTHING"
+            ),
+            {"prefix": PREFIX, "users": users, "conversations": conversations},
+        )
+
+    for start in range(1, messages + 1, batch):
+        end = min(messages, start + batch - 1)
+        batch_start = time.perf_counter()
+        async with engine.begin() as conn:
+            await conn.execute(
+                text(
+                    "INSERT INTO messages (id, conversation_id, role, content, created_at) "
+                    "SELECT * FROM ("
+                    "  SELECT :prefix || '-msg-' || g AS id, "
+                    "  :prefix || '-conv-' || (g % :conversations + 1) AS conversation_id, "
+                    "  CASE WHEN g % 2 = 0 THEN 'user' ELSE 'assistant' END AS role, "
+                    "  (SELECT string_agg(("
+                    "     CAST(:vocabulary AS text[]))[1 + floor(power(random(), 3) "
+                    "     * :vocabulary_size)::int], ' ') "
+                    "   FROM generate_series(1, 8 + g % 40)) AS content, "
+                    "  now() - (:messages - g) * interval '1 second' AS created_at "
+                    "  FROM generate_series(:start, :end) g"
+                    ") corpus ON CONFLICT DO NOTHING"
+                ),
+                {
+                    "prefix": PREFIX,
+                    "conversations": conversations,
+                    "vocabulary": VOCABULARY,
+                    "vocabulary_size": len(VOCABULARY),
+                    "messages": messages,
+                    "start": start,
+                    "end": end,
+                },
+            )
+        print(
+            f"inserted messages {start}-{end} "
+            f"in {time.perf_counter() - batch_start:.2f}s"
+        )
+
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.execute(text("VACUUM ANALYZE messages"))
+        await conn.execute(text("VACUUM ANALYZE conversations"))
+
+
+async def corpus_size() -> int:
+    async with engine.connect() as conn:
+        result = await conn.execute(
+            text("SELECT count(*) FROM messages WHERE id LIKE :pattern"),
+            {"pattern": f"{PREFIX}-msg-%"},
+        )
+        return result.scalar()
+
+
+async def explain(email: str, q: str) -> str:
+    async with engine.connect() as conn:
+        compiled = build_search_query(email, q, 20).compile(dialect=conn.dialect)
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+        result = await conn.exec_driver_sql("EXPLAIN " + compiled.string, params)
+        return "\n".join(row[0] for row in result)
+
+
+async def run_queries(users: int, queries: int, limit: int) -> dict:
+    rng = random.Random(42)
+    latencies = []
+    async with engine.connect() as conn:
+        for _ in range(queries):
+            email = f"{PREFIX}-user-{rng.randint(1, users)}@example.com"
+            words = rng.sample(VOCABULARY, rng.choice([1, 1, 2, 3]))
+            q = " ".join(words)
+            start = time.perf_counter()
+            result = await conn.execute(build_search_query(email, q, limit))
+            result.all()
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    return {
+        "queries": queries,
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "mean_ms": round(statistics.mean(latencies), 3),
+        "max_ms": round(max(latencies), 3),
+    }
+
+
+async def cleanup():
+    async with engine.begin() as conn:
+        pattern = {"pattern": f"{PREFIX}-%"}
+        await conn.execute(text("DELETE FROM messages WHERE id LIKE :pattern"), pattern)
+        await conn.execute(
+            text("DELETE FROM conversations WHERE id LIKE :pattern"), pattern
+        )
+        await conn.execute(text("DELETE FROM users WHERE email LIKE :pattern"), pattern)
+
+
+async def main(args):
+    await init_models()
+    try:
+        existing = await corpus_size()
+        if existing < args.messages:
+            await build_corpus(args.users, args.conversations, args.messages, args.batch)
+        else:
+            print(f"reusing existing corpus of {existing} messages")
+
+        plan = await explain(f"{PREFIX}-user-1@example.com", VOCABULARY[0])
+        seq_scan = "Seq Scan on messages" in plan
+        print(plan)
+        if seq_scan:
+            print("WARNING: search plan uses a sequential scan on messages")
+
+        results = await run_queries(args.users, args.queries, args.limit)
+        results.update(
+            {
+                "messages": args.messages,
+                "users": args.users,
+                "conversations": args.conversations,
+                "seq_scan": seq_scan,
+            }
+        )
+        print(json.dumps(results, indent=2))
+    finally:
+        if args.cleanup:
+            await cleanup()
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--conversations", type=int, default=50_000)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--batch", type=int, default=100_000)
+    parser.add_argument(
+        "--cleanup", action="store_true", help="delete the corpus when done"
+    )
+    asyncio.run(main(parser.parse_args()))
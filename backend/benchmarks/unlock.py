@@ -0,0 +1,152 @@
+"""
+Streaming latency during a burst of /keys/unlock requests.
+
+Starts the app in-process with the mock LLM provider and keeps a set of /ws
+sessions streaming with coalescing disabled, so the gap between chunk frames
+shows how long the event loop was stalled. Each executor mode is measured in
+a quiet window and then while clients hammer /keys/unlock (100k-iteration
+PBKDF2 per call). With CRYPTO_EXECUTOR=inline the key derivation runs on the
+loop and the gaps grow with the burst; with a thread or process pool they
+should stay at the quiet baseline.
+
+Run from the backend directory against a scratch database:
+    python -m benchmarks.unlock --sessions 50 --burst 20 --duration 5
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+import uuid
+
+os.environ.setdefault("LLM_PROVIDER", "mock")
+os.environ.setdefault("MOCK_LLM_TOKENS_PER_SECOND", "200")
+
+import httpx
+import websockets
+
+from app.utils.executor import CpuPool, set_cpu_pool
+from benchmarks.common import git_revision, summarize, write_results
+from benchmarks.load import PASSWORD, ensure_users, start_server
+
+
+async def stream_client(url: str, token: str, stop: asyncio.Event, phase: dict, gaps: dict):
+    """Run queries back to back, recording the gap between chunk frames."""
+    async with websockets.connect(f"{url}?token={token}", max_size=None) as ws:
+        await ws.send(json.dumps({"type": "config", "flush_ms": 0, "done_content": False}))
+        await ws.recv()
+        conversation_id = str(uuid.uuid4())
+        while not stop.is_set():
+            await ws.send(
+                json.dumps(
+                    {
+                        "type": "query",
+                        "conversation_id": conversation_id,
+                        "message": "benchmark question",
+                    }
+                )
+            )
+            last = None
+            while True:
+                frame = json.loads(await ws.recv())
+                now = time.perf_counter()
+                if frame["type"] == "chunk":
+                    if last is not None:
+                        gaps[phase["name"]].append((now - last) * 1000)
+                    last = now
+                elif frame["type"] in ("done", "error"):
+                    break
+
+
+async def unlock_burst(client: httpx.AsyncClient, tokens, size: int, stop: asyncio.Event):
+    """Fire `size` concurrent unlocks at a time until stopped."""
+    latencies, errors = [], 0
+
+    async def one(i):
+        nonlocal errors
+        start = time.perf_counter()
+        response = await client.post(
+            "/keys/unlock",
+            json={"password": PASSWORD},
+            headers={"Authorization": f"Bearer {tokens[i % len(tokens)]}"},
+        )
+        if response.status_code != 200:
+            errors += 1
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    while not stop.is_set():
+        await asyncio.gather(*(one(i) for i in range(size)))
+    return latencies, errors
+
+
+async def measure(kind: str, args, client, tokens, ws_url) -> dict:
+    set_cpu_pool(CpuPool(kind, workers=args.workers))
+    phase = {"name": "quiet"}
+    gaps = {"quiet": [], "burst": []}
+    stop_streams = asyncio.Event()
+    streams = [
+        asyncio.create_task(
+            stream_client(ws_url, tokens[i % len(tokens)], stop_streams, phase, gaps)
+        )
+        for i in range(args.sessions)
+    ]
+
+    await asyncio.sleep(args.duration)
+    phase["name"] = "burst"
+    stop_burst = asyncio.Event()
+    burst = asyncio.create_task(unlock_burst(client, tokens, args.burst, stop_burst))
+    await asyncio.sleep(args.duration)
+    stop_burst.set()
+    unlock_latencies, unlock_errors = await burst
+    stop_streams.set()
+    await asyncio.gather(*streams, return_exceptions=True)
+
+    result = {
+        "chunk_gap_quiet_ms": summarize(gaps["quiet"]),
+        "chunk_gap_burst_ms": summarize(gaps["burst"]),
+        "unlock_latency_ms": summarize(unlock_latencies),
+        "unlock_errors": unlock_errors,
+    }
+    print(f"{kind}: {json.dumps(result)}")
+    return result
+
+
+async def main(args):
+    server, serve_task = await start_server(args.host, args.port)
+    ws_url = f"ws://{args.host}:{args.port}/ws"
+    try:
+        async with httpx.AsyncClient(
+            base_url=f"http://{args.host}:{args.port}", timeout=60
+        ) as client:
+            tokens = await ensure_users(client, args.users)
+            executors = {}
+            for kind in args.executors.split(","):
+                executors[kind] = await measure(kind, args, client, tokens, ws_url)
+    finally:
+        set_cpu_pool(None)
+        server.should_exit = True
+        await serve_task
+
+    results = {
+        "benchmark": "unlock",
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": vars(args),
+        "executors": executors,
+    }
+    print(f"results written to {write_results('unlock', results, args.output)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--burst", type=int, default=20, help="concurrent unlocks")
+    parser.add_argument("--duration", type=float, default=5, help="seconds per window")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--executors", default="inline,thread,process")
+    parser.add_argument("--output", default="benchmarks/results")
+    asyncio.run(main(parser.parse_args()))
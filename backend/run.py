@@ -1,9 +1,155 @@
+"""
+Start the API server.
+
+    python run.py                    # WEB_WORKERS processes (default: one per core)
+    python run.py --workers 1 --port 8000
+
+Every worker is its own process with its own event loop and connection pool
+of at most DB_POOL_SIZE + DB_MAX_OVERFLOW connections, so before binding the
+port the launcher checks that all workers together fit under the Postgres
+connection limit.
+
+On SIGTERM or SIGINT a worker stops accepting connections, refuses new /ws
+queries and lets the ones in flight finish streaming for up to
+SHUTDOWN_DRAIN_SECONDS. Only then are the sockets closed and the app shut
+down (queued messages flushed, engine disposed).
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+import sys
+import time
+
 import uvicorn
 
-from app import create_app
+from app import create_app, logger
+from app.utils.database import check_connection_budget, engine
+
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "0")) or os.cpu_count() or 1
+SHUTDOWN_DRAIN_SECONDS = float(os.getenv("SHUTDOWN_DRAIN_SECONDS", "30"))
+# A worker that dies is restarted after 1s, doubling on each crash up to this
+# many seconds; one that ran this long before dying starts over at 1s
+WORKER_RESTART_MAX_DELAY = float(os.getenv("WORKER_RESTART_MAX_DELAY", "60"))
 
 app = create_app()
 
 
+class DrainingServer(uvicorn.Server):
+    """uvicorn server that lets in-flight /ws queries finish before closing sockets."""
+
+    async def shutdown(self, sockets=None):
+        from app.views.qa import drain_queries
+
+        # uvicorn closes every open connection as soon as shutdown starts;
+        # stop listening first and give running answers time to complete
+        for server in self.servers:
+            server.close()
+        drain = asyncio.create_task(drain_queries(SHUTDOWN_DRAIN_SECONDS))
+        while not drain.done() and not self.force_exit:
+            await asyncio.sleep(0.1)
+        drain.cancel()
+        await super().shutdown(sockets)
+
+
+def make_config(host: str, port: int) -> uvicorn.Config:
+    return uvicorn.Config(
+        app, host=host, port=port, timeout_graceful_shutdown=SHUTDOWN_DRAIN_SECONDS
+    )
+
+
+def serve(sock, host: str, port: int):
+    """Worker process entry point: serve the shared listening socket."""
+    DrainingServer(make_config(host, port)).run(sockets=[sock])
+
+
+async def check_budget(workers: int):
+    try:
+        budget = await check_connection_budget(workers)
+    finally:
+        await engine.dispose()
+    logger.info(
+        f"Connection budget: {budget['required']} of {budget['available']} "
+        f"({workers} workers x {budget['per_worker']}), "
+        f"{budget['in_use_by_others']} used by other clients"
+    )
+    if budget["required"] + budget["in_use_by_others"] > budget["available"]:
+        logger.warning("Connections already in use leave too little room at peak load")
+
+
+def supervise(host: str, port: int, workers: int):
+    """
+    Run `workers` server processes on one socket, replacing any that die,
+    with a growing delay while a worker keeps crashing.
+    """
+    sock = make_config(host, port).bind_socket()
+    spawn = multiprocessing.get_context("spawn")
+    stopping = False
+
+    def start_worker():
+        process = spawn.Process(target=serve, args=(sock, host, port))
+        process.start()
+        return process
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    # Per worker slot: its process (None while waiting to restart), when it
+    # started, its consecutive quick crashes and when it may start again
+    processes = [start_worker() for _ in range(workers)]
+    started = [time.monotonic()] * workers
+    crashes = [0] * workers
+    restart_at = [0.0] * workers
+    logger.info(f"Started {workers} workers on {host}:{port}")
+    while not stopping:
+        now = time.monotonic()
+        for i, process in enumerate(processes):
+            if process is None:
+                if now >= restart_at[i]:
+                    processes[i], started[i] = start_worker(), now
+            elif not process.is_alive() and not stopping:
+                if now - started[i] >= WORKER_RESTART_MAX_DELAY:
+                    crashes[i] = 0
+                delay = min(2.0 ** crashes[i], WORKER_RESTART_MAX_DELAY)
+                crashes[i] += 1
+                logger.error(
+                    f"Worker {process.pid} exited with code {process.exitcode}, "
+                    f"restarting in {delay:.0f}s"
+                )
+                processes[i], restart_at[i] = None, now + delay
+        time.sleep(0.5)
+
+    # Ctrl-C already reached the workers through the process group; a SIGTERM
+    # to the launcher alone is passed on here. Each worker drains on its own
+    processes = [process for process in processes if process is not None]
+    for process in processes:
+        if process.is_alive():
+            os.kill(process.pid, signal.SIGTERM)
+    for process in processes:
+        process.join()
+    sock.close()
+
+
 if __name__ == "__main__":
-    uvicorn.run("run:app", host="0.0.0.0", port=8000, reload=False)
+    parser = argparse.ArgumentParser(description="Start the API server.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=WEB_WORKERS)
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(check_budget(args.workers))
+    except ValueError as e:
+        logger.error(str(e))
+        sys.exit(1)
+
+    if args.workers == 1:
+        DrainingServer(make_config(args.host, args.port)).run()
+    else:
+        supervise(args.host, args.port, args.workers)
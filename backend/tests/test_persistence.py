@@ -0,0 +1,85 @@
+"""
+Tests for the write-behind message writer. Run from the backend directory:
+
+    python -m pytest tests
+"""
+
+import asyncio
+from datetime import datetime
+
+from app.utils.persistence import MessageWriter
+
+
+def test_cancelled_enqueue_does_not_block_flush_conversation():
+    async def scenario():
+        # No writer task, so the one-slot queue stays full
+        writer = MessageWriter(maxsize=1)
+        await writer.enqueue("m1", "other", "user", "hi", datetime.now())
+
+        blocked = asyncio.create_task(
+            writer.enqueue("m2", "c1", "user", "hi", datetime.now())
+        )
+        await asyncio.sleep(0.01)
+        assert writer.pending("c1") == 1
+        blocked.cancel()
+        await asyncio.gather(blocked, return_exceptions=True)
+
+        assert writer.pending("c1") == 0
+        await asyncio.wait_for(writer.flush_conversation("c1"), 1)
+
+    asyncio.run(scenario())
+
+
+def test_messages_are_held_while_the_database_is_unreachable(monkeypatch):
+    from sqlalchemy import exc
+
+    from app.utils import persistence
+
+    monkeypatch.setattr(persistence, "WRITER_RETRY_DELAY", 0.05)
+
+    class FlakyWriter(MessageWriter):
+        def __init__(self):
+            super().__init__(max_delay=0)
+            self.outage = True
+            self.rows = []
+
+        async def _insert(self, batch):
+            if self.outage:
+                raise exc.OperationalError("INSERT", {}, OSError("connection refused"))
+            self.rows.extend(batch)
+
+    async def scenario():
+        writer = FlakyWriter()
+        writer.start()
+        await writer.enqueue("m1", "c1", "assistant", "hi", datetime.now())
+        await writer.flush()
+        assert writer.stats()["held"] == 1
+        assert writer.pending("c1") == 1
+
+        writer.outage = False
+        await asyncio.wait_for(writer.flush_conversation("c1"), 5)
+        assert [row["id"] for row in writer.rows] == ["m1"]
+        assert writer.stats()["dropped"] == 0
+        await writer.stop()
+
+    asyncio.run(scenario())
+
+
+def test_rejected_rows_are_dropped_and_counted():
+    from sqlalchemy import exc
+
+    class StrictWriter(MessageWriter):
+        async def _insert(self, batch):
+            if any(row["id"] == "bad" for row in batch):
+                raise exc.IntegrityError("INSERT", {}, Exception("violates fk"))
+
+    async def scenario():
+        writer = StrictWriter(max_delay=0)
+        writer.start()
+        await writer.enqueue("bad", "c1", "user", "hi", datetime.now())
+        await asyncio.wait_for(writer.flush_conversation("c1"), 5)
+        stats = writer.stats()
+        assert (stats["held"], stats["dropped"], stats["written"]) == (0, 1, 0)
+        await writer.stop()
+
+    asyncio.run(scenario())
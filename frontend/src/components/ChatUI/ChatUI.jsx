@@ -10,6 +10,11 @@ import { useScrollToBottom } from "../common/hooks";
 export default function ChatUI() {
   const [conversations, setConversations] = useState([]);
   const [loadingList, setLoadingList] = useState(false);
+  // Cursor for the next, older page of /c/list; null once everything is loaded
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const loadingMoreRef = useRef(false);
+  const loadedOlderPagesRef = useRef(false);
   const [selectedConvId, setSelectedConvId] = useState(null);
   const [messages, setMessages] = useState([]);
   const [loadingConv, setLoadingConv] = useState(false);
@@ -174,18 +179,35 @@ export default function ChatUI() {
     }
   }
 
+  async function fetchConversationPage(cursor) {
+    const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : "";
+    const res = await fetch(`${API_BASE}/c/list${query}`, {
+      method: "GET",
+      credentials: "include", // Send cookies for authentication
+    });
+    if (!res.ok) throw new Error(`Failed to fetch list: ${res.status}`);
+    const data = await res.json();
+    // Expecting { conversations: [{ id, title, updated_at, snippet }], next_cursor }
+    return {
+      page: Array.isArray(data.conversations) ? data.conversations : [],
+      cursor: data.next_cursor || null,
+    };
+  }
+
   async function loadConversationList() {
     setLoadingList(true);
     setError(null);
     try {
-      const res = await fetch(`${API_BASE}/c/list`, { 
-        method: "GET",
-        credentials: "include", // Send cookies for authentication
-      });
-      if (!res.ok) throw new Error(`Failed to fetch list: ${res.status}`);
-      const data = await res.json();
-      // Expecting an array of metadata dicts { id, title, updated_at, snippet }
-      setConversations(Array.isArray(data) ? data : []);
+      const { page, cursor } = await fetchConversationPage(null);
+      if (loadedOlderPagesRef.current) {
+        // Refresh the newest conversations but keep the older pages already
+        // loaded; anything pushed off the first page is still among them
+        const ids = new Set(page.map((c) => c.id));
+        setConversations((prev) => [...page, ...prev.filter((c) => !ids.has(c.id))]);
+      } else {
+        setConversations(page);
+        setNextCursor(cursor);
+      }
     } catch (err) {
       console.error(err);
       setError("Could not load conversations");
@@ -194,6 +216,27 @@ export default function ChatUI() {
     }
   }
 
+  async function loadMoreConversations() {
+    if (!nextCursor || loadingMoreRef.current) return;
+    loadingMoreRef.current = true;
+    setLoadingMore(true);
+    try {
+      const { page, cursor } = await fetchConversationPage(nextCursor);
+      loadedOlderPagesRef.current = true;
+      setConversations((prev) => {
+        const ids = new Set(prev.map((c) => c.id));
+        return [...prev, ...page.filter((c) => !ids.has(c.id))];
+      });
+      setNextCursor(cursor);
+    } catch (err) {
+      console.error(err);
+      setError("Could not load more conversations");
+    } finally {
+      loadingMoreRef.current = false;
+      setLoadingMore(false);
+    }
+  }
+
   async function loadConversation(convId) {
     if (!convId) return;
     // cancel existing
@@ -352,6 +395,9 @@ export default function ChatUI() {
         onNewChat={handleNewChat}
         onSelectConversation={handleSelectConversation}
         loading={loadingList}
+        hasMore={!!nextCursor}
+        loadingMore={loadingMore}
+        onLoadMore={loadMoreConversations}
         searchTerm={searchTerm}
         setSearchTerm={setSearchTerm}
         onOpenSettings={() => setShowSettings(true)}
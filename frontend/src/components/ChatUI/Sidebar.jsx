@@ -8,6 +8,9 @@ export default function Sidebar({
   onNewChat,
   onSelectConversation,
   loading,
+  hasMore,
+  loadingMore,
+  onLoadMore,
   searchTerm,
   setSearchTerm,
   onOpenSettings,
@@ -22,6 +25,14 @@ export default function Sidebar({
     return (c.title?.toLowerCase().includes(q)) || (c.snippet?.toLowerCase().includes(q));
   });
 
+  // Fetch the next page of conversations when the list is scrolled near its end
+  function handleListScroll(e) {
+    const el = e.currentTarget;
+    if (hasMore && el.scrollHeight - el.scrollTop - el.clientHeight < 200) {
+      onLoadMore();
+    }
+  }
+
   // Close dropdown when clicking outside
   useEffect(() => {
     function handleClickOutside(event) {
@@ -63,7 +74,7 @@ export default function Sidebar({
         </div>
       </div>
 
-      <div className="flex-1 overflow-y-auto">
+      <div className="flex-1 overflow-y-auto" onScroll={handleListScroll}>
         {loading ? (
           <div className="p-4 text-sm text-gray-400 text-center">Loading conversations...</div>
         ) : filteredConversations.length === 0 ? (
@@ -88,6 +99,15 @@ export default function Sidebar({
             ))}
           </ul>
         )}
+        {!loading && hasMore && (
+          <button
+            onClick={onLoadMore}
+            disabled={loadingMore}
+            className="w-full px-3 py-2 mb-2 text-xs text-gray-400 hover:text-white transition-colors disabled:opacity-50"
+          >
+            {loadingMore ? "Loading..." : "Load more"}
+          </button>
+        )}
       </div>
 
       {/* User menu */}